@@ -1,5 +1,4 @@
 import os
-import yaml
 from adk import LlmAgent
 
 class BrandMonitoringAgent(LlmAgent):
@@ -7,19 +6,10 @@ class BrandMonitoringAgent(LlmAgent):
         # Model configuration
         model_name = os.environ.get("MODEL_NAME", "gemini-2.5-pro")
 
-        # Load prompts
-        persona_path = os.path.join(os.path.dirname(__file__), 'prompts', 'persona.yaml')
-        rules_path = os.path.join(os.path.dirname(__file__), 'prompts', 'rules.yaml')
-        instructions_path = os.path.join(os.path.dirname(__file__), 'prompts', 'instructions.yaml')
-        
-        with open(persona_path, 'r') as f:
-            persona_data = yaml.safe_load(f)
-        with open(rules_path, 'r') as f:
-            rules_data = yaml.safe_load(f)
-        with open(instructions_path, 'r') as f:
-            instructions_data = yaml.safe_load(f)
-            
-        combined_instructions = f"{persona_data['persona']}\n\n{rules_data['rules']}\n\n{instructions_data['instructions']}"
+        # Load prompts (shared with main.py, see prompt_bundle.py)
+        from config import BRAND
+        from prompt_bundle import agent_instructions
+        combined_instructions = agent_instructions(BRAND)
         
         from tools import search_social_media, search_financial_news, vertex_ai_search, store_in_bigquery
         from sentiment import analyze_sentiment
@@ -0,0 +1,234 @@
+"""Análisis estructurado: esquema JSON de la respuesta de Gemini y render local del reporte HTML."""
+import json
+import time
+import html
+import logging
+from typing import List, Dict, Any
+
+from vertexai.generative_models import GenerationConfig
+
+from prompt_bundle import report_usage
+from prompt_compaction import (ITEM_TOKEN_BUDGET, compact_mention, fit_prompt, count_tokens, record_usage,
+                               restore_links, strip_aliases)
+from ratelimit import LIMITER
+from deadline import run_with_timeout, request_timeout, submit, result_or, DeadlineExceeded
+
+# Verificación con grounding: solo para menciones relevantes sin texto local (ver enrichment.py)
+MAX_VERIFICATIONS = 3
+VERIFY_PROMPT = """Verifica con Google Search si esta noticia es real y reciente: "{title}" ({link}).
+Responde en la primera línea solo VERIFICADA o NO VERIFICADA, y en la segunda una frase de contexto."""
+
+STATES = ["Estable", "Alerta", "Crisis"]
+SEVERITIES = ["Baja", "Media", "Crítica"]
+SENTIMENTS = ["Positivo", "Neutro", "Negativo"]
+
+STATE_COLORS = {"Estable": "green", "Alerta": "#F9A825", "Crisis": "red"}
+SENTIMENT_COLORS = {"Positivo": "#00C853", "Neutro": "#607D8B", "Negativo": "#D32F2F"}
+
+# Esquema (subconjunto OpenAPI) que Vertex AI usa para restringir la salida del modelo
+ANALYSIS_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "state": {"type": "STRING", "enum": STATES},
+        "score": {"type": "INTEGER", "description": "Brand Health Index (0=Crisis, 100=Perfecto)"},
+        "analysis": {"type": "STRING", "description": "2-3 líneas de análisis experto"},
+        "recommendation": {"type": "STRING", "description": "1 línea de recomendación para la alta dirección"},
+        "tech_insight": {"type": "STRING", "description": "Perspectiva Tecnológica (Google Cloud)"},
+        "mentions": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {
+                    "ref": {"type": "INTEGER", "description": "Número de la referencia de la mención (R3 → 3)"},
+                    "tag": {"type": "STRING", "description": "Categoría, ej: FINANZAS, TECNOLOGÍA, LEGAL, SERVICIO"},
+                    "severity": {"type": "STRING", "enum": SEVERITIES},
+                    "sentiment": {"type": "STRING", "enum": SENTIMENTS},
+                    "summary": {"type": "STRING"},
+                },
+                "required": ["ref", "tag", "severity", "sentiment", "summary"],
+            },
+        },
+    },
+    "required": ["state", "score", "analysis", "recommendation", "tech_insight", "mentions"],
+}
+
+GENERATION_CONFIG = GenerationConfig(response_mime_type="application/json", response_schema=ANALYSIS_SCHEMA)
+
+
+def build_prompt(batch, date_str: str, item_tokens: int = ITEM_TOKEN_BUDGET) -> str:
+    """Parte dinámica de la solicitud: la fecha y las menciones con alias `[R1]` (ver prompt_compaction.py)."""
+    context_str = "".join(compact_mention(i, item, item_tokens) for i, item in enumerate(batch, 1))
+
+    # Solo la parte dinámica: el resto viaja en la instrucción de sistema (o en el context cache)
+    return f'''
+    Analiza las siguientes menciones NUEVAS recolectadas hoy {date_str}:
+    
+    {context_str}
+    '''
+
+
+def run_analysis(model, bundle, batch, date_str: str, recorder=None) -> Dict[str, Any]:
+    """Llama al modelo, registra el uso de tokens y devuelve el análisis validado."""
+    # El prompt se mide antes de enviarlo; si excede el máximo se recorta cada mención
+    prompt, prompt_tokens, item_tokens = fit_prompt(lambda budget: build_prompt(batch, date_str, budget),
+                                                    lambda text: count_tokens(model, text))
+    logging.info(f"📏 Prompt dinámico: {prompt_tokens} tokens para {len(batch)} menciones (≤{item_tokens} por mención)")
+    started = time.monotonic()
+    # Sin timeout propio en el SDK: se deja de esperar al agotarse la etapa (ver deadline.py)
+    response = LIMITER.call("vertex", lambda: run_with_timeout(
+        lambda: model.generate_content(prompt, generation_config=GENERATION_CONFIG), request_timeout()),
+        timeout=request_timeout())
+    usage = report_usage(response, bundle, time.monotonic() - started)
+    record_usage("analysis", response)
+    if recorder:
+        recorder.record("prompt", bundle=bundle.version, prompt=prompt, tokens=prompt_tokens, item_tokens=item_tokens)
+        recorder.record("response", text=response.text, usage=usage)
+
+    # Un JSON inválido o fuera de esquema es un error explícito (ya no un score 0 silencioso)
+    analysis = parse_analysis(response.text, len(batch))
+    apply_analysis(batch, analysis)
+    return analysis
+
+
+def verify_unenriched(batch, analysis: Dict[str, Any], search=None, limit: int = MAX_VERIFICATIONS, store=None) -> int:
+    """Verifica con grounding las menciones Críticas/Medias cuyo artículo no se pudo leer.
+
+    Marca `verified` (True/False) en las menciones del análisis revisadas y
+    devuelve cuántas se verificaron. Las consultas corren en paralelo dentro
+    del deadline vigente; las que no responden a tiempo quedan sin marcar.
+    Con `store` (ver mention_store.py) se reutilizan las verificaciones hechas
+    por cualquier marca y se guardan las nuevas.
+    """
+    if search is None:
+        from tools import vertex_ai_search as search
+    mentions = list(batch)
+    candidates = [m for m in sorted(analysis["mentions"], key=lambda m: -SEVERITIES.index(m["severity"]))
+                  if m["severity"] != "Baja" and not mentions[m["ref"] - 1].body][:limit]
+    known = store.verifications([mentions[m["ref"] - 1].link for m in candidates]) if store else {}
+    for m in candidates:
+        if mentions[m["ref"] - 1].link in known:
+            m["verified"] = known[mentions[m["ref"] - 1].link]
+    reused = len(candidates)
+    candidates = [m for m in candidates if "verified" not in m]
+    reused -= len(candidates)
+    if not candidates:
+        return reused
+
+    futures = [(m, submit(lambda item=mentions[m["ref"] - 1]: search(VERIFY_PROMPT.format(title=item.title, link=item.link))))
+               for m in candidates]
+    verified = {}
+    for m, future in futures:
+        try:
+            timeout = request_timeout()
+        except DeadlineExceeded:
+            timeout = 0
+        answer = result_or(future, timeout=timeout) or ""
+        first_line = answer.strip().splitlines()[0].upper() if answer.strip() else ""
+        if first_line.startswith("NO VERIFICADA"):
+            m["verified"] = False
+        elif first_line.startswith("VERIFICADA"):
+            m["verified"] = True
+        else:
+            continue
+        verified[mentions[m["ref"] - 1].link] = m["verified"]
+    if store:
+        store.save_verifications(verified)
+    logging.info(f"🔍 Verificación con grounding: {len(verified)}/{len(candidates)} menciones sin texto local revisadas"
+                 f"{f', {reused} reutilizadas de otra corrida' if reused else ''}.")
+    return len(verified) + reused
+
+
+def parse_analysis(text: str, mention_count: int) -> Dict[str, Any]:
+    """Valida la respuesta JSON del modelo. Lanza ValueError si no es utilizable."""
+    cleaned = (text or "").strip().removeprefix("```json").removeprefix("```").removesuffix("```").strip()
+    try:
+        data = json.loads(cleaned)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Respuesta del modelo no es JSON válido: {e}")
+
+    missing = [k for k in ANALYSIS_SCHEMA["required"] if k not in data]
+    if missing:
+        raise ValueError(f"Faltan campos en el análisis: {missing}")
+    if data["state"] not in STATES:
+        raise ValueError(f"Estado inválido: {data['state']}")
+    if not isinstance(data["score"], int) or not 0 <= data["score"] <= 100:
+        raise ValueError(f"Brand Health Index inválido: {data['score']}")
+
+    mentions, seen = [], set()
+    for m in data["mentions"]:
+        if not isinstance(m.get("ref"), int) or not 1 <= m["ref"] <= mention_count or m["ref"] in seen:
+            logging.warning(f"Mención con referencia inválida o repetida descartada: {m}")
+            continue
+        if m.get("severity") not in SEVERITIES or m.get("sentiment") not in SENTIMENTS:
+            logging.warning(f"Mención con severidad/sentimiento inválido descartada: {m}")
+            continue
+        if not all(isinstance(m.get(k), str) and m[k].strip() for k in ("tag", "summary")):
+            logging.warning(f"Mención sin tag o resumen descartada: {m}")
+            continue
+        seen.add(m["ref"])
+        mentions.append(m)
+    data["mentions"] = mentions
+    return data
+
+
+def apply_analysis(batch, analysis: Dict[str, Any]):
+    """Copia tag, severidad, sentimiento y resumen de cada mención analizada al lote."""
+    by_ref = {m["ref"]: m for m in analysis["mentions"]}
+    for name in ("tag", "severity", "sentiment"):
+        batch.assign(name, [by_ref.get(i, {}).get(name) for i in range(1, len(batch) + 1)])
+    # Los alias [R3] solo tienen sentido dentro del reporte de esta corrida
+    batch.assign("summary", [strip_aliases(by_ref.get(i, {}).get("summary")) for i in range(1, len(batch) + 1)])
+
+
+def render_report_html(analysis: Dict[str, Any], batch) -> str:
+    """Genera localmente el HTML del reporte (mismo formato que antes generaba el modelo)."""
+    mentions = list(batch)
+    links = {i: mention.link for i, mention in enumerate(mentions, 1)}
+    # Texto del modelo escapado, con los alias [R3] convertidos en enlaces reales (ver prompt_compaction.py)
+    e = lambda text: restore_links(html.escape(text), links)
+    items = []
+    for m in analysis["mentions"]:
+        mention = mentions[m["ref"] - 1]
+        color = SENTIMENT_COLORS[m["sentiment"]]
+        items.append(
+            f'<li><strong>[{e(m["tag"].upper())}]</strong> <strong>Mención:</strong> {e(m["summary"].rstrip("."))}. '
+            f'<strong>Sentimiento:</strong> <span style="color: {color};">{m["sentiment"]}</span>. '
+            + ('<em>(no verificada)</em> ' if m.get("verified") is False else '') +
+            f'<a href="{html.escape(mention.link)}" target="_blank">leer más</a></li>'
+        )
+
+    return f"""<p><strong>Estado General:</strong> <span style="color: {STATE_COLORS[analysis['state']]};">{analysis['state']}</span> | <strong>Brand Health Index:</strong> {analysis['score']}/100</p>
+<p><strong>Análisis:</strong> {e(analysis['analysis'])}</p>
+<p><strong>Recomendación:</strong> {e(analysis['recommendation'])}</p>
+<hr>
+<h4>Detalle de Menciones</h4>
+<ul>
+{chr(10).join(items)}
+</ul>
+
+<div class="tech-insight">
+    <strong>Perspectiva Tecnológica (Google Cloud):</strong> {e(analysis['tech_insight'])}
+</div>
+"""
+
+
+def render_fallback_html(batch, reason: str) -> str:
+    """Reporte degradado cuando el análisis no está disponible: lista las menciones sin analizar."""
+    e = html.escape
+    items = [f'<li>[{e(str(m.get("date") or "Fecha desc."))}] {e(m.title)}. '
+             f'<a href="{e(m.link)}" target="_blank">leer más</a></li>' for m in batch]
+    return f"""<p><strong>Estado General:</strong> <span style="color: #607D8B;">Sin análisis</span></p>
+<p><strong>Análisis:</strong> El análisis automático no estuvo disponible en esta ejecución ({e(reason)}). Se listan las menciones nuevas sin procesar; serán analizadas en la próxima ejecución.</p>
+<hr>
+<h4>Menciones Nuevas ({len(batch)})</h4>
+<ul>
+{chr(10).join(items)}
+</ul>
+"""
+
+
+def sentiment_counts(analysis: Dict[str, Any]) -> Dict[str, int]:
+    counts = {s: 0 for s in SENTIMENTS}
+    for m in analysis["mentions"]:
+        counts[m["sentiment"]] += 1
+    return counts
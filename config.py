@@ -7,16 +7,26 @@ import logging
 # Default a 'banco_chile' para desarrollo local
 CURRENT_BRAND_ID = os.environ.get("BRAND_ID", "banco_chile")
 
-def load_config():
-    try:
+_ALL_BRANDS = None
+
+def load_all_brands():
+    """Lee brands_config.yaml una sola vez por proceso."""
+    global _ALL_BRANDS
+    if _ALL_BRANDS is None:
         with open("brands_config.yaml", "r", encoding="utf-8") as f:
-            all_brands = yaml.safe_load(f)
+            _ALL_BRANDS = yaml.safe_load(f)
+    return _ALL_BRANDS
+
+def load_config(brand_id: str = None):
+    brand_id = brand_id or CURRENT_BRAND_ID
+    try:
+        all_brands = load_all_brands()
         
-        if CURRENT_BRAND_ID not in all_brands:
-            raise ValueError(f"❌ Error Fatal: BRAND_ID '{CURRENT_BRAND_ID}' no encontrado en brands_config.yaml")
+        if brand_id not in all_brands:
+            raise ValueError(f"❌ Error Fatal: BRAND_ID '{brand_id}' no encontrado en brands_config.yaml")
             
-        logging.info(f"📂 Configuración cargada para: {all_brands[CURRENT_BRAND_ID]['name']}")
-        return all_brands[CURRENT_BRAND_ID]
+        logging.info(f"📂 Configuración cargada para: {all_brands[brand_id]['name']}")
+        return all_brands[brand_id]
         
     except FileNotFoundError:
         logging.error("❌ No se encontró brands_config.yaml")
@@ -0,0 +1,238 @@
+"""Presupuesto de tiempo de la corrida (deadline) y solicitudes con cobertura (hedging).
+
+Cloud Run mata la tarea al cumplirse `--task-timeout`; sin un presupuesto
+explícito, una sola llamada lenta consumía todo el tiempo y el correo y las
+escrituras en memoria nunca ocurrían. La corrida crea un `Deadline` al inicio;
+cada etapa recibe una fracción del total y los timeouts de las llamadas se
+derivan del tiempo restante de la etapa en curso. Una reserva final queda
+siempre disponible para el correo y las escrituras en memoria.
+
+Las lecturas idempotentes y gratuitas (indicadores) usan `hedged`: si la
+primera solicitud supera el p95 observado, se lanza una segunda y gana la
+primera que responda. Las búsquedas de SerpApi no se cubren: cada solicitud
+de respaldo es una búsqueda pagada fuera del presupuesto de llamadas. Un Job
+hace pocas llamadas por upstream, así que las latencias observadas se
+guardan en Firestore (`latency_samples`) para que el p95 se ajuste entre
+ejecuciones.
+"""
+import os
+import time
+import logging
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from typing import Any, Callable, Dict, Optional
+
+TASK_TIMEOUT_SECONDS = float(os.environ.get("TASK_TIMEOUT_SECONDS", 300))
+SAFETY_MARGIN_SECONDS = 10  # Margen para logs y cierre antes de que Cloud Run mate la tarea
+FINAL_RESERVE_SHARE = 0.15  # Fracción reservada para el correo y las escrituras finales en memoria
+
+# Fracción del presupuesto total asignada a cada etapa de main.run_brand
+STAGE_SHARES = {"plan": 0.05, "search": 0.25, "dedup": 0.05, "enrich": 0.1, "analysis": 0.3, "report": 0.1}
+
+HEDGE_DEFAULT_DELAY = 3.0
+HEDGE_MIN_DELAY = 0.5
+HEDGE_MIN_SAMPLES = 20
+LATENCY_COLLECTION = "latency_samples"
+LATENCY_TIMEOUT_SECONDS = 5
+
+_POOL = ThreadPoolExecutor(max_workers=16, thread_name_prefix="deadline")
+_CURRENT: contextvars.ContextVar = contextvars.ContextVar("deadline", default=None)
+
+
+class DeadlineExceeded(TimeoutError):
+    """Se agotó el tiempo de la corrida o de la etapa."""
+
+
+class Deadline:
+    """Instante límite de la corrida (o de una etapa), con reserva para lo que viene después.
+
+    Usado como context manager, pasa a ser el deadline vigente para
+    `request_timeout`, `hedged` y `run_with_timeout`.
+    """
+
+    def __init__(self, seconds: float, name: str = "run", reserve: float = 0.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.name = name
+        self.total = seconds
+        self.reserve = reserve
+        self.clock = clock
+        self.started_at = clock()
+        self.expires_at = self.started_at + seconds
+        self._token = None
+
+    @classmethod
+    def for_task(cls) -> "Deadline":
+        """Deadline de la tarea de Cloud Run (TASK_TIMEOUT_SECONDS), con la reserva final."""
+        seconds = TASK_TIMEOUT_SECONDS - SAFETY_MARGIN_SECONDS
+        return cls(seconds, reserve=seconds * FINAL_RESERVE_SHARE)
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - self.clock())
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def timeout(self, cap: float = None) -> float:
+        """Timeout para una llamada: lo que queda (acotado por `cap`). Lanza DeadlineExceeded si no queda nada."""
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded(f"Sin tiempo en la etapa '{self.name}'")
+        return min(cap, remaining) if cap is not None else remaining
+
+    def stage(self, name: str, share: float = None, reserved: bool = False) -> "Deadline":
+        """Sub-deadline para una etapa: su fracción del total (o todo lo que queda, sin `share`).
+
+        Solo las etapas finales (`reserved=True`: correo, memoria) pueden usar la reserva.
+        """
+        available = self.remaining() if reserved else max(0.0, self.remaining() - self.reserve)
+        seconds = available if share is None else min(self.total * share, available)
+        return Deadline(seconds, name=name, clock=self.clock)
+
+    def __enter__(self) -> "Deadline":
+        self._token = _CURRENT.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _CURRENT.reset(self._token)
+        elapsed = self.clock() - self.started_at
+        level = logging.WARNING if elapsed > self.total else logging.INFO
+        logging.log(level, f"⏱️ Etapa '{self.name}': {elapsed:.1f}s de {self.total:.1f}s asignados")
+
+
+def current() -> Optional[Deadline]:
+    return _CURRENT.get()
+
+
+def request_timeout(cap: float = None) -> Optional[float]:
+    """Timeout para una llamada de red según el deadline vigente (o `cap` si no hay ninguno)."""
+    deadline = current()
+    return deadline.timeout(cap) if deadline else cap
+
+
+def submit(fn: Callable[[], Any]) -> Future:
+    """Ejecuta `fn` en segundo plano conservando el contexto (deadline, tenant del limitador)."""
+    return _POOL.submit(contextvars.copy_context().run, fn)
+
+
+def result_or(future: Future, timeout: Optional[float], default: Any = None) -> Any:
+    """Resultado de una tarea en segundo plano, o `default` si falla o no termina a tiempo."""
+    try:
+        return future.result(timeout=timeout)
+    except Exception as e:
+        logging.warning(f"Tarea en segundo plano sin resultado a tiempo: {str(e) or type(e).__name__}")
+        return default
+
+
+def run_with_timeout(fn: Callable[[], Any], timeout: Optional[float]) -> Any:
+    """Ejecuta `fn` y deja de esperarla tras `timeout` (la llamada queda abandonada en segundo plano)."""
+    if timeout is None:
+        return fn()
+    future = submit(fn)
+    try:
+        return future.result(timeout=timeout)
+    except TimeoutError:
+        raise DeadlineExceeded(f"La llamada no respondió en {timeout:.1f}s")
+
+
+class LatencyTracker:
+    """Latencias recientes de un upstream, para decidir cuándo lanzar la solicitud de respaldo."""
+
+    def __init__(self, size: int = 100, samples=()):
+        self.samples = deque(samples, maxlen=size)
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float):
+        with self._lock:
+            self.samples.append(seconds)
+
+    def hedge_delay(self) -> float:
+        with self._lock:
+            if len(self.samples) < HEDGE_MIN_SAMPLES:
+                return HEDGE_DEFAULT_DELAY
+            ordered = sorted(self.samples)
+        return max(HEDGE_MIN_DELAY, ordered[int(len(ordered) * 0.95) - 1])
+
+    def snapshot(self) -> list:
+        with self._lock:
+            return [round(s, 3) for s in self.samples]
+
+
+_LATENCIES: Dict[str, LatencyTracker] = {}
+_LATENCIES_LOCK = threading.Lock()
+_LATENCY_DB = None
+
+
+def use_firestore(db):
+    """Persiste las latencias observadas en Firestore (las comparten Jobs y workers)."""
+    global _LATENCY_DB
+    _LATENCY_DB = db
+
+
+def latency(name: str) -> LatencyTracker:
+    """Latencias del upstream; la primera vez en el proceso se cargan las guardadas en Firestore."""
+    with _LATENCIES_LOCK:
+        if name in _LATENCIES:
+            return _LATENCIES[name]
+    samples = []
+    if _LATENCY_DB is not None:
+        try:
+            doc = _LATENCY_DB.collection(LATENCY_COLLECTION).document(name)\
+                .get(timeout=request_timeout(LATENCY_TIMEOUT_SECONDS))
+            samples = (doc.to_dict() or {}).get("samples", []) if doc.exists else []
+        except Exception as e:
+            logging.debug(f"Latencias de {name} no disponibles: {str(e) or type(e).__name__}")
+    with _LATENCIES_LOCK:
+        return _LATENCIES.setdefault(name, LatencyTracker(samples=samples))
+
+
+def _save_latency(name: str, tracker: LatencyTracker):
+    if _LATENCY_DB is None:
+        return
+    try:
+        _LATENCY_DB.collection(LATENCY_COLLECTION).document(name)\
+            .set({"samples": tracker.snapshot(), "updated_at": time.time()}, timeout=LATENCY_TIMEOUT_SECONDS)
+    except Exception as e:
+        logging.debug(f"No se pudieron guardar las latencias de {name}: {str(e) or type(e).__name__}")
+
+
+def hedged(name: str, fn: Callable[[], Any], timeout: float = None, delay: float = None) -> Any:
+    """Ejecuta una lectura idempotente; si tarda más que el p95 observado, la repite en paralelo.
+
+    Devuelve el primer resultado exitoso. Solo usar con llamadas sin efectos
+    laterales ni costo por solicitud: la solicitud perdedora no se cancela, se
+    abandona.
+    """
+    timeout = request_timeout(timeout)
+    tracker = latency(name)
+    delay = tracker.hedge_delay() if delay is None else delay
+    started = time.monotonic()
+
+    def timed():
+        t0 = time.monotonic()
+        result = fn()
+        tracker.observe(time.monotonic() - t0)
+        _POOL.submit(_save_latency, name, tracker)  # Sin demorar la respuesta
+        return result
+
+    pending = {submit(timed)}
+    done, _ = wait(pending, timeout=delay if timeout is None else min(delay, timeout))
+    if not done:
+        if timeout is not None and time.monotonic() - started >= timeout:
+            raise DeadlineExceeded(f"{name} no respondió en {timeout:.1f}s")
+        logging.info(f"🏇 {name} lenta (>{delay:.1f}s), lanzando solicitud de respaldo")
+        pending.add(submit(timed))
+
+    error = None
+    while pending:
+        left = None if timeout is None else max(0.0, started + timeout - time.monotonic())
+        done, pending = wait(pending, timeout=left, return_when=FIRST_COMPLETED)
+        if not done:
+            raise DeadlineExceeded(f"{name} no respondió en {timeout:.1f}s")
+        for future in done:
+            if future.exception() is None:
+                return future.result()
+            error = future.exception()
+    raise error
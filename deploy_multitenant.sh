@@ -36,6 +36,15 @@ gcloud builds submit --tag $IMAGE_NAME .
 SANITIZED_BRAND_ID=${BRAND_ID//_/-}
 JOB_NAME="brand-agent-$SANITIZED_BRAND_ID"
 REGION="us-central1"
+# The agent budgets its stages against the same timeout (see deadline.py)
+TASK_TIMEOUT=300
+# Run recordings for replay.py (see recorder.py); the job's disk is ephemeral
+RECORDINGS_BUCKET="${RECORDINGS_BUCKET:-$GOOGLE_CLOUD_PROJECT-brand-recordings}"
+
+if ! gcloud storage buckets describe gs://$RECORDINGS_BUCKET > /dev/null 2>&1; then
+    echo "🪣 Creating recordings bucket: gs://$RECORDINGS_BUCKET"
+    gcloud storage buckets create gs://$RECORDINGS_BUCKET --location $REGION
+fi
 
 echo "☁️ Updating/Creating Cloud Run Job: $JOB_NAME"
 
@@ -46,20 +55,20 @@ if gcloud run jobs describe $JOB_NAME --region $REGION > /dev/null 2>&1; then
     gcloud run jobs update $JOB_NAME \
       --image $IMAGE_NAME \
       --region $REGION \
-      --set-env-vars="BRAND_ID=$BRAND_ID,GOOGLE_CLOUD_PROJECT=$GOOGLE_CLOUD_PROJECT" \
+      --set-env-vars="BRAND_ID=$BRAND_ID,GOOGLE_CLOUD_PROJECT=$GOOGLE_CLOUD_PROJECT,TASK_TIMEOUT_SECONDS=$TASK_TIMEOUT,RECORDINGS_BUCKET=$RECORDINGS_BUCKET" \
       --set-secrets="GMAIL_PASSWORD=GMAIL_PASSWORD:latest,SERPAPI_KEY=SERPAPI_KEY:latest,GMAIL_USER=GMAIL_USER:latest,BCC_EMAILS=BCC_EMAILS:latest" \
       --max-retries 0 \
-      --task-timeout 300s \
+      --task-timeout ${TASK_TIMEOUT}s \
       --memory 2Gi \
       --cpu 1
 else
     gcloud run jobs create $JOB_NAME \
       --image $IMAGE_NAME \
       --region $REGION \
-      --set-env-vars="BRAND_ID=$BRAND_ID,GOOGLE_CLOUD_PROJECT=$GOOGLE_CLOUD_PROJECT" \
+      --set-env-vars="BRAND_ID=$BRAND_ID,GOOGLE_CLOUD_PROJECT=$GOOGLE_CLOUD_PROJECT,TASK_TIMEOUT_SECONDS=$TASK_TIMEOUT,RECORDINGS_BUCKET=$RECORDINGS_BUCKET" \
       --set-secrets="GMAIL_PASSWORD=GMAIL_PASSWORD:latest,SERPAPI_KEY=SERPAPI_KEY:latest,GMAIL_USER=GMAIL_USER:latest,BCC_EMAILS=BCC_EMAILS:latest" \
       --max-retries 0 \
-      --task-timeout 300s \
+      --task-timeout ${TASK_TIMEOUT}s \
       --memory 2Gi \
       --cpu 1
 fi
@@ -0,0 +1,74 @@
+#!/bin/bash
+
+# deploy_worker.sh
+# Deploys the resident worker (worker.py) as a Cloud Run Service and, for each
+# brand given, an hourly Cloud Scheduler trigger that POSTs to /run.
+# Usage: ./deploy_worker.sh [BRAND_ID...]
+# Example: ./deploy_worker.sh banco_chile banco_estado
+
+set -e
+
+SERVICE_NAME="brand-agent-worker"
+REGION="us-central1"
+IMAGE_NAME="us-central1-docker.pkg.dev/$GOOGLE_CLOUD_PROJECT/cuba-news/brand-agent:latest"
+SCHEDULER_SERVICE_ACCOUNT="30162433848-compute@developer.gserviceaccount.com"
+# Per-run budget (see deadline.py); runs are asynchronous, so it is independent of the request timeout
+TASK_TIMEOUT=300
+# Run recordings for replay.py; same bucket as deploy_multitenant.sh
+RECORDINGS_BUCKET="${RECORDINGS_BUCKET:-$GOOGLE_CLOUD_PROJECT-brand-recordings}"
+
+echo "🚀 Deploying resident worker: $SERVICE_NAME"
+
+# 1. Build Docker Image (Cloud Build). The image's CMD runs main.py (Jobs); the service overrides it.
+echo "📦 Building Docker Image with Cloud Build..."
+gcloud builds submit --tag $IMAGE_NAME .
+
+if ! gcloud storage buckets describe gs://$RECORDINGS_BUCKET > /dev/null 2>&1; then
+  echo "🪣 Creating recordings bucket: gs://$RECORDINGS_BUCKET"
+  gcloud storage buckets create gs://$RECORDINGS_BUCKET --location $REGION
+fi
+
+# 2. Deploy the Cloud Run Service running worker.py
+# --no-cpu-throttling: runs continue in background threads after the 202 response
+# --min-instances 1: keeps clients, prompts and caches warm between triggers
+gcloud run deploy $SERVICE_NAME \
+  --image $IMAGE_NAME \
+  --region $REGION \
+  --command python \
+  --args worker.py \
+  --no-allow-unauthenticated \
+  --no-cpu-throttling \
+  --min-instances 1 \
+  --max-instances 1 \
+  --timeout 900 \
+  --set-env-vars="GOOGLE_CLOUD_PROJECT=$GOOGLE_CLOUD_PROJECT,TASK_TIMEOUT_SECONDS=$TASK_TIMEOUT,PER_BRAND_CONCURRENCY=1,DRAIN_TIMEOUT_SECONDS=$TASK_TIMEOUT,RECORDINGS_BUCKET=$RECORDINGS_BUCKET" \
+  --set-secrets="GMAIL_PASSWORD=GMAIL_PASSWORD:latest,SERPAPI_KEY=SERPAPI_KEY:latest,GMAIL_USER=GMAIL_USER:latest,BCC_EMAILS=BCC_EMAILS:latest" \
+  --memory 2Gi \
+  --cpu 1
+
+SERVICE_URL=$(gcloud run services describe $SERVICE_NAME --region $REGION --format 'value(status.url)')
+echo "🔗 Worker URL: $SERVICE_URL"
+
+# 3. Hourly trigger per brand (authenticated with OIDC); the scheduler decides which terms are due
+for BRAND_ID in "$@"; do
+  SCHEDULER_NAME="$SERVICE_NAME-${BRAND_ID//_/-}-hourly"
+  PAYLOAD="{\"brand_id\": \"$BRAND_ID\", \"notify_empty\": false}"
+  if gcloud scheduler jobs describe $SCHEDULER_NAME --location $REGION > /dev/null 2>&1; then
+    ACTION=update
+  else
+    ACTION=create
+  fi
+  echo "⏰ Scheduler ($ACTION): $SCHEDULER_NAME"
+  gcloud scheduler jobs $ACTION http $SCHEDULER_NAME \
+    --schedule="0 * * * *" \
+    --uri="$SERVICE_URL/run" \
+    --http-method POST \
+    --headers="Content-Type=application/json" \
+    --message-body="$PAYLOAD" \
+    --oidc-service-account-email "$SCHEDULER_SERVICE_ACCOUNT" \
+    --oidc-token-audience "$SERVICE_URL" \
+    --location $REGION \
+    --time-zone "America/Santiago"
+done
+
+echo "✅ Worker deployment complete!"
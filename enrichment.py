@@ -0,0 +1,211 @@
+"""Enriquecimiento de menciones: descarga concurrente del artículo y extracción de su texto.
+
+Con el texto principal (truncado) adjunto a cada mención, Gemini analiza desde
+contexto local en lugar de volver a buscar cada noticia con grounding. Las
+descargas corren en paralelo con un límite por dominio, y el texto extraído se
+guarda por URL canónica en el almacén de menciones compartido por todas las
+marcas (ver mention_store.py).
+"""
+import os
+import re
+import logging
+import threading
+import contextvars
+from html.parser import HTMLParser
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Dict, List, Optional, Callable
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+from requests.compat import chardet
+
+from tools import SESSION
+from deadline import request_timeout, DeadlineExceeded
+
+BODY_MAX_CHARS = int(os.environ.get("ENRICHMENT_BODY_MAX_CHARS", 1500))
+CACHE_TTL_SECONDS = int(os.environ.get("ENRICHMENT_CACHE_TTL_HOURS", 72)) * 3600
+FETCH_WORKERS = int(os.environ.get("ENRICHMENT_WORKERS", 8))
+PER_DOMAIN_CONCURRENCY = 2
+FETCH_TIMEOUT_SECONDS = 10
+MAX_PAGE_BYTES = 2_000_000
+MIN_PARAGRAPH_CHARS = 40
+
+_HEADER_CHARSET_RE = re.compile(r"charset=[\"']?([\w.:-]+)", re.I)
+# <meta charset="..."> o <meta http-equiv="Content-Type" content="text/html; charset=...">
+_META_CHARSET_RE = re.compile(rb"<meta[^>]+charset=[\"']?([\w.:-]+)", re.I)
+
+# Parámetros de seguimiento que no cambian el contenido de la página
+TRACKING_PARAMS = {"fbclid", "gclid", "dclid", "msclkid", "igshid", "mc_cid", "mc_eid", "ref", "ref_src", "_ga"}
+
+# Redes sociales: exigen login o renderizan con JavaScript; el snippet de SerpApi es lo único útil
+SKIP_DOMAINS = ("twitter.com", "x.com", "facebook.com", "instagram.com", "linkedin.com", "tiktok.com")
+
+
+def canonical_url(url: str) -> str:
+    """URL normalizada para el caché: sin fragmento, sin parámetros de seguimiento, host en minúsculas y sin www."""
+    parts = urlsplit(url.strip())
+    host = parts.netloc.lower().removeprefix("www.")
+    query = sorted((k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+                   if not k.lower().startswith("utm_") and k.lower() not in TRACKING_PARAMS)
+    path = parts.path.rstrip("/") or "/"
+    return urlunsplit((parts.scheme.lower() or "https", host, path, urlencode(query), ""))
+
+
+class _ArticleTextParser(HTMLParser):
+    """Junta los párrafos de la página, priorizando los que están dentro de <article>."""
+
+    SKIP_TAGS = {"script", "style", "noscript", "nav", "header", "footer", "aside", "form", "svg", "figure"}
+    BLOCK_TAGS = {"p", "h1", "h2", "h3", "li", "blockquote"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.article_paragraphs: List[str] = []
+        self.paragraphs: List[str] = []
+        self.description: Optional[str] = None
+        self._skip_depth = 0
+        self._article_depth = 0
+        self._buffer: Optional[List[str]] = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP_TAGS:
+            self._skip_depth += 1
+        elif tag == "article":
+            self._article_depth += 1
+        elif tag in self.BLOCK_TAGS and not self._skip_depth:
+            self._flush()
+            self._buffer = []
+        elif tag == "meta":
+            attrs = dict(attrs)
+            if attrs.get("property") == "og:description" or attrs.get("name") == "description":
+                self.description = self.description or attrs.get("content")
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP_TAGS:
+            self._skip_depth = max(0, self._skip_depth - 1)
+        elif tag == "article":
+            self._flush()
+            self._article_depth = max(0, self._article_depth - 1)
+        elif tag in self.BLOCK_TAGS:
+            self._flush()
+
+    def handle_data(self, data):
+        if self._buffer is not None and not self._skip_depth:
+            self._buffer.append(data)
+
+    def _flush(self):
+        if self._buffer is None:
+            return
+        text = " ".join("".join(self._buffer).split())
+        self._buffer = None
+        if len(text) >= MIN_PARAGRAPH_CHARS:
+            (self.article_paragraphs if self._article_depth else self.paragraphs).append(text)
+
+
+def extract_text(html: str, max_chars: int = BODY_MAX_CHARS) -> str:
+    """Texto principal de una página HTML, truncado a `max_chars` (en un límite de palabra)."""
+    parser = _ArticleTextParser()
+    try:
+        parser.feed(html)
+        parser.close()
+    except Exception as e:
+        logging.debug(f"HTML mal formado, se usa lo extraído hasta el error: {e}")
+    parser._flush()
+    paragraphs = parser.article_paragraphs or parser.paragraphs
+    text = "\n".join(dict.fromkeys(paragraphs)) or (parser.description or "").strip()
+    if len(text) > max_chars:
+        text = text[:max_chars].rsplit(" ", 1)[0] + "…"
+    return text
+
+
+def decode_html(data: bytes, content_type: str = "") -> str:
+    """Decodifica una página: charset del encabezado, luego <meta charset>, luego UTF-8 o detección.
+
+    Sin charset en el encabezado, `requests` asume ISO-8859-1 para text/html y
+    los acentos de una página UTF-8 quedaban como "Ã­".
+    """
+    match = _HEADER_CHARSET_RE.search(content_type or "") or _META_CHARSET_RE.search(data[:4096])
+    if match:
+        encoding = match.group(1).decode("ascii", "ignore") if isinstance(match.group(1), bytes) else match.group(1)
+        try:
+            return data.decode(encoding, errors="replace")
+        except LookupError:
+            pass
+    try:
+        return data.decode("utf-8")
+    except UnicodeDecodeError:
+        return data.decode(chardet.detect(data).get("encoding") or "cp1252", errors="replace")
+
+
+def fetch_html(url: str) -> Optional[str]:
+    """Descarga una página HTML (máx. MAX_PAGE_BYTES). Devuelve None si no es HTML."""
+    with SESSION.get(url, timeout=request_timeout(FETCH_TIMEOUT_SECONDS), stream=True,
+                     headers={"User-Agent": "Mozilla/5.0 (compatible; BrandMonitor/1.0)"}) as response:
+        response.raise_for_status()
+        content_type = response.headers.get("Content-Type", "html")
+        if "html" not in content_type:
+            return None
+        chunks, size = [], 0
+        for chunk in response.iter_content(64 * 1024):
+            chunks.append(chunk)
+            size += len(chunk)
+            if size >= MAX_PAGE_BYTES:
+                break
+        return decode_html(b"".join(chunks), content_type)
+
+
+class Enricher:
+    """Adjunta a cada mención el texto de su artículo (`Mention.body`), desde caché o descargándolo."""
+
+    def __init__(self, cache, workers: int = FETCH_WORKERS,
+                 per_domain: int = PER_DOMAIN_CONCURRENCY, fetch: Callable[[str], Optional[str]] = fetch_html):
+        # `cache`: {URL canónica: texto} con get_many/put_many; en el runtime, el MentionStore compartido
+        self.cache = cache
+        self.fetch = fetch
+        self.per_domain = per_domain
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="enrichment")
+        self._domains: Dict[str, threading.Semaphore] = {}
+        self._lock = threading.Lock()
+
+    def _domain_slot(self, url: str) -> threading.Semaphore:
+        with self._lock:
+            return self._domains.setdefault(urlsplit(url).netloc, threading.Semaphore(self.per_domain))
+
+    def _fetch_one(self, url: str) -> Optional[str]:
+        with self._domain_slot(url):
+            try:
+                html = self.fetch(url)
+            except Exception as e:
+                logging.info(f"No se pudo descargar {url}: {e}")
+                return None
+        # Una página sin texto extraíble se cachea vacía: no vale la pena volver a descargarla
+        return extract_text(html) if html else ""
+
+    def enrich(self, batch) -> Dict[str, str]:
+        """Completa `body` en el lote. Devuelve {link: texto} de las menciones enriquecidas.
+
+        Lo que no termina dentro del deadline vigente queda sin texto (el
+        análisis usa entonces título y snippet); si la etapa ya no tiene
+        tiempo, solo se usa el caché.
+        """
+        canonical = {m.link: canonical_url(m.link) for m in batch}
+        wanted = [c for link, c in canonical.items() if not urlsplit(c).netloc.endswith(SKIP_DOMAINS)]
+        bodies = self.cache.get_many(list(dict.fromkeys(wanted)))
+        hits = len(bodies)
+
+        misses = [c for c in dict.fromkeys(wanted) if c not in bodies]
+        try:
+            timeout = request_timeout()
+        except DeadlineExceeded:
+            timeout = 0
+        # Sin tiempo en la etapa no se lanza ninguna descarga: las menciones siguen sin texto
+        futures = {self._pool.submit(contextvars.copy_context().run, self._fetch_one, c): c
+                   for c in (misses if timeout != 0 else [])}
+        done, not_done = wait(futures, timeout=timeout) if futures else (set(), set(misses))
+        fetched = {futures[f]: f.result() for f in done if f.result() is not None}
+        self.cache.put_many(fetched)
+        bodies.update(fetched)
+
+        batch.assign("body", [bodies.get(canonical[link]) or None for link in batch.links()])
+        logging.info(f"📰 Enriquecimiento: {hits} desde caché, {len(fetched)}/{len(misses)} descargadas"
+                     f"{f', {len(not_done)} sin tiempo' if not_done else ''}, "
+                     f"{len(canonical) - len(wanted)} redes sociales omitidas.")
+        return {link: bodies[c] for link, c in canonical.items() if bodies.get(c)}
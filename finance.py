@@ -1,21 +1,24 @@
-import requests
 import logging
+from tools import SESSION
+from ratelimit import LIMITER
+from deadline import hedged, request_timeout
 from datetime import datetime
 
 def get_economic_indicators():
     """Obtiene indicadores económicos de Chile (UF, USD, EUR) desde mindicador.cl"""
     api_url = "https://mindicador.cl/api"
     
-    for attempt in range(3):
-        try:
-            response = requests.get(api_url, timeout=10)
-            response.raise_for_status()
-            data = response.json()
-            break
-        except Exception as e:
-            logging.warning(f"Intento {attempt+1} fallido obteniendo indicadores: {e}")
-            if attempt == 2:
-                return None
+    def _get():
+        response = SESSION.get(api_url, timeout=request_timeout(10))
+        response.raise_for_status()
+        return response
+
+    try:
+        # Reintentos con backoff y Retry-After, bajo la cuota compartida (ver ratelimit.py)
+        data = hedged("mindicador", lambda: LIMITER.call("mindicador", _get, timeout=request_timeout())).json()
+    except Exception as e:
+        logging.warning(f"No se pudieron obtener indicadores: {e}")
+        return None
     
     try:
         # Extraemos y formateamos solo lo que nos interesa
@@ -4,6 +4,10 @@ from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.mime.image import MIMEImage
 
+from deadline import request_timeout
+
+SMTP_TIMEOUT_SECONDS = 30
+
 def _generate_indicators_html(indicators):
     if not indicators:
         return ""
@@ -164,7 +168,7 @@ def send_alert_email(subject: str, body: str, recipient: str = None, chart_buffe
             print(f"Error attaching image: {e}")
 
     try:
-        with smtplib.SMTP_SSL('smtp.gmail.com', 465) as server:
+        with smtplib.SMTP_SSL('smtp.gmail.com', 465, timeout=request_timeout(SMTP_TIMEOUT_SECONDS)) as server:
             server.login(sender_email, password)
             server.send_message(msg, to_addrs=to_addrs)
         return "Email sent successfully."
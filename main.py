@@ -1,12 +1,19 @@
 import os
+import json
 import logging
-import vertexai
-from vertexai.generative_models import GenerativeModel, Tool, SafetySetting
-from tools import search_financial_news, search_social_media
-from memory import BrandMemory
+from itertools import chain
+from query_planner import execute_plan
+from mentions import make_batch
+from relevance import filter_relevant
+from scheduler import schedule_terms, update_term_stats, DEFAULT_CALL_BUDGET
+from runtime import Runtime
+from analysis import run_analysis, verify_unenriched, render_report_html, render_fallback_html, sentiment_counts
+from deadline import Deadline, DeadlineExceeded, STAGE_SHARES, submit, result_or
+from recorder import RunRecorder, check_destination
+from ratelimit import tenant_context, brand_priority
+from prompt_compaction import TokenLedger
 from mailer import send_alert_email
 from datetime import datetime
-import re
 from visualizer import generate_trend_chart
 from finance import get_economic_indicators
 from config import BRAND # Importamos la configuración dinámica
@@ -14,77 +21,100 @@ from config import BRAND # Importamos la configuración dinámica
 # Configuración de Logging
 logging.basicConfig(level=logging.INFO)
 
-def main():
-    project_id = os.environ.get("GOOGLE_CLOUD_PROJECT")
-    location = "us-central1"
-    model_name = "gemini-2.5-pro"
+MONTHS_ES = {
+    1: "Ene", 2: "Feb", 3: "Mar", 4: "Abr", 5: "May", 6: "Jun",
+    7: "Jul", 8: "Ago", 9: "Sep", 10: "Oct", 11: "Nov", 12: "Dic"
+}
+
+def _formatted_date() -> str:
+    now = datetime.now()
+    return f"[{MONTHS_ES[now.month]} {now.day}, {now.year}]"
+
+def run_brand(brand, runtime: Runtime, terms=None, notify_empty: bool = True, deadline: Deadline = None):
+    """Ejecuta un ciclo completo de vigilancia para una marca.
+
+    Args:
+        brand: Configuración de la marca (entrada de brands_config.yaml).
+        runtime: Clientes compartidos (ver runtime.py).
+        terms: Restringe la búsqueda a estos términos (ej: chequeos horarios de caídas).
+        notify_empty: Si es False, no se envía el correo "Sin Novedades".
+        deadline: Presupuesto de tiempo de la corrida (por defecto TASK_TIMEOUT_SECONDS; ver deadline.py).
+    """
+    deadline = deadline or Deadline.for_task()
+    # Grabación append-only de la corrida para replay.py (ver recorder.py)
+    # Cuota de APIs atribuida a la marca, con su prioridad (ver ratelimit.py)
+    # Tokens de todas las llamadas a Gemini de la corrida (ver prompt_compaction.py)
+    with RunRecorder(brand['id']) as recorder, tenant_context(brand['id'], brand_priority(brand)), deadline, \
+            TokenLedger(brand['id']) as ledger:
+        recorder.record("run", brand_id=brand['id'], model=runtime.model_name, terms=terms)
+        _run_brand(brand, runtime, recorder, deadline, ledger, terms, notify_empty)
+        recorder.record("tokens", **ledger.totals())
+
+
+def _run_brand(brand, runtime: Runtime, recorder: RunRecorder, deadline: Deadline, ledger: TokenLedger, terms=None,
+               notify_empty: bool = True):
+    memory = runtime.memory(brand)
     
-    if not project_id:
-        logging.error("GOOGLE_CLOUD_PROJECT environment variable not set.")
-        return
+    print(f"🚀 Iniciando Agente de Vigilancia para {brand['name']} ({runtime.model_name})...")
 
-    vertexai.init(project=project_id, location=location)
-    
-    # Configuración de Grounding (Google Search)
-    tools = [Tool.from_dict({"google_search": {}})]
-    
-    model = GenerativeModel(
-        model_name,
-        tools=tools
-    )
-    
-    memory = BrandMemory(project_id)
-    
-    print(f"🚀 Iniciando Agente de Vigilancia para {BRAND['name']} ({model_name})...")
+    # 0. Obtener indicadores económicos (en paralelo a la búsqueda; se esperan solo hasta el envío del correo)
+    print("💰 Obteniendo indicadores económicos...")
+    indicators = submit(get_economic_indicators)
 
     # 1. Recolección de Información (Búsqueda Amplia)
-    raw_news = []
     print("🔎 Buscando en medios financieros y redes sociales...")
     
-    # 0. Obtener indicadores económicos (Paralelo a búsqueda)
-    print("💰 Obteniendo indicadores económicos...")
-    market_data = get_economic_indicators()
-    
-    # Búsqueda iterativa por términos configurados
-    for term in BRAND['search_terms']:
-        print(f"   👉 Buscando: '{term}'...")
-        
-        # Financial News
-        financial = search_financial_news(term, limit=5)
-        if isinstance(financial, list): raw_news.extend(financial)
-        
-        # Social Media
-        social = search_social_media(term, limit=5)
-        if isinstance(social, list): raw_news.extend(social)
-
-    # 2. Deduplicación (El Filtro de Memoria)
-    new_items = []
-    for item in raw_news:
-        url = item.get('link')
-        if url and not memory.is_news_processed(url):
-            new_items.append(item)
-        else:
-            logging.info(f"♻️ Saltando duplicado: {item.get('title')}")
+    # Programación adaptativa: qué términos se consultan hoy y con qué profundidad (ver scheduler.py)
+    with deadline.stage("plan", STAGE_SHARES["plan"]):
+        term_stats = memory.get_term_stats()
+    call_budget = brand.get('call_budget', DEFAULT_CALL_BUDGET)
+    requested = terms or brand['search_terms']
+    plan, schedule = schedule_terms(requested, term_stats, brand.get('critical_terms', []), call_budget)
+
+    # Búsqueda consolidada: los términos se empaquetan en consultas OR (ver query_planner.py)
+    print(f"   👉 {len(plan.terms)}/{len(requested)} términos en {plan.call_count} consultas combinadas...")
+    with deadline.stage("search", STAGE_SHARES["search"]) as stage:
+        raw_news = make_batch(execute_plan(plan, max_calls=call_budget, critical_terms=brand.get('critical_terms', []),
+                                           deadline=stage))
+    recorder.record("search", terms=plan.terms, plan=plan.to_dict(), items=raw_news.to_records())
+
+    # Exportar el plan para auditoría (Cloud Logging y, opcionalmente, archivo)
+    logging.info(f"🧭 Plan de consultas: {json.dumps(plan.to_dict(), ensure_ascii=False)}")
+    plan_path = os.environ.get("QUERY_PLAN_EXPORT")
+    if plan_path:
+        plan.export(plan_path)
+
+    # 2. Deduplicación (El Filtro de Memoria): una consulta por cada 30 URLs, filtrado sobre el lote
+    with deadline.stage("dedup", STAGE_SHARES["dedup"]):
+        processed = memory.filter_processed(raw_news.links())
+        new_items = raw_news.exclude_links(processed)
+        recorder.record("dedup", new_links=new_items.links())
+        logging.info(f"♻️ Saltando {len(processed)} duplicados ya procesados.")
+
+        # Filtro de relevancia (TF-IDF contra el perfil de la marca): homónimos y temas ajenos no llegan a Gemini
+        new_items, off_topic = filter_relevant(new_items, brand, memory.get_accepted_texts())
+        # `dropped` permite a replay.py reproducir la misma decisión sin recalcular el perfil
+        recorder.record("relevance", scores={m.link: m.relevance for m in chain(new_items, off_topic)},
+                        dropped=off_topic.links())
+        # Las descartadas se recuerdan aparte (con vencimiento) para no re-evaluarlas en cada corrida
+        memory.remember_dropped(off_topic)
+
+        # El rendimiento de cada término se mide sobre menciones nuevas y relevantes
+        memory.save_term_stats(update_term_stats(term_stats, schedule, new_items, plan.executed_terms))
 
     if not new_items:
         print("✅ No hay noticias nuevas relevantes desde la última ejecución.")
+        if not notify_empty:
+            return
         
         # Enviar correo de "Sin Novedades"
-        months_es = {
-            1: "Ene", 2: "Feb", 3: "Mar", 4: "Abr", 5: "May", 6: "Jun",
-            7: "Jul", 8: "Ago", 9: "Sep", 10: "Oct", 11: "Nov", 12: "Dic"
-        }
-        now = datetime.now()
-        month_es = months_es[now.month]
-        formatted_date = f"[{month_es} {now.day}, {now.year}]"
-        
-        subject = f"{formatted_date} {BRAND['name']}: Reporte de Monitoreo - Sin Novedades"
+        subject = f"{_formatted_date()} {brand['name']}: Reporte de Monitoreo - Sin Novedades"
         body = f"""
         <div style="text-align: center; padding: 30px 20px;">
             <div style="font-size: 48px; margin-bottom: 15px;">✅</div>
             <h2 style="color: #2E7D32; margin: 0 0 10px 0; font-family: Helvetica, Arial, sans-serif;">Sin Novedades Relevantes</h2>
             <p style="color: #555; font-size: 16px; line-height: 1.5; margin: 0 0 20px 0;">
-                El sistema de monitoreo no ha detectado nuevas menciones críticas ni noticias relevantes para <strong>{BRAND['name']}</strong> desde la última ejecución.
+                El sistema de monitoreo no ha detectado nuevas menciones críticas ni noticias relevantes para <strong>{brand['name']}</strong> desde la última ejecución.
             </p>
             <div style="background-color: #f5f5f5; border-radius: 8px; padding: 15px; display: inline-block;">
                 <p style="color: #777; font-size: 14px; margin: 0;">
@@ -93,141 +123,83 @@ def main():
             </div>
         </div>
         """
-        send_alert_email(subject, body, indicators=market_data, brand_config=BRAND)
+        with deadline.stage("report", reserved=True):
+            market_data = result_or(indicators, timeout=deadline.remaining())
+            send_alert_email(subject, body, indicators=market_data, brand_config=brand)
         return
 
-    print(f"⚡ Procesando {len(new_items)} noticias nuevas con Gemini...")
+    # 2b. Enriquecimiento: texto del artículo para cada mención (descargas concurrentes con caché; ver enrichment.py)
+    with deadline.stage("enrich", STAGE_SHARES["enrich"]):
+        bodies = runtime.enricher.enrich(new_items)
+    recorder.record("enrichment", bodies=bodies)
 
-    # 3. Análisis Cognitivo (Gemini 2.5 Pro con Grounding)
-    print("⚠️ Usando workaround para Grounding Tool (google_search dict)...")
-    tools = [Tool.from_dict({'google_search': {}})]
+    print(f"⚡ Procesando {len(new_items)} noticias nuevas con Gemini...")
 
-    # Cargar instrucciones detalladas desde el archivo YAML si existe, o usar string robusto
+    # 3. Análisis Cognitivo (Gemini 2.5 Pro, salida JSON restringida por esquema; ver analysis.py)
+    # Instrucción de sistema estática precompilada por marca (ver prompt_bundle.py)
+    analysis = None
     try:
-        with open('prompts/instructions.yaml', 'r') as f:
-            import yaml
-            loaded_instructions = yaml.safe_load(f).get('instructions', '')
-    except Exception:
-        # Fallback si falla la lectura del archivo
-        loaded_instructions = """
-        **Output Format (HTML)**:
-        <p><strong>Estado General:</strong> <span style="color: [green/yellow/red];">[Estable/Alerta/Crisis]</span> | <strong>Brand Health Index:</strong> [0-100]/100</p>
-        <p><strong>Análisis:</strong> [2-3 líneas de análisis experto sobre por qué el estado es ese, mencionando tendencias o noticias clave]</p>
-        <p><strong>Recomendación:</strong> [1 línea de recomendación para la alta dirección]</p>
-        <hr>
-        <h4>Detalle de Menciones</h4>
-        <ul>
-          <li><strong>[TAG]</strong> <strong>Mención:</strong> [Resumen]. <strong>Sentimiento:</strong> <span style="color: #00C853;">Positivo</span> / <span style="color: #607D8B;">Neutro</span> / <span style="color: #D32F2F;">Negativo</span>. <a href="[URL_FUENTE_DIRECTA]" target="_blank">leer más</a></li>
-        </ul>
-        """
-
-    model = GenerativeModel(
-        model_name,
-        tools=tools,
-        system_instruction=f"""Eres un Analista de Riesgo Reputacional Senior de {BRAND['name']}. 
-        Tu trabajo es analizar las noticias ingresadas y generar un reporte ejecutivo HTML.
-        
-        Reglas:
-        1. Evalúa la SEVERIDAD (Baja, Media, Crítica).
-        2. Si la noticia es 'fake news' o irrelevante, descártala.
-        3. Genera un resumen HTML limpio y profesional siguiendo ESTRICTAMENTE el formato solicitado.
-        4. Usa etiquetas de sentimiento con colores: <span style="color: #00C853;">Positivo</span>, <span style="color: #607D8B;">Neutro</span>, <span style="color: #D32F2F;">Negativo</span>.
-        5. Incluye enlaces 'leer más' a las fuentes.
-        
-        {loaded_instructions}"""
-    )
-    
-    # Construir Contexto
-    context_str = ""
-    for i, item in enumerate(new_items, 1):
-        context_str += f"{i}. [{item.get('date', 'Fecha desc.')}] {item['title']} ({item['link']})\n"
-
-    prompt = f'''
-    Analiza las siguientes menciones NUEVAS recolectadas hoy {datetime.now().strftime('%Y-%m-%d')}:
-    
-    {context_str}
-    
-    Tus competidores son: {', '.join(BRAND['competitors'])}.
-    Tu foco tecnológico estratégico es: {BRAND['tech_focus']}.
-    
-    Tarea:
-    1. Verifica la veracidad usando Grounding (Google Search).
-    2. FILTRA: Descarta noticias con fecha > 3 meses.
-    3. Genera el 'Resumen Ejecutivo de Riesgo' en formato HTML.
-    4. Asegúrate de incluir 'Brand Health Index' (0-100) y Tags [CATEGORÍA].
-    5. USA ENLACES DIRECTOS (No Google Redirects).
-    6. [NUEVO] Genera un 'Google Cloud Tech Insight':
-       - Identifica el dolor o oportunidad principal en las noticias (ej: lentitud, fraude, innovación, costos).
-       - Conecta ese punto Específico con una solución de Google Cloud Platform que ayude a {BRAND['name']}.
-       - Usa un tono de "Asesor de Confianza", no de vendedor agresivo.
-       - Ejemplo: "Dada la expansión de {BRAND['name']}, una arquitectura basada en GKE Autopilot..."
-    
-    Formato de salida esperado (Incrústalo en el HTML):
-    <p><strong>Estado General:</strong> <span style="color: [green/yellow/red];">[Estable/Alerta/Crisis]</span> | <strong>Brand Health Index:</strong> [0-100]/100</p>
-    <p><strong>Análisis:</strong> [2-3 líneas de análisis experto sobre por qué el estado es ese, mencionando tendencias o noticias clave]</p>
-    <p><strong>Recomendación:</strong> [1 línea de recomendación para la alta dirección]</p>
-    <hr>
-    <h4>Detalle de Menciones</h4>
-    <ul>
-      <li><strong>[TAG]</strong> <strong>Mención:</strong> [Resumen]. <strong>Sentimiento:</strong> <span style="color: #00C853;">Positivo</span> / <span style="color: #607D8B;">Neutro</span> / <span style="color: #D32F2F;">Negativo</span>. <a href="[URL_FUENTE_DIRECTA]" target="_blank">leer más</a></li>
-    </ul>
-    
-    <div class="tech-insight">
-        <strong>Perspectiva Tecnológica (Google Cloud):</strong> [Tu consejo estratégico aquí]
-    </div>
-    '''
+        with deadline.stage("analysis", STAGE_SHARES["analysis"]):
+            model, bundle = runtime.analysis_model(brand)
+            analysis = run_analysis(model, bundle, new_items, datetime.now().strftime('%Y-%m-%d'), recorder=recorder)
+            # Grounding solo como verificación de lo que no se pudo leer localmente
+            verify_unenriched(new_items, analysis, store=runtime.mention_store)
+    except Exception as e:
+        # Degradación: sin análisis se envían igual las menciones crudas (y quedan pendientes para la próxima corrida)
+        logging.error(f"❌ Error en el análisis, se envía reporte degradado: {str(e) or type(e).__name__}")
+        recorder.record("degraded", stage="analysis", error=str(e) or type(e).__name__)
+        reason = "tiempo agotado" if isinstance(e, DeadlineExceeded) else "error del modelo"
 
     try:
-        response = model.generate_content(prompt)
-        html_report = response.text
-        
-        # Extract Score
-        current_score = 0
-        try:
-            match = re.search(r"Brand Health Index:.*?(\d+)/100", html_report)
-            if match:
-                current_score = int(match.group(1))
-        except Exception as e:
-            logging.warning(f"Could not extract Brand Health Index: {e}")
-
-        # Save to Memory
-        if current_score > 0:
-            memory.save_daily_summary(current_score)
-
-        # Generate Chart
-        history_data = memory.get_history_stats(limit=10)
-        chart_buffer = None
-        if len(history_data) > 1:
-            try:
-                chart_buffer = generate_trend_chart(history_data)
-            except Exception as e:
-                logging.error(f"Error generating chart: {e}")
-        
-        # 4. Acción: Enviar Correo y Guardar en Memoria
-        months_es = {
-            1: "Ene", 2: "Feb", 3: "Mar", 4: "Abr", 5: "May", 6: "Jun",
-            7: "Jul", 8: "Ago", 9: "Sep", 10: "Oct", 11: "Nov", 12: "Dic"
-        }
-        now = datetime.now()
-        month_es = months_es[now.month]
-        formatted_date = f"[{month_es} {now.day}, {now.year}]"
-        
-        subject = f"{formatted_date} {BRAND['name']}: Resumen de Marca e Inteligencia de Mercado - Powered by Gemini"
-        
-        # 4. Enviar Correo
-        print("📧 Enviando reporte...")
-        result = send_alert_email(subject, html_report, chart_buffer=chart_buffer, indicators=market_data, brand_config=BRAND)
-        print(f"📧 Email Result: {result}")
-        
-        # 5. Guardar en Memoria (Solo si se envió éxito) fue exitoso
-        print("💾 Actualizando memoria...")
-        for item in new_items:
-            memory.remember_news(item)
+        with deadline.stage("report", STAGE_SHARES["report"], reserved=True):
+            if analysis:
+                html_report = render_report_html(analysis, new_items)
+
+                # Save to Memory
+                memory.save_daily_summary(analysis['score'], state=analysis['state'], sentiment=sentiment_counts(analysis),
+                                          tokens=ledger.totals())
+                recorder.record("analysis", analysis=analysis)
+
+                # Generate Chart
+                history_data = memory.get_history_stats(limit=10)
+                chart_buffer = None
+                if len(history_data) > 1:
+                    try:
+                        chart_buffer = generate_trend_chart(history_data)
+                    except Exception as e:
+                        logging.error(f"Error generating chart: {e}")
+                subject = f"{_formatted_date()} {brand['name']}: Resumen de Marca e Inteligencia de Mercado - Powered by Gemini"
+            else:
+                html_report = render_fallback_html(new_items, reason)
+                chart_buffer = None
+                subject = f"{_formatted_date()} {brand['name']}: Menciones Nuevas (Análisis Pendiente)"
+
+            # 4. Enviar Correo (los indicadores se omiten si no llegaron a tiempo)
+            market_data = result_or(indicators, timeout=deadline.timeout(cap=5))
+            print("📧 Enviando reporte...")
+            result = send_alert_email(subject, html_report, chart_buffer=chart_buffer, indicators=market_data, brand_config=brand)
+            print(f"📧 Email Result: {result}")
+
+        # 5. Guardar en Memoria: usa el tiempo reservado de la corrida.
+        # Las menciones sin análisis no se marcan como procesadas, para reanalizarlas en la próxima corrida.
+        if analysis:
+            with deadline.stage("memory", reserved=True):
+                print("💾 Actualizando memoria...")
+                memory.remember_batch(new_items)
             
         print("✅ Ciclo completado exitosamente.")
 
     except Exception as e:
         logging.error(f"❌ Error en la generación o envío: {e}")
 
+def main():
+    # El presupuesto de la tarea corre desde el arranque del proceso (incluye inicializar clientes)
+    deadline = Deadline.for_task()
+    check_destination()
+    runtime = Runtime()
+    if not runtime.project_id:
+        return
+    run_brand(BRAND, runtime, deadline=deadline)
+
 if __name__ == "__main__":
     main()
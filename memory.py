@@ -1,64 +1,255 @@
 import os
 import logging
 import hashlib
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 from google.cloud import firestore
+import time
 import datetime
 from config import BRAND
+from recent_index import RecentMentionIndex
+from deadline import request_timeout
+from mention_store import MentionStore, mention_id
+
+# Timeout máximo por llamada a Firestore (acotado además por el deadline de la etapa en curso)
+FIRESTORE_TIMEOUT_SECONDS = 20
+
+# Frecuencia máxima de sincronización del índice de contexto reciente con Firestore
+RECENT_INDEX_REFRESH_SECONDS = 60
+RECENT_INDEX_MAX_DAYS = 30
+
+# Las menciones descartadas por el filtro de relevancia se omiten durante este plazo; luego se re-evalúan
+RELEVANCE_DROP_TTL_DAYS = int(os.environ.get("RELEVANCE_DROP_TTL_DAYS", 7))
+
+def _still_processed(record: Dict[str, Any], now: datetime.datetime) -> bool:
+    """Un registro cuenta como procesado salvo que sea un descarte por relevancia ya vencido."""
+    return not record.get("relevance_dropped") or record.get("expires_at", now) > now
+
 
 class BrandMemory:
-    def __init__(self, project_id: str = None):
-        self.db = None
+    def __init__(self, project_id: str = None, brand: Dict[str, Any] = None, db=None, store: MentionStore = None):
+        # `db` permite compartir un cliente de Firestore ya inicializado (modo servicio)
+        self.db = db
+        brand = brand or BRAND
+        self.brand_id = brand['id']
+        # Contenido compartido entre marcas; aquí solo se guardan referencias y juicios de la marca
+        self.store = store or MentionStore(db)
+        # Colecciones dinámicas basadas en la marca
+        self.collection_name = f"{brand['id']}_processed_news"
+        self.history_collection = f"{brand['id']}_brand_history"
+        self.term_stats_collection = f"{brand['id']}_term_stats"
+        self._recent = RecentMentionIndex()
+        self._recent_synced_at = 0.0
+        self._recent_watermark = None  # processed_at más reciente leído desde Firestore
+        if self.db:
+            return
+
         if not project_id:
             project_id = os.environ.get("GOOGLE_CLOUD_PROJECT")
             
         if project_id:
             try:
                 self.db = firestore.Client(project=project_id)
-                # Colecciones dinámicas basadas en la marca
-                self.collection_name = f"{BRAND['id']}_processed_news"
-                self.history_collection = f"{BRAND['id']}_brand_history"
             except Exception as e:
                 logging.error(f"Error connecting to Firestore: {e}")
         else:
             logging.warning("⚠️ Firestore no inicializado: Faltan env vars.")
+        self.store.db = self.store.db or self.db
+
+    def filter_processed(self, urls: List[str]) -> set:
+        """Devuelve cuáles de las URLs ya fueron procesadas (consultas `in` de a 30, no una por URL).
 
-    def is_news_processed(self, url: str) -> bool:
-        """Verifica si la noticia ya fue procesada."""
-        if not self.db: return False
+        Se compara por `mention_id` (URL canónica): las variantes con parámetros
+        de seguimiento (utm_*, fbclid) de una mención ya vista no son nuevas.
+        Los registros anteriores a `mention_id` se buscan por URL exacta. Una
+        mención descartada por relevancia cuenta como procesada solo hasta su
+        `expires_at`.
+        """
+        if not self.db or not urls: return set()
         
-        docs = self.db.collection(self.collection_name).where("url", "==", url).stream()
-        return any(True for _ in docs)
+        now = datetime.datetime.now(datetime.timezone.utc)
+        processed = set()
+        by_id: Dict[str, List[str]] = {}
+        for url in dict.fromkeys(urls):
+            by_id.setdefault(mention_id(url), []).append(url)
+        try:
+            ids = list(by_id)
+            for start in range(0, len(ids), 30):
+                docs = self.db.collection(self.collection_name)\
+                    .where("mention_id", "in", ids[start:start + 30])\
+                    .select(["mention_id", "relevance_dropped", "expires_at"])\
+                    .stream(timeout=request_timeout(FIRESTORE_TIMEOUT_SECONDS))
+                for doc in docs:
+                    data = doc.to_dict()
+                    if _still_processed(data, now):
+                        processed.update(by_id.get(data.get("mention_id"), ()))
+            legacy = [url for url in dict.fromkeys(urls) if url not in processed]
+            for start in range(0, len(legacy), 30):
+                docs = self.db.collection(self.collection_name)\
+                    .where("url", "in", legacy[start:start + 30])\
+                    .select(["url", "relevance_dropped", "expires_at"])\
+                    .stream(timeout=request_timeout(FIRESTORE_TIMEOUT_SECONDS))
+                for doc in docs:
+                    data = doc.to_dict()
+                    if _still_processed(data, now):
+                        processed.add(data["url"])
+        except Exception as e:
+            logging.error(f"Error consultando memoria: {e}")
+        return processed
+
+    def remember_batch(self, batch, when: datetime.datetime = None):
+        """Guarda un lote de menciones con escrituras por lotes de Firestore (máx. 500 por commit).
 
-    def remember_news(self, news_item: dict):
-        """Guarda la noticia en memoria."""
+        El contenido va una sola vez al almacén global (ver mention_store.py); la
+        colección de la marca guarda la referencia y el juicio de esta marca.
+        `when` fecha el procesamiento en el pasado (replay.py).
+        """
         if not self.db: return
         
+        now = (when.replace(tzinfo=when.tzinfo or datetime.timezone.utc) if when
+               else datetime.datetime.now(datetime.timezone.utc))
         try:
-            self.db.collection(self.collection_name).add({
-                "url": news_item['link'],
-                "title": news_item['title'],
-                "processed_at": firestore.SERVER_TIMESTAMP,
-                "sentiment": "unknown" 
-            })
+            # Dos escrituras por mención (referencia + contenido compartido)
+            for chunk in batch.iter_chunks(250):
+                writes = self.db.batch()
+                added = []
+                for mention in chunk:
+                    writes.set(self.store.ref(mention.link), self.store.content(mention, self.brand_id), merge=True)
+                    record = {
+                        "url": mention.link,
+                        "mention_id": mention_id(mention.link),
+                        "title": mention.title,
+                        # Copia del contenido que usan el índice de contexto y el perfil de relevancia
+                        "snippet": mention.snippet,
+                        "sentiment": (mention.sentiment or "unknown").lower(),
+                        "tag": mention.tag,
+                        "severity": mention.severity,
+                        "summary": mention.summary,
+                        "relevance": mention.relevance,
+                    }
+                    doc_ref = self.db.collection(self.collection_name).document()
+                    writes.set(doc_ref, {**record, "processed_at": now if when else firestore.SERVER_TIMESTAMP})
+                    added.append((doc_ref.id, record))
+                writes.commit(timeout=request_timeout(FIRESTORE_TIMEOUT_SECONDS))
+                for doc_id, record in added:
+                    self._recent.add(doc_id, {**record, "processed_at": now})
         except Exception as e:
             logging.error(f"Error saving to memory: {e}")
 
-    def save_daily_summary(self, score: int):
-        """Guarda el Brand Health Index del día."""
+    def remember_dropped(self, batch):
+        """Registra las menciones que el filtro de relevancia descartó, para no re-evaluarlas en cada corrida.
+
+        Quedan marcadas con `relevance_dropped` y un `expires_at` (apto para una
+        política TTL de Firestore): no entran al contexto reciente ni al perfil
+        de relevancia, y pasado el plazo vuelven a evaluarse.
+        """
+        if not self.db or not len(batch): return
+
+        expires_at = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(days=RELEVANCE_DROP_TTL_DAYS)
+        try:
+            for chunk in batch.iter_chunks(500):
+                writes = self.db.batch()
+                for mention in chunk:
+                    writes.set(self.db.collection(self.collection_name).document(), {
+                        "url": mention.link,
+                        "mention_id": mention_id(mention.link),
+                        "title": mention.title,
+                        "relevance": mention.relevance,
+                        "relevance_dropped": True,
+                        "expires_at": expires_at,
+                        "processed_at": firestore.SERVER_TIMESTAMP,
+                    })
+                writes.commit(timeout=request_timeout(FIRESTORE_TIMEOUT_SECONDS))
+        except Exception as e:
+            logging.error(f"Error guardando descartadas por relevancia: {e}")
+
+    def _refresh_recent_index(self):
+        """Carga incrementalmente en el índice las menciones procesadas desde la última sincronización."""
+        if time.monotonic() - self._recent_synced_at < RECENT_INDEX_REFRESH_SECONDS:
+            return
+        try:
+            collection = self.db.collection(self.collection_name)
+            if self._recent_watermark is None:
+                # Primera carga: las más recientes de la ventana (el índice está acotado a `max_items`)
+                since = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=RECENT_INDEX_MAX_DAYS)
+                query = collection.where("processed_at", ">", since)\
+                    .order_by("processed_at", direction=firestore.Query.DESCENDING)
+            else:
+                query = collection.where("processed_at", ">", self._recent_watermark).order_by("processed_at")
+            docs = query.limit(self._recent.max_items).stream(timeout=request_timeout(FIRESTORE_TIMEOUT_SECONDS))
+            for doc in docs:
+                data = doc.to_dict()
+                if self._recent_watermark is None or data["processed_at"] > self._recent_watermark:
+                    self._recent_watermark = data["processed_at"]
+                # Las descartadas por relevancia no son contexto de la marca
+                if not data.get("relevance_dropped"):
+                    self._recent.add(doc.id, data)
+            self._recent_synced_at = time.monotonic()
+        except Exception as e:
+            logging.error(f"Error cargando contexto reciente: {e}")
+
+    def get_recent_context(self, query: str = "", days: int = 7, limit: int = 10) -> List[Dict[str, Any]]:
+        """Busca menciones ya procesadas recientemente para dar contexto histórico.
+        Args:
+            query: Palabras clave (ej: 'caída app', 'fraude', 'negativo'). Vacío = las más recientes.
+            days: Ventana de tiempo hacia atrás, en días.
+            limit: Máximo de menciones a devolver.
+        """
+        if self.db:
+            self._refresh_recent_index()
+        
+        results = self._recent.search(query, days=days, limit=limit)
+        for r in results:
+            r["processed_at"] = r["processed_at"].isoformat()
+        return results
+
+    def get_accepted_texts(self, days: int = 30, limit: int = 300) -> List[str]:
+        """Textos de las menciones recientes que el análisis aceptó (perfil de relevancia, ver relevance.py)."""
+        if self.db:
+            self._refresh_recent_index()
+        return [
+            " ".join(filter(None, [r.get("title"), r.get("snippet"), r.get("summary")]))
+            for r in self._recent.search("", days=days, limit=limit) if r.get("tag")
+        ]
+
+    def save_daily_summary(self, score: int, state: str = None, sentiment: Dict[str, int] = None,
+                           when: datetime.datetime = None, doc_id: str = None, tokens: Dict[str, Any] = None):
+        """Guarda el Brand Health Index del día (y el estado y mezcla de sentimiento si se conocen).
+
+        `when` y `doc_id` permiten a replay.py reescribir días pasados de forma idempotente.
+        `tokens` son los totales de Gemini de la corrida (ver prompt_compaction.TokenLedger).
+        """
         if not self.db: return
         
         try:
             # Usamos timestamp como ID para historial cronológico
-            doc_ref = self.db.collection(self.history_collection).document()
+            doc_ref = self.db.collection(self.history_collection).document(doc_id) if doc_id \
+                else self.db.collection(self.history_collection).document()
             doc_ref.set({
-                "timestamp": firestore.SERVER_TIMESTAMP,
+                "timestamp": when or firestore.SERVER_TIMESTAMP,
                 "brand_index": score,
-                "date_str": datetime.datetime.now().strftime("%Y-%m-%d")
-            })
+                "state": state,
+                "sentiment": sentiment or {},
+                "tokens": tokens or {},
+                "date_str": (when or datetime.datetime.now()).strftime("%Y-%m-%d")
+            }, timeout=request_timeout(FIRESTORE_TIMEOUT_SECONDS))
         except Exception as e:
             logging.error(f"Error guardando historial: {e}")
 
+    def find_summary(self, since: datetime.datetime, until: datetime.datetime) -> Optional[str]:
+        """Id del punto de historial guardado entre `since` y `until` (ej: el de una corrida grabada), si existe."""
+        if not self.db: return None
+
+        try:
+            docs = self.db.collection(self.history_collection)\
+                .where("timestamp", ">=", since)\
+                .where("timestamp", "<", until)\
+                .limit(1)\
+                .stream(timeout=request_timeout(FIRESTORE_TIMEOUT_SECONDS))
+            return next((doc.id for doc in docs), None)
+        except Exception as e:
+            logging.error(f"Error consultando historial: {e}")
+            return None
+
     def get_history_stats(self, limit: int = 10) -> List[Dict[str, Any]]:
         """Recupera el historial de Brand Health Index para el gráfico."""
         if not self.db: return []
@@ -67,14 +258,15 @@ class BrandMemory:
             docs = self.db.collection(self.history_collection)\
                 .order_by("timestamp", direction=firestore.Query.DESCENDING)\
                 .limit(limit)\
-                .stream()
+                .stream(timeout=request_timeout(FIRESTORE_TIMEOUT_SECONDS))
             
             history = []
             for doc in docs:
                 data = doc.to_dict()
                 history.append({
                     "date": data.get("timestamp"), # Datetime object
-                    "score": data.get("brand_index", 0)
+                    "score": data.get("brand_index", 0),
+                    "sentiment": data.get("sentiment", {})
                 })
             
             # Reordenamos para que el gráfico vaya de izquierda (pasado) a derecha (presente)
@@ -82,3 +274,31 @@ class BrandMemory:
         except Exception as e:
             logging.error(f"Error recuperando historial: {e}")
             return []
+
+    def get_term_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Recupera el rendimiento histórico por término de búsqueda (para el scheduler)."""
+        if not self.db: return {}
+        
+        try:
+            stats = {}
+            for doc in self.db.collection(self.term_stats_collection).stream(timeout=request_timeout(FIRESTORE_TIMEOUT_SECONDS)):
+                data = doc.to_dict()
+                stats[data.pop("term")] = data
+            return stats
+        except Exception as e:
+            logging.error(f"Error recuperando estadísticas de términos: {e}")
+            return {}
+
+    def save_term_stats(self, stats: Dict[str, Dict[str, Any]]):
+        """Guarda el rendimiento por término en una sola escritura por lotes."""
+        if not self.db or not stats: return
+        
+        try:
+            batch = self.db.batch()
+            for term, data in stats.items():
+                # ID determinístico: los términos pueden contener caracteres no válidos como ID
+                doc_id = hashlib.sha1(term.encode("utf-8")).hexdigest()
+                batch.set(self.db.collection(self.term_stats_collection).document(doc_id), {**data, "term": term})
+            batch.commit(timeout=request_timeout(FIRESTORE_TIMEOUT_SECONDS))
+        except Exception as e:
+            logging.error(f"Error guardando estadísticas de términos: {e}")
@@ -0,0 +1,134 @@
+"""Almacén global de menciones, direccionado por contenido (hash de la URL canónica).
+
+Un mismo artículo de df.cl puede mencionar a Banco de Chile y a BancoEstado;
+antes cada marca lo descargaba, lo guardaba completo en su colección y lo
+verificaba por separado. Aquí se guarda una sola vez, en la colección
+`mentions`: contenido (título, snippet, fuente, fecha), texto extraído (ver
+enrichment.py) y el análisis que no depende de la marca (verificación con
+grounding). Las colecciones de cada marca (`{brand_id}_processed_news`)
+guardan la referencia (`mention_id`), título y snippet (los indexa el contexto
+reciente de la marca) y los juicios propios de la marca: tag, severidad,
+sentimiento, resumen y relevancia. El texto completo no se copia.
+"""
+import time
+import hashlib
+import logging
+import datetime
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, List, Callable, Optional
+
+from enrichment import canonical_url, CACHE_TTL_SECONDS, FETCH_TIMEOUT_SECONDS
+from deadline import request_timeout
+
+MENTIONS_COLLECTION = "mentions"
+VERIFICATION_TTL_SECONDS = 24 * 3600  # Una verificación con grounding se reutiliza durante un día
+CONTENT_FIELDS = ("title", "snippet", "source", "date")
+
+
+def mention_id(url: str) -> str:
+    """Id del documento global: sha256 de la URL canónica."""
+    return hashlib.sha256(canonical_url(url).encode("utf-8")).hexdigest()
+
+
+class MentionStore:
+    """Documentos de `mentions` con un LRU en memoria delante de Firestore (compartido por las marcas del proceso).
+
+    Implementa además el contrato de caché de `Enricher` (`get_many`/`put_many`
+    por URL canónica), de modo que el texto de cada artículo se descarga y se
+    guarda una sola vez para todas las marcas.
+    """
+
+    def __init__(self, db=None, body_ttl_seconds: int = CACHE_TTL_SECONDS, max_items: int = 5000,
+                 clock: Callable[[], float] = time.time):
+        self.db = db
+        # Pasado este plazo el texto se vuelve a descargar (también el vacío de una descarga fallida)
+        self.body_ttl_seconds = body_ttl_seconds
+        self.max_items = max_items
+        self.clock = clock
+        self._docs: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def ref(self, url: str):
+        return self.db.collection(MENTIONS_COLLECTION).document(mention_id(url))
+
+    def _remember(self, doc_id: str, fields: Dict[str, Any]):
+        with self._lock:
+            self._docs[doc_id] = {**self._docs.get(doc_id, {}), **fields}
+            self._docs.move_to_end(doc_id)
+            while len(self._docs) > self.max_items:
+                self._docs.popitem(last=False)
+
+    def get_docs(self, urls: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Documentos guardados para las URLs dadas, por URL (las que no existen se omiten)."""
+        ids = {url: mention_id(url) for url in dict.fromkeys(urls)}
+        found, missing = {}, []
+        with self._lock:
+            for url, doc_id in ids.items():
+                if doc_id in self._docs:
+                    found[url] = self._docs[doc_id]
+                else:
+                    missing.append(url)
+        if self.db and missing:
+            try:
+                refs = [self.ref(url) for url in missing]
+                by_id = {ids[url]: url for url in missing}
+                for doc in self.db.get_all(refs, timeout=request_timeout(FETCH_TIMEOUT_SECONDS)):
+                    if doc.exists:
+                        data = {k: v.timestamp() if isinstance(v, datetime.datetime) else v
+                                for k, v in doc.to_dict().items()}
+                        self._remember(doc.id, data)
+                        found[by_id[doc.id]] = data
+            except Exception as e:
+                logging.warning(f"Error leyendo el almacén de menciones: {e}")
+        return found
+
+    def _write(self, fields_by_url: Dict[str, Dict[str, Any]]):
+        for url, fields in fields_by_url.items():
+            self._remember(mention_id(url), fields)
+        if not self.db or not fields_by_url:
+            return
+        try:
+            writes = self.db.batch()
+            for url, fields in fields_by_url.items():
+                stored = {k: _timestamp(v) if k.endswith("_at") else v for k, v in fields.items()}
+                writes.set(self.ref(url), stored, merge=True)
+            writes.commit(timeout=request_timeout(FETCH_TIMEOUT_SECONDS))
+        except Exception as e:
+            logging.warning(f"Error guardando en el almacén de menciones: {e}")
+
+    # Contrato de caché de Enricher: {URL canónica: texto}
+    def get_many(self, urls: List[str]) -> Dict[str, str]:
+        now = self.clock()
+        bodies = {}
+        for url, doc in self.get_docs(urls).items():
+            body = doc.get("body")
+            if body is not None and doc.get("body_fetched_at", 0) + self.body_ttl_seconds > now:
+                bodies[url] = body
+        return bodies
+
+    def put_many(self, bodies: Dict[str, str]):
+        now = self.clock()
+        self._write({url: {"url": canonical_url(url), "body": body, "body_fetched_at": now}
+                     for url, body in bodies.items()})
+
+    def verifications(self, urls: List[str]) -> Dict[str, bool]:
+        """Verificaciones con grounding vigentes (hechas por cualquier marca), por URL."""
+        now = self.clock()
+        return {url: doc["verified"] for url, doc in self.get_docs(urls).items()
+                if doc.get("verified") is not None and doc.get("verified_at", 0) + VERIFICATION_TTL_SECONDS > now}
+
+    def save_verifications(self, verified: Dict[str, bool]):
+        now = self.clock()
+        self._write({url: {"url": canonical_url(url), "verified": value, "verified_at": now}
+                     for url, value in verified.items()})
+
+    def content(self, mention, brand_id: str) -> Dict[str, Any]:
+        """Campos neutros de la mención para `set(..., merge=True)`; registra qué marcas la referencian."""
+        from google.cloud import firestore
+        return {"url": canonical_url(mention.link), **{k: getattr(mention, k) for k in CONTENT_FIELDS},
+                "brands": firestore.ArrayUnion([brand_id]), "updated_at": firestore.SERVER_TIMESTAMP}
+
+
+def _timestamp(value: Optional[float]):
+    return datetime.datetime.fromtimestamp(value, datetime.timezone.utc) if isinstance(value, (int, float)) else value
@@ -0,0 +1,182 @@
+"""Lotes tipados de menciones compartidos por todas las etapas del pipeline.
+
+Las ejecuciones normales (decenas de menciones) usan `MentionBatch`, una lista
+de registros `Mention` con slots. Los backfills y ejecuciones multi-marca
+(miles de menciones) usan `ColumnarMentionBatch`, respaldado por un DataFrame
+de pandas, con filtrado, deduplicación y ordenamiento vectorizados. Ambos
+exponen la misma interfaz; `make_batch` elige según el tamaño.
+"""
+from dataclasses import dataclass, field, fields, asdict
+from typing import List, Dict, Any, Iterable, Iterator
+
+# Sobre este tamaño conviene la representación columnar
+COLUMNAR_THRESHOLD = 1000
+
+
+@dataclass(slots=True)
+class Mention:
+    title: str
+    link: str
+    snippet: str = None
+    date: str = None
+    source: str = None
+    matched_terms: List[str] = field(default_factory=list)
+    # Texto principal del artículo, truncado (ver enrichment.py)
+    body: str = None
+    # Similitud con el perfil de la marca (ver relevance.py)
+    relevance: float = None
+    # Resultado del análisis por mención (ver analysis.py)
+    tag: str = None
+    severity: str = None
+    sentiment: str = None
+    summary: str = None
+
+    def get(self, key: str, default=None):
+        """Acceso estilo dict para las etapas y tools que reciben menciones como dicts."""
+        value = getattr(self, key, None)
+        return default if value is None else value
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, item: Dict[str, Any]) -> "Mention":
+        return cls(**{name: item.get(name) for name in MENTION_FIELDS if item.get(name) is not None})
+
+
+MENTION_FIELDS = [f.name for f in fields(Mention)]
+
+
+class MentionBatch:
+    """Lote pequeño: lista de registros `Mention`."""
+
+    def __init__(self, mentions: List[Mention] = None):
+        self.mentions = mentions or []
+
+    @classmethod
+    def from_dicts(cls, items: Iterable[Dict[str, Any]]) -> "MentionBatch":
+        return cls([Mention.from_dict(i) for i in items if i.get("link") and i.get("title")])
+
+    def __len__(self):
+        return len(self.mentions)
+
+    def __iter__(self) -> Iterator[Mention]:
+        return iter(self.mentions)
+
+    def links(self) -> List[str]:
+        return [m.link for m in self.mentions]
+
+    def exclude_links(self, links) -> "MentionBatch":
+        links = set(links)
+        return MentionBatch([m for m in self.mentions if m.link not in links])
+
+    def where(self, mask) -> "MentionBatch":
+        return MentionBatch([m for m, keep in zip(self.mentions, mask) if keep])
+
+    def dedup(self) -> "MentionBatch":
+        seen = set()
+        unique = []
+        for m in self.mentions:
+            if m.link not in seen:
+                seen.add(m.link)
+                unique.append(m)
+        return MentionBatch(unique)
+
+    def sort(self, by: str, ascending: bool = False) -> "MentionBatch":
+        return MentionBatch(sorted(self.mentions, key=lambda m: getattr(m, by) or 0, reverse=not ascending))
+
+    def column(self, name: str) -> List[Any]:
+        return [getattr(m, name) for m in self.mentions]
+
+    def assign(self, name: str, values: List[Any]):
+        for m, value in zip(self.mentions, values):
+            setattr(m, name, value)
+
+    def to_records(self) -> List[Dict[str, Any]]:
+        return [m.to_dict() for m in self.mentions]
+
+    def to_dataframe(self):
+        import pandas as pd
+        return pd.DataFrame.from_records(self.to_records(), columns=MENTION_FIELDS)
+
+    def to_arrow(self):
+        import pyarrow as pa
+        return pa.Table.from_pylist(self.to_records())
+
+    def iter_chunks(self, size: int) -> Iterator["MentionBatch"]:
+        for start in range(0, len(self.mentions), size):
+            yield MentionBatch(self.mentions[start:start + size])
+
+
+def _none_if_nan(value):
+    return None if isinstance(value, float) and value != value else value
+
+
+class ColumnarMentionBatch:
+    """Lote grande respaldado por un DataFrame (una columna por campo de `Mention`)."""
+
+    def __init__(self, frame):
+        self.frame = frame
+
+    @classmethod
+    def from_dicts(cls, items: Iterable[Dict[str, Any]]) -> "ColumnarMentionBatch":
+        import pandas as pd
+        frame = pd.DataFrame.from_records(list(items), columns=MENTION_FIELDS)
+        frame = frame[frame["link"].notna() & frame["title"].notna()].reset_index(drop=True)
+        frame["matched_terms"] = frame["matched_terms"].map(lambda v: v if isinstance(v, list) else [])
+        # Columnas de baja cardinalidad como categorías: mantiene plano el uso de memoria
+        frame["source"] = frame["source"].astype("category")
+        return cls(frame)
+
+    def __len__(self):
+        return len(self.frame)
+
+    def __iter__(self) -> Iterator[Mention]:
+        for row in self.frame.itertuples(index=False):
+            yield Mention.from_dict({k: _none_if_nan(v) for k, v in row._asdict().items()})
+
+    def links(self) -> List[str]:
+        return self.frame["link"].tolist()
+
+    def exclude_links(self, links) -> "ColumnarMentionBatch":
+        return ColumnarMentionBatch(self.frame[~self.frame["link"].isin(list(links))])
+
+    def where(self, mask) -> "ColumnarMentionBatch":
+        import numpy as np
+        return ColumnarMentionBatch(self.frame[np.asarray(mask, dtype=bool)])
+
+    def dedup(self) -> "ColumnarMentionBatch":
+        return ColumnarMentionBatch(self.frame.drop_duplicates(subset="link"))
+
+    def sort(self, by: str, ascending: bool = False) -> "ColumnarMentionBatch":
+        return ColumnarMentionBatch(self.frame.sort_values(by, ascending=ascending, na_position="last"))
+
+    def column(self, name: str) -> List[Any]:
+        return self.frame[name].tolist()
+
+    def assign(self, name: str, values: List[Any]):
+        self.frame[name] = values
+
+    def to_records(self) -> List[Dict[str, Any]]:
+        frame = self.frame.astype(object).where(self.frame.notna(), None)
+        return frame.to_dict("records")
+
+    def to_dataframe(self):
+        # Sin copia: las etapas que trabajan en pandas operan sobre el mismo frame
+        return self.frame
+
+    def to_arrow(self):
+        import pyarrow as pa
+        return pa.Table.from_pandas(self.frame, preserve_index=False)
+
+    def iter_chunks(self, size: int) -> Iterator["ColumnarMentionBatch"]:
+        for start in range(0, len(self.frame), size):
+            yield ColumnarMentionBatch(self.frame.iloc[start:start + size])
+
+
+def make_batch(items: Iterable[Dict[str, Any]], columnar: bool = None):
+    """Crea el lote adecuado: columnar sobre `COLUMNAR_THRESHOLD` menciones (o si se fuerza)."""
+    items = items if isinstance(items, list) else list(items)
+    if columnar is None:
+        columnar = len(items) >= COLUMNAR_THRESHOLD
+    return ColumnarMentionBatch.from_dicts(items) if columnar else MentionBatch.from_dicts(items)
@@ -0,0 +1,282 @@
+"""Compilador de prompts: arma una sola vez la instrucción de sistema estática por marca.
+
+La instrucción (persona + reglas + tarea del reporte + instrucciones/formato)
+se versiona por hash de (marca, archivos de prompts, modelo), se guarda como
+artefacto JSON y se registra en el context caching de Vertex AI, de modo que
+cada llamada solo envía la lista dinámica de menciones.
+
+Vertex AI rechaza cachés por debajo de un mínimo de tokens por modelo: una
+instrucción más corta que `CACHE_MIN_TOKENS` no se intenta registrar, y si el
+caché la rechaza igual por ese mínimo, el bundle queda marcado como no
+cacheable (también en el artefacto) para no repetir la llamada en cada
+ejecución. Cualquier otro error (red, 429, permisos) solo afecta a esa
+llamada, que se hace sin caché; la siguiente lo vuelve a intentar.
+
+Hoy la instrucción estática ronda los 1.100 tokens, bajo el mínimo: en
+producción no se usa context caching y el ahorro reportado es 0 hasta que
+la instrucción crezca (o se baje `PROMPT_CACHE_MIN_TOKENS` para un modelo
+con un mínimo menor).
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+import datetime
+import threading
+from functools import lru_cache
+from typing import Dict, Any, Tuple
+
+import yaml
+
+PROMPTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "prompts")
+PROMPT_FILES = ("persona", "rules", "report", "instructions")
+BUNDLE_DIR = os.environ.get("PROMPT_BUNDLE_DIR", ".prompt_bundles")
+CACHE_TTL_SECONDS = int(os.environ.get("PROMPT_CACHE_TTL_SECONDS", 3600))
+# Mínimo de tokens que Vertex AI acepta en un context cache (gemini-2.5-pro: 2048; margen por la estimación)
+CACHE_MIN_TOKENS = int(os.environ.get("PROMPT_CACHE_MIN_TOKENS", 4096))
+
+
+def _below_cache_minimum(exc: Exception) -> bool:
+    # Mensaje de Vertex AI: "The minimum token count to start caching is 2048."
+    return "minimum token count" in str(exc).lower()
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimación rápida (~4 caracteres por token) cuando no hay respuesta del modelo."""
+    return len(text or "") // 4
+
+
+@lru_cache(maxsize=None)
+def load_prompt_files() -> Tuple[Dict[str, str], str]:
+    """Lee prompts/*.yaml una sola vez por proceso. Devuelve (textos, hash de los archivos)."""
+    texts, digest = {}, hashlib.sha256()
+    for name in PROMPT_FILES:
+        with open(os.path.join(PROMPTS_DIR, f"{name}.yaml"), "rb") as f:
+            raw = f.read()
+        digest.update(raw)
+        texts.update(yaml.safe_load(raw))
+    return texts, digest.hexdigest()
+
+
+def _fill(template: str, brand: Dict[str, Any]) -> str:
+    # Reemplazo explícito: las plantillas contienen CSS/HTML con llaves que no son placeholders
+    return template\
+        .replace("{brand_name}", brand['name'])\
+        .replace("{competitors}", ", ".join(brand.get('competitors', [])))\
+        .replace("{tech_focus}", brand.get('tech_focus', ""))
+
+
+def agent_instructions(brand: Dict[str, Any]) -> str:
+    """Instrucciones combinadas para BrandMonitoringAgent (persona + reglas + instrucciones)."""
+    texts, _ = load_prompt_files()
+    return _fill(f"{texts['persona']}\n\n{texts['rules']}\n\n{texts['instructions']}\n\n{texts['output_format_html']}", brand)
+
+
+class PromptBundle:
+    def __init__(self, brand_id: str, version: str, prompt_hash: str, system_instruction: str,
+                 cache_name: str = None, cache_expires_at: float = 0.0, cacheable: bool = None):
+        self.brand_id = brand_id
+        self.version = version
+        self.prompt_hash = prompt_hash
+        self.system_instruction = system_instruction
+        self.static_tokens = estimate_tokens(system_instruction)
+        self.cache_name = cache_name
+        self.cache_expires_at = cache_expires_at
+        # None: aún no se intentó; False: bajo el mínimo de tokens del caché (no se reintenta)
+        self.cacheable = cacheable
+
+    @property
+    def cache_valid(self) -> bool:
+        # Margen de 60s para no usar un caché que expira a mitad de la llamada
+        return bool(self.cache_name) and self.cache_expires_at - 60 > time.time()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "brand_id": self.brand_id,
+            "version": self.version,
+            "prompt_hash": self.prompt_hash,
+            "static_tokens": self.static_tokens,
+            "cache_name": self.cache_name,
+            "cache_expires_at": self.cache_expires_at,
+            "cacheable": self.cacheable,
+            "system_instruction": self.system_instruction,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "PromptBundle":
+        return cls(data["brand_id"], data["version"], data["prompt_hash"], data["system_instruction"],
+                   data.get("cache_name"), data.get("cache_expires_at", 0.0), data.get("cacheable"))
+
+
+def compile_bundle(brand: Dict[str, Any], model_name: str) -> PromptBundle:
+    texts, prompt_hash = load_prompt_files()
+    system_instruction = _fill("\n\n".join([
+        texts['persona'], texts['rules'], texts['report'], texts['instructions'],
+    ]), brand)
+    brand_fields = json.dumps({k: brand.get(k) for k in ("id", "name", "competitors", "tech_focus")}, sort_keys=True)
+    version = hashlib.sha256(f"{brand_fields}\n{prompt_hash}\n{model_name}".encode("utf-8")).hexdigest()[:16]
+    return PromptBundle(brand['id'], version, prompt_hash, system_instruction)
+
+
+class VertexContextCache:
+    """Registra la instrucción de sistema en el context caching de Vertex AI."""
+
+    def create(self, model_name: str, system_instruction: str, tools, ttl_seconds: int) -> Tuple[str, float]:
+        from vertexai.preview import caching
+        cached = caching.CachedContent.create(
+            model_name=model_name,
+            system_instruction=system_instruction,
+            tools=tools,
+            ttl=datetime.timedelta(seconds=ttl_seconds),
+        )
+        return cached.name, cached.expire_time.timestamp()
+
+    def model(self, cache_name: str):
+        from vertexai.preview.generative_models import GenerativeModel
+        return GenerativeModel.from_cached_content(cached_content=cache_name)
+
+
+class _LocalResponse:
+    def __init__(self, text: str, prompt_tokens: int, cached_tokens: int):
+        self.text = text
+        self.usage_metadata = type("UsageMetadata", (), {
+            "prompt_token_count": prompt_tokens,
+            "cached_content_token_count": cached_tokens,
+            "candidates_token_count": estimate_tokens(text),
+        })()
+
+
+class LocalContextCache:
+    """Sustituto offline del context caching para pruebas locales.
+
+    `responder(system_instruction, prompt)` genera el texto de la respuesta;
+    por defecto devuelve un análisis JSON mínimo y válido. Como Vertex AI,
+    rechaza instrucciones de menos de `min_tokens` tokens.
+    """
+
+    def __init__(self, responder=None, min_tokens: int = 0):
+        self.responder = responder or (lambda system, prompt: json.dumps({
+            "state": "Estable", "score": 100, "analysis": "Reporte local.", "recommendation": "-",
+            "tech_insight": "-", "mentions": [],
+        }))
+        self.min_tokens = min_tokens
+        self.entries: Dict[str, str] = {}
+        self.created = 0
+
+    def create(self, model_name: str, system_instruction: str, tools, ttl_seconds: int) -> Tuple[str, float]:
+        self.created += 1
+        if estimate_tokens(system_instruction) < self.min_tokens:
+            raise ValueError(f"The cached content is of {estimate_tokens(system_instruction)} tokens. "
+                             f"The minimum token count to start caching is {self.min_tokens}.")
+        name = f"local/{hashlib.sha256(system_instruction.encode('utf-8')).hexdigest()[:16]}"
+        self.entries[name] = system_instruction
+        return name, time.time() + ttl_seconds
+
+    def model(self, cache_name: str):
+        system_instruction = self.entries[cache_name]
+        cache = self
+
+        class _LocalModel:
+            def generate_content(self, prompt, **kwargs):
+                static = estimate_tokens(system_instruction)
+                return _LocalResponse(cache.responder(system_instruction, prompt), static + estimate_tokens(prompt), static)
+
+        return _LocalModel()
+
+
+def cache_backend_from_env():
+    backend = os.environ.get("PROMPT_CACHE_BACKEND", "vertex")
+    if backend == "local":
+        return LocalContextCache()
+    if backend == "none":
+        return None
+    return VertexContextCache()
+
+
+class PromptCompiler:
+    """Compila, persiste y registra en caché los bundles de prompts por marca."""
+
+    def __init__(self, model_name: str, cache=None, bundle_dir: str = BUNDLE_DIR, ttl_seconds: int = CACHE_TTL_SECONDS,
+                 min_cache_tokens: int = CACHE_MIN_TOKENS):
+        self.model_name = model_name
+        self.cache = cache
+        self.min_cache_tokens = min_cache_tokens
+        self.bundle_dir = bundle_dir
+        self.ttl_seconds = ttl_seconds
+        self._bundles: Dict[str, PromptBundle] = {}
+        self._models: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def _artifact_path(self, bundle: PromptBundle) -> str:
+        return os.path.join(self.bundle_dir, bundle.brand_id, f"{bundle.version}.json")
+
+    def _load_or_compile(self, brand: Dict[str, Any]) -> PromptBundle:
+        bundle = compile_bundle(brand, self.model_name)
+        known = self._bundles.get(bundle.version)
+        if known:
+            return known
+        try:
+            with open(self._artifact_path(bundle), "r", encoding="utf-8") as f:
+                bundle = PromptBundle.from_dict(json.load(f))
+        except FileNotFoundError:
+            self._save(bundle)
+            logging.info(f"🧱 Bundle de prompts compilado: {bundle.brand_id}@{bundle.version} (~{bundle.static_tokens} tokens estáticos)")
+        self._bundles[bundle.version] = bundle
+        return bundle
+
+    def _save(self, bundle: PromptBundle):
+        try:
+            os.makedirs(os.path.dirname(self._artifact_path(bundle)), exist_ok=True)
+            with open(self._artifact_path(bundle), "w", encoding="utf-8") as f:
+                json.dump(bundle.to_dict(), f, ensure_ascii=False, indent=2)
+        except OSError as e:
+            logging.warning(f"No se pudo guardar el bundle de prompts: {e}")
+
+    def model_for(self, brand: Dict[str, Any], tools=None, fallback=None):
+        """Devuelve (modelo, bundle). Si el caché no está disponible, usa `fallback(system_instruction)`."""
+        with self._lock:
+            bundle = self._load_or_compile(brand)
+            if self.cache and bundle.cacheable is None and bundle.static_tokens < self.min_cache_tokens:
+                logging.info(f"🗄️ Instrucción de ~{bundle.static_tokens} tokens bajo el mínimo del context cache "
+                             f"({self.min_cache_tokens}): se envía completa")
+                bundle.cacheable = False
+                self._save(bundle)
+            if self.cache and bundle.cacheable is not False and not bundle.cache_valid:
+                try:
+                    bundle.cache_name, bundle.cache_expires_at = self.cache.create(
+                        self.model_name, bundle.system_instruction, tools, self.ttl_seconds)
+                    bundle.cacheable = True
+                    logging.info(f"🗄️ Instrucción registrada en context cache: {bundle.cache_name}")
+                    self._save(bundle)
+                except Exception as e:
+                    logging.warning(f"Context caching no disponible, se envía la instrucción completa: {e}")
+                    bundle.cache_name = None
+                    # Solo el rechazo por mínimo de tokens es definitivo; un error transitorio se reintenta
+                    if _below_cache_minimum(e):
+                        bundle.cacheable = False
+                        self._save(bundle)
+
+            if bundle.cache_valid:
+                if bundle.cache_name not in self._models:
+                    self._models[bundle.cache_name] = self.cache.model(bundle.cache_name)
+                return self._models[bundle.cache_name], bundle
+            return fallback(bundle.system_instruction), bundle
+
+
+def report_usage(response, bundle: PromptBundle, elapsed: float) -> Dict[str, Any]:
+    """Registra tokens de entrada, tokens servidos desde caché y latencia de la llamada."""
+    usage = getattr(response, "usage_metadata", None)
+    prompt_tokens = getattr(usage, "prompt_token_count", 0) or 0
+    cached_tokens = getattr(usage, "cached_content_token_count", 0) or 0
+    report = {
+        "bundle": bundle.version,
+        "prompt_tokens": prompt_tokens,
+        "cached_tokens": cached_tokens,
+        "output_tokens": getattr(usage, "candidates_token_count", 0) or 0,
+        "saved_ratio": round(cached_tokens / prompt_tokens, 3) if prompt_tokens else 0.0,
+        "latency_s": round(elapsed, 2),
+    }
+    logging.info(f"📊 Uso de tokens: {prompt_tokens} entrada ({cached_tokens} desde caché, "
+                 f"{report['saved_ratio']:.0%} ahorrado), {report['output_tokens']} salida, {elapsed:.1f}s")
+    return report
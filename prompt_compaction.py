@@ -0,0 +1,189 @@
+"""Compactación del prompt de análisis y contabilidad de tokens de la corrida.
+
+Cada mención viaja al modelo con un alias corto (`[R3]`) y el dominio de la
+fuente en lugar de la URL completa: las URLs de seguimiento costaban tokens
+y el modelo a veces las alteraba al citarlas. Los alias que el modelo usa en
+sus textos se reemplazan por los enlaces reales al generar el HTML. Títulos,
+extractos y textos se normalizan y se recortan a un presupuesto de tokens
+por mención; el prompt se mide antes de enviarlo y, si excede
+`PROMPT_MAX_TOKENS`, se achica el presupuesto por mención. La medición usa la
+estimación local mientras quede holgadamente bajo el máximo; cerca de él se
+consulta `count_tokens` de Vertex AI, bajo el limitador y el deadline.
+
+El uso de tokens de cada llamada a Gemini (análisis y verificación) se
+acumula en el `TokenLedger` de la corrida, que se registra en los logs y en
+el historial de la marca.
+"""
+import os
+import re
+import html
+import logging
+import threading
+import contextvars
+from typing import Any, Callable, Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+from prompt_bundle import estimate_tokens
+from deadline import run_with_timeout, request_timeout
+from ratelimit import LIMITER
+
+ITEM_TOKEN_BUDGET = int(os.environ.get("PROMPT_ITEM_TOKENS", 400))
+MIN_ITEM_TOKENS = 60
+PROMPT_MAX_TOKENS = int(os.environ.get("PROMPT_MAX_TOKENS", 30000))
+TITLE_TOKENS = 40
+SNIPPET_TOKENS = 80
+LINE_OVERHEAD_TOKENS = 12  # Alias, fecha, fuente y rótulos de cada mención
+COUNT_TOKENS_TIMEOUT_SECONDS = 5
+# Bajo esta fracción del máximo la estimación local basta y no se llama a count_tokens
+COUNT_TOKENS_ESTIMATE_SHARE = 0.6
+CHARS_PER_TOKEN = 4  # Misma estimación que prompt_bundle.estimate_tokens
+
+ALIAS_RE = re.compile(r"\[R(\d+)\]")
+_INVISIBLE_RE = re.compile("[\u200b-\u200f\u2060\ufeff\u00ad]")
+
+
+def alias(ref: int) -> str:
+    return f"R{ref}"
+
+
+def source_label(url: str) -> str:
+    """Dominio de la URL, sin www (ej: df.cl)."""
+    return urlsplit(url or "").netloc.lower().removeprefix("www.") or "fuente desc."
+
+
+def normalize(text: Optional[str]) -> str:
+    """Texto en una línea: entidades HTML resueltas, sin caracteres invisibles ni espacios repetidos."""
+    return " ".join(_INVISIBLE_RE.sub("", html.unescape(text or "")).split())
+
+
+def trim_to_tokens(text: str, tokens: int) -> str:
+    """Recorta `text` (en un límite de palabra) para que quepa en `tokens` estimados."""
+    limit = max(0, tokens) * CHARS_PER_TOKEN
+    if len(text) <= limit:
+        return text
+    return (text[:limit].rsplit(" ", 1)[0] + "…") if limit else ""
+
+
+def compact_mention(ref: int, mention, budget: int = ITEM_TOKEN_BUDGET) -> str:
+    """Bloque de una mención para el prompt, dentro de `budget` tokens estimados."""
+    title = trim_to_tokens(normalize(mention.title), min(TITLE_TOKENS, budget // 3))
+    body = normalize(mention.body)
+    snippet = normalize(mention.snippet)
+    # El extracto del buscador suele ser el inicio del artículo: si el texto ya lo trae, sobra
+    if snippet and body and snippet.rstrip("….").strip()[:80] in body:
+        snippet = ""
+    snippet = trim_to_tokens(snippet, min(SNIPPET_TOKENS, budget // 3))
+    remaining = budget - LINE_OVERHEAD_TOKENS - estimate_tokens(title) - estimate_tokens(snippet)
+    body = trim_to_tokens(body, remaining)
+
+    block = f"[{alias(ref)}] ({mention.get('date') or 'Fecha desc.'}) {title} · {source_label(mention.link)}\n"
+    if snippet:
+        block += f"   Extracto: {snippet}\n"
+    if body:
+        block += f"   Texto: {body}\n"
+    return block
+
+
+def fit_prompt(build: Callable[[int], str], count: Callable[[str], int], max_tokens: int = PROMPT_MAX_TOKENS,
+               budget: int = ITEM_TOKEN_BUDGET) -> Tuple[str, int, int]:
+    """Arma el prompt y achica el presupuesto por mención hasta que quepa en `max_tokens`.
+
+    Devuelve (prompt, tokens medidos, presupuesto por mención usado).
+    """
+    prompt = build(budget)
+    tokens = count(prompt)
+    while tokens > max_tokens and budget > MIN_ITEM_TOKENS:
+        budget = max(MIN_ITEM_TOKENS, int(budget * max_tokens / tokens * 0.9))
+        prompt = build(budget)
+        tokens = count(prompt)
+    if tokens > max_tokens:
+        logging.warning(f"✂️ El prompt sigue excediendo el máximo ({tokens} > {max_tokens} tokens) con el presupuesto mínimo")
+    return prompt, tokens, budget
+
+
+def count_tokens(model, prompt: str, max_tokens: int = PROMPT_MAX_TOKENS) -> int:
+    """Tokens del prompt: la estimación local si queda lejos de `max_tokens`; si no, `count_tokens` del modelo."""
+    estimate = estimate_tokens(prompt)
+    if estimate < max_tokens * COUNT_TOKENS_ESTIMATE_SHARE:
+        return estimate
+    try:
+        # Es una solicitud a Vertex AI: usa la cuota compartida y el tiempo de la etapa en curso
+        response = LIMITER.call("vertex", lambda: run_with_timeout(
+            lambda: model.count_tokens(prompt), request_timeout(COUNT_TOKENS_TIMEOUT_SECONDS)),
+            timeout=request_timeout(COUNT_TOKENS_TIMEOUT_SECONDS))
+        return response.total_tokens
+    except Exception as e:
+        logging.debug(f"count_tokens no disponible, se estima: {str(e) or type(e).__name__}")
+        return estimate
+
+
+def restore_links(text: str, links: Dict[int, str]) -> str:
+    """Reemplaza los alias `[R3]` de un texto ya escapado por enlaces a la URL real (los desconocidos quedan igual)."""
+    def link(match):
+        url = links.get(int(match.group(1)))
+        if not url:
+            return match.group(0)
+        return f'<a href="{html.escape(url)}" target="_blank">[{html.escape(source_label(url))}]</a>'
+    return ALIAS_RE.sub(link, text)
+
+
+def strip_aliases(text: Optional[str]) -> Optional[str]:
+    """Quita los alias de un texto que se guarda fuera del reporte (memoria)."""
+    return " ".join(re.sub(r"\s*" + ALIAS_RE.pattern, "", text).split()) if text else text
+
+
+class TokenLedger:
+    """Tokens de entrada, caché y salida de todas las llamadas a Gemini de una corrida.
+
+    Usado como context manager, pasa a ser el registro vigente para
+    `record_usage` (también en los hilos lanzados con `deadline.submit`) y al
+    salir registra los totales en el log.
+    """
+
+    def __init__(self, name: str = "run"):
+        self.name = name
+        self.calls: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+        self._token = None
+
+    def add(self, call: str, input_tokens: int, output_tokens: int, cached_tokens: int = 0):
+        with self._lock:
+            entry = self.calls.setdefault(call, {"calls": 0, "input": 0, "cached": 0, "output": 0})
+            entry["calls"] += 1
+            entry["input"] += input_tokens
+            entry["cached"] += cached_tokens
+            entry["output"] += output_tokens
+
+    def totals(self) -> Dict[str, Any]:
+        with self._lock:
+            totals = {key: sum(entry[key] for entry in self.calls.values()) for key in ("calls", "input", "cached", "output")}
+            return {**totals, "by_call": {call: dict(entry) for call, entry in self.calls.items()}}
+
+    def __enter__(self) -> "TokenLedger":
+        self._token = _CURRENT.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _CURRENT.reset(self._token)
+        totals = self.totals()
+        if totals["calls"]:
+            detail = ", ".join(f"{call} {e['input']}/{e['output']}" for call, e in totals["by_call"].items())
+            logging.info(f"🧾 Tokens de la corrida '{self.name}': {totals['input']} entrada ({totals['cached']} desde caché), "
+                         f"{totals['output']} salida en {totals['calls']} llamadas ({detail})")
+
+
+_CURRENT: contextvars.ContextVar = contextvars.ContextVar("token_ledger", default=None)
+
+
+def current_ledger() -> Optional[TokenLedger]:
+    return _CURRENT.get()
+
+
+def record_usage(call: str, response) -> None:
+    """Suma el `usage_metadata` de una respuesta de Gemini al registro de la corrida vigente (si hay)."""
+    ledger = current_ledger()
+    usage = getattr(response, "usage_metadata", None)
+    if ledger is None or usage is None:
+        return
+    ledger.add(call, getattr(usage, "prompt_token_count", 0) or 0, getattr(usage, "candidates_token_count", 0) or 0,
+               getattr(usage, "cached_content_token_count", 0) or 0)
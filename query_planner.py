@@ -0,0 +1,205 @@
+import json
+import logging
+import re
+import unicodedata
+from dataclasses import dataclass, field, asdict
+from contextlib import nullcontext
+from typing import List, Dict, Any, Callable, Iterable
+
+from tools import serpapi_search, SOURCE_CLAUSES, SERPAPI_PAGE_SIZE
+from ratelimit import escalate, Priority
+from enrichment import canonical_url
+
+# Límites de Google/SerpApi: Google ignora las palabras después de la 32 (los
+# operadores OR y site: cuentan) y SerpApi acepta como máximo num=100.
+MAX_QUERY_WORDS = 32
+MAX_QUERY_CHARS = 500
+MAX_NUM = 100
+
+
+def normalize_text(text: str) -> str:
+    """Minúsculas, sin tildes y solo caracteres alfanuméricos separados por un espacio."""
+    if not text:
+        return ""
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return re.sub(r"[^a-z0-9]+", " ", text.lower()).strip()
+
+
+def build_query(source: str, terms: List[str]) -> str:
+    """Construye la consulta combinada `(site:...) ("term1" OR "term2")`.
+
+    Un término solo va sin comillas, igual que la antigua consulta por término.
+    En un grupo, las comillas son necesarias: OR une solo las palabras vecinas,
+    y `Banco de Chile OR Cuenta FAN` buscaría `Banco de (Chile OR Cuenta) FAN`.
+    """
+    if len(terms) == 1:
+        return f"{SOURCE_CLAUSES[source]} {terms[0]}"
+    clause = " OR ".join(f'"{term}"' for term in terms)
+    return f"{SOURCE_CLAUSES[source]} ({clause})"
+
+
+def _fits(query: str, max_words: int, max_chars: int) -> bool:
+    return len(query.split()) <= max_words and len(query) <= max_chars
+
+
+@dataclass
+class QueryGroup:
+    source: str
+    terms: List[str]
+    num: int
+    query: str
+    depth: int = 0          # Nivel de subdivisión por saturación (0 = grupo original)
+    results: int = 0
+    saturated: bool = False
+    failed: bool = False    # La llamada falló (solo errores): el grupo no cuenta como consultado
+
+
+@dataclass
+class QueryPlan:
+    terms: List[str]
+    sources: List[str]
+    limits: Dict[str, int]   # Resultados esperados por término (num efectivo por término)
+    groups: List[QueryGroup] = field(default_factory=list)
+
+    @property
+    def call_count(self) -> int:
+        return len(self.groups)
+
+    @property
+    def executed_terms(self) -> List[str]:
+        """Términos consultados con éxito en todas las fuentes (tras `execute_plan`, `groups` solo tiene lo ejecutado)."""
+        covered = {(g.source, t) for g in self.groups if not g.failed for t in g.terms}
+        return [t for t in self.terms if all((source, t) in covered for source in self.sources)]
+
+    @property
+    def naive_call_count(self) -> int:
+        """Llamadas que haría la búsqueda término por término (una por término y fuente)."""
+        return len(self.terms) * len(self.sources)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "terms": self.terms,
+            "limits": self.limits,
+            "call_count": self.call_count,
+            "naive_call_count": self.naive_call_count,
+            "groups": [asdict(g) for g in self.groups],
+        }
+
+    def export(self, path: str):
+        """Escribe el plan en JSON para auditoría."""
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=2)
+
+
+def _make_group(plan: QueryPlan, source: str, terms: List[str], depth: int = 0) -> QueryGroup:
+    return QueryGroup(
+        source=source,
+        terms=terms,
+        num=min(MAX_NUM, sum(plan.limits[t] for t in terms)),
+        query=build_query(source, terms),
+        depth=depth,
+    )
+
+
+def plan_queries(terms: List[str], per_term_limit: int = 5, sources=("financial", "social"),
+                 max_words: int = MAX_QUERY_WORDS, max_chars: int = MAX_QUERY_CHARS,
+                 limits: Dict[str, int] = None) -> QueryPlan:
+    """Empaqueta los términos en el menor número de consultas OR que respetan los límites.
+
+    El empaquetado es voraz y conserva el orden de `terms`, de modo que los
+    términos configurados primero (los más importantes) quedan juntos.
+    `limits` permite fijar la profundidad (resultados) de cada término; si no
+    se indica, todos usan `per_term_limit`.
+    """
+    limits = limits or {}
+    plan = QueryPlan(terms=list(terms), sources=list(sources),
+                     limits={t: limits.get(t, per_term_limit) for t in terms})
+    for source in sources:
+        current: List[str] = []
+        for term in terms:
+            candidate = current + [term]
+            if current and (not _fits(build_query(source, candidate), max_words, max_chars)
+                            or sum(plan.limits[t] for t in candidate) > MAX_NUM):
+                plan.groups.append(_make_group(plan, source, current))
+                candidate = [term]
+            current = candidate
+        if current:
+            plan.groups.append(_make_group(plan, source, current))
+    return plan
+
+
+def attribute_terms(item: Dict[str, Any], terms: List[str]) -> List[str]:
+    """Devuelve los términos que aparecen en el título, snippet o URL del resultado (puede ser ninguno)."""
+    haystack = " ".join(normalize_text(item.get(k) or "") for k in ("title", "snippet", "link"))
+    haystack = f" {haystack} "
+    return [t for t in terms if f" {normalize_text(t)} " in haystack]
+
+
+def execute_plan(plan: QueryPlan,
+                 search: Callable[[str, int], List[Dict[str, Any]]] = serpapi_search,
+                 max_calls: int = None,
+                 critical_terms: Iterable[str] = (),
+                 deadline=None,
+                 page_size: int = SERPAPI_PAGE_SIZE) -> List[Dict[str, Any]]:
+    """Ejecuta el plan y atribuye cada resultado a los términos que coincide.
+
+    Si un grupo combinado devuelve una página llena (`num` resultados, o
+    `page_size` si el upstream entrega menos por página), está saturado y se
+    divide en dos mitades que se consultan de nuevo para no perder recall,
+    siempre que quede presupuesto (`max_calls`). Los resultados repetidos entre consultas se
+    fusionan por URL. Las consultas que incluyen `critical_terms` usan la
+    prioridad crítica del limitador de tasa. Si se agota `deadline`, las
+    consultas pendientes se omiten y se devuelve lo ya recolectado; al
+    terminar, `plan.groups` contiene solo las consultas ejecutadas, con
+    `failed` en las que fallaron (ver `QueryPlan.executed_terms`).
+    """
+    critical = set(critical_terms)
+    # Las consultas críticas primero: si el tiempo se agota, son las últimas en perderse
+    pending = sorted(plan.groups, key=lambda g: not critical.intersection(g.terms))
+    executed: List[QueryGroup] = []
+    merged: Dict[str, Dict[str, Any]] = {}
+
+    while pending:
+        if deadline is not None and deadline.expired:
+            logging.warning(f"⏱️ Sin tiempo para {len(pending)} consultas pendientes, se omiten: "
+                            f"{[g.terms for g in pending]}")
+            break
+        group = pending.pop(0)
+        with escalate(Priority.CRITICAL) if critical.intersection(group.terms) else nullcontext():
+            raw = search(group.query, group.num)
+        results = [r for r in raw if "error" not in r]
+        group.results = len(results)
+        # Una caída del upstream no es rendimiento cero: sus términos quedan como no consultados
+        group.failed = bool(raw) and not results
+        executed.append(group)
+
+        group.saturated = group.results >= min(group.num, page_size)
+        budget_left = max_calls is None or len(executed) + len(pending) + 2 <= max_calls
+        if group.saturated and len(group.terms) > 1 and budget_left:
+            half = len(group.terms) // 2
+            pending[0:0] = [
+                _make_group(plan, group.source, group.terms[:half], group.depth + 1),
+                _make_group(plan, group.source, group.terms[half:], group.depth + 1),
+            ]
+            logging.info(f"🧩 Consulta saturada ({group.results}/{group.num}), dividiendo: {group.terms}")
+
+        for result in results:
+            url = result.get("link")
+            if not url:
+                continue
+            # Sin coincidencia textual solo se acredita una consulta de un término (no hay ambigüedad);
+            # en un grupo OR no se sabe qué término la trajo y no se infla su rendimiento
+            matched = attribute_terms(result, group.terms) or (list(group.terms) if len(group.terms) == 1 else [])
+            # Las variantes con parámetros de seguimiento de un mismo artículo son un solo resultado
+            key = canonical_url(url)
+            if key in merged:
+                known = merged[key]["matched_terms"]
+                known.extend(t for t in matched if t not in known)
+            else:
+                merged[key] = {**result, "source": group.source, "matched_terms": matched}
+
+    plan.groups = executed
+    logging.info(f"🧭 Plan ejecutado: {plan.call_count} llamadas SerpApi "
+                 f"(vs {plan.naive_call_count} sin consolidar), {len(merged)} resultados únicos.")
+    return list(merged.values())
@@ -0,0 +1,313 @@
+"""Limitador de tasa compartido para las APIs externas (SerpApi, Vertex AI, mindicador).
+
+Cada llamada consume un token de dos buckets: el del upstream (cuota total de
+la flota) y el del tenant/marca (una fracción de esa cuota, para que una
+marca no acapare al resto). Los buckets viven en Firestore, de modo que los
+límites se respetan entre procesos (Jobs, worker, replay); sin Firestore se
+usa un bucket en memoria, y tras un error de Firestore solo hasta el
+siguiente reintento.
+
+Prioridades: las clases más bajas dejan una reserva en el bucket del upstream
+que solo pueden consumir las más urgentes (términos de caída, marcas críticas).
+Un 429 con Retry-After vacía el bucket compartido para que toda la flota espere.
+"""
+import os
+import time
+import random
+import logging
+import threading
+import contextvars
+from enum import IntEnum
+from contextlib import contextmanager
+from typing import Dict, Any, Callable, List, Optional, Tuple
+
+RATE_LIMIT_COLLECTION = "rate_limits"
+TENANT_SHARE = float(os.environ.get("RATE_LIMIT_TENANT_SHARE", 0.5))
+BACKOFF_BASE_SECONDS = 1.0
+MAX_ATTEMPTS = 3
+# Tras un error de Firestore se usan buckets locales y se reintenta el compartido con backoff
+STORE_RETRY_SECONDS = 15.0
+STORE_RETRY_MAX_SECONDS = 300.0
+
+
+class Priority(IntEnum):
+    CRITICAL = 0
+    HIGH = 1
+    NORMAL = 2
+    LOW = 3
+
+
+# Fracción del bucket del upstream que cada clase debe dejar disponible para las más urgentes
+RESERVES = {Priority.CRITICAL: 0.0, Priority.HIGH: 0.1, Priority.NORMAL: 0.25, Priority.LOW: 0.5}
+
+
+class Limit:
+    """Tasa sostenida (llamadas por minuto) y ráfaga máxima de un bucket."""
+
+    def __init__(self, per_minute: float, burst: float):
+        self.per_minute = per_minute
+        self.burst = burst
+
+    @property
+    def rate(self) -> float:
+        return self.per_minute / 60.0
+
+    @classmethod
+    def from_env(cls, name: str, per_minute: float, burst: float) -> "Limit":
+        # Formato: RATE_LIMIT_SERPAPI="30:10" (llamadas por minuto : ráfaga)
+        raw = os.environ.get(f"RATE_LIMIT_{name.upper()}")
+        if raw:
+            per_minute, _, burst = raw.partition(":")
+            return cls(float(per_minute), float(burst or per_minute))
+        return cls(per_minute, burst)
+
+
+UPSTREAM_LIMITS = {
+    "serpapi": Limit.from_env("serpapi", 30, 10),
+    "vertex": Limit.from_env("vertex", 60, 10),
+    "mindicador": Limit.from_env("mindicador", 60, 5),
+}
+
+
+class RateLimitTimeout(Exception):
+    """No se obtuvo cuota antes del plazo indicado."""
+
+
+def _refill(state: Dict[str, float], limit: Limit, now: float) -> float:
+    if not state:
+        return limit.burst
+    elapsed = max(0.0, now - state["updated"])
+    return min(limit.burst, state["tokens"] + elapsed * limit.rate)
+
+
+def take_tokens(states: List[Dict[str, float]], limits: List[Limit], cost: float, reserve: float,
+                now: float) -> Tuple[float, List[Dict[str, float]]]:
+    """Recarga y consume los buckets indicados de forma atómica (todos o ninguno).
+
+    El primer bucket es el del upstream y es el único que aplica la reserva de
+    prioridad. Devuelve (segundos de espera, nuevos estados); espera 0 significa
+    que los tokens se consumieron.
+    """
+    levels = [_refill(s, l, now) for s, l in zip(states, limits)]
+    wait = 0.0
+    for i, (level, limit) in enumerate(zip(levels, limits)):
+        needed = cost + (reserve * limit.burst if i == 0 else 0.0)
+        if level < needed:
+            wait = max(wait, (needed - level) / limit.rate)
+    if wait:
+        return wait, [{"tokens": level, "updated": now} for level in levels]
+    return 0.0, [{"tokens": level - cost, "updated": now} for level in levels]
+
+
+class LocalBucketStore:
+    """Buckets en memoria (un solo proceso)."""
+
+    def __init__(self):
+        self._states: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def take(self, keys: List[str], limits: List[Limit], cost: float, reserve: float, now: float) -> float:
+        with self._lock:
+            wait, states = take_tokens([self._states.get(k, {}) for k in keys], limits, cost, reserve, now)
+            self._states.update(zip(keys, states))
+            return wait
+
+    def penalize(self, key: str, limit: Limit, seconds: float, now: float):
+        with self._lock:
+            self._states[key] = {"tokens": -seconds * limit.rate, "updated": now}
+
+
+class FirestoreBucketStore:
+    """Buckets persistidos en la colección `rate_limits`, consumidos en una transacción.
+
+    Un documento por bucket; con tasas del orden de una llamada por segundo la
+    contención por documento se mantiene bajo el límite de escritura de Firestore.
+    """
+
+    def __init__(self, db):
+        self.db = db
+
+    def take(self, keys: List[str], limits: List[Limit], cost: float, reserve: float, now: float) -> float:
+        from google.cloud import firestore
+        refs = [self.db.collection(RATE_LIMIT_COLLECTION).document(k) for k in keys]
+
+        @firestore.transactional
+        def _take(transaction):
+            states = [ref.get(transaction=transaction).to_dict() or {} for ref in refs]
+            wait, new_states = take_tokens(states, limits, cost, reserve, now)
+            if not wait:
+                for ref, state in zip(refs, new_states):
+                    transaction.set(ref, state)
+            return wait
+
+        return _take(self.db.transaction())
+
+    def penalize(self, key: str, limit: Limit, seconds: float, now: float):
+        self.db.collection(RATE_LIMIT_COLLECTION).document(key).set({"tokens": -seconds * limit.rate, "updated": now})
+
+
+_TENANT = contextvars.ContextVar("rate_limit_tenant", default=("default", Priority.NORMAL))
+
+
+def brand_priority(brand: Dict[str, Any]) -> Priority:
+    """Clase de prioridad de una marca (clave `priority` en brands_config.yaml, por defecto normal)."""
+    return Priority[str(brand.get('priority', "normal")).upper()]
+
+
+@contextmanager
+def tenant_context(tenant: str, priority: Priority = Priority.NORMAL):
+    """Atribuye las llamadas del bloque a un tenant (marca) con su prioridad."""
+    token = _TENANT.set((tenant, priority))
+    try:
+        yield
+    finally:
+        _TENANT.reset(token)
+
+
+@contextmanager
+def escalate(priority: Priority):
+    """Sube la prioridad de las llamadas del bloque (ej: consultas de términos críticos)."""
+    tenant, current = _TENANT.get()
+    token = _TENANT.set((tenant, min(current, priority)))
+    try:
+        yield
+    finally:
+        _TENANT.reset(token)
+
+
+def _retry_after(exc: Exception) -> Optional[float]:
+    response = getattr(exc, "response", None)
+    value = getattr(response, "headers", {}).get("Retry-After") if response is not None else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def _status(exc: Exception) -> Optional[int]:
+    # requests.HTTPError trae la respuesta; las excepciones de google.api_core exponen `code`
+    response = getattr(exc, "response", None)
+    status = getattr(response, "status_code", None) or getattr(exc, "code", None)
+    return int(status) if isinstance(status, int) else None
+
+
+def _is_throttled(exc: Exception) -> bool:
+    return _status(exc) == 429
+
+
+def _is_retryable(exc: Exception) -> bool:
+    status = _status(exc)
+    if status is not None:
+        return status == 429 or status >= 500
+    return type(exc).__name__ in ("ConnectionError", "Timeout", "ReadTimeout", "ConnectTimeout")
+
+
+class RateLimiter:
+    """Buckets por upstream y por tenant, con prioridades y reintentos coordinados."""
+
+    def __init__(self, store=None, limits: Dict[str, Limit] = None, tenant_share: float = TENANT_SHARE,
+                 clock: Callable[[], float] = time.time, sleep: Callable[[float], None] = time.sleep):
+        self.store = store
+        self.limits = limits or UPSTREAM_LIMITS
+        self.tenant_share = tenant_share
+        self.clock = clock
+        self.sleep = sleep
+        self._local = LocalBucketStore()
+        self._lock = threading.Lock()
+        self._store_failures = 0
+        self._store_retry_at = 0.0
+
+    def _store(self):
+        with self._lock:
+            if self.store is None:
+                self.store = store_from_env()
+            return self.store
+
+    def _take(self, keys, limits, cost, reserve) -> float:
+        store = self._store()
+        if store is self._local or self.clock() < self._store_retry_at:
+            return self._local.take(keys, limits, cost, reserve, self.clock())
+        try:
+            wait = store.take(keys, limits, cost, reserve, self.clock())
+        except Exception as e:
+            # Un error transitorio (contención, UNAVAILABLE) no debe dejar al proceso sin la cuota
+            # compartida para siempre: esta llamada usa buckets locales y Firestore se reintenta luego
+            with self._lock:
+                self._store_failures += 1
+                delay = min(STORE_RETRY_MAX_SECONDS, STORE_RETRY_SECONDS * 2 ** (self._store_failures - 1))
+                self._store_retry_at = self.clock() + delay
+            logging.warning(f"Limitador sin Firestore, buckets locales por {delay:.0f}s: {e}")
+            return self._local.take(keys, limits, cost, reserve, self.clock())
+        self._store_failures = 0
+        return wait
+
+    def acquire(self, upstream: str, cost: float = 1, timeout: float = None):
+        """Bloquea hasta obtener cuota del upstream para el tenant y prioridad actuales."""
+        tenant, priority = _TENANT.get()
+        upstream_limit = self.limits[upstream]
+        tenant_limit = Limit(upstream_limit.per_minute * self.tenant_share, max(1.0, upstream_limit.burst * self.tenant_share))
+        keys = [upstream, f"{upstream}:{tenant}"]
+        deadline = None if timeout is None else self.clock() + timeout
+
+        while True:
+            wait = self._take(keys, [upstream_limit, tenant_limit], cost, RESERVES[priority])
+            if not wait:
+                return
+            if deadline is not None and self.clock() + wait > deadline:
+                raise RateLimitTimeout(f"Sin cuota de {upstream} para {tenant} en {timeout:.0f}s")
+            # Jitter para que los procesos que esperan no despierten todos a la vez
+            self.sleep(wait * random.uniform(1.0, 1.2))
+
+    def penalize(self, upstream: str, seconds: float):
+        """Vacía el bucket compartido tras un 429: toda la flota espera `seconds`."""
+        logging.warning(f"🚦 {upstream} limitado por el proveedor, pausa compartida de {seconds:.0f}s")
+        try:
+            self._store().penalize(upstream, self.limits[upstream], seconds, self.clock())
+        except Exception as e:
+            logging.warning(f"No se pudo registrar la pausa en Firestore: {e}")
+            self._local.penalize(upstream, self.limits[upstream], seconds, self.clock())
+
+    def call(self, upstream: str, fn: Callable[[], Any], attempts: int = MAX_ATTEMPTS, cost: float = 1,
+             timeout: float = None) -> Any:
+        """Ejecuta `fn` con cuota, reintentando errores transitorios con backoff exponencial.
+
+        Respeta Retry-After en los 429; los errores no transitorios (ej: 4xx) se propagan de inmediato.
+        """
+        for attempt in range(attempts):
+            self.acquire(upstream, cost, timeout)
+            try:
+                return fn()
+            except Exception as e:
+                if attempt == attempts - 1 or not _is_retryable(e):
+                    raise
+                logging.warning(f"Intento {attempt + 1} fallido llamando a {upstream}: {e}")
+                retry_after = _retry_after(e)
+                if _is_throttled(e):
+                    self.penalize(upstream, retry_after or BACKOFF_BASE_SECONDS * 2 ** (attempt + 1))
+                else:
+                    self.sleep(BACKOFF_BASE_SECONDS * 2 ** attempt * random.uniform(0.5, 1.5))
+
+
+def store_from_env(db=None):
+    """RATE_LIMIT_BACKEND: firestore (por defecto si hay proyecto) o local."""
+    backend = os.environ.get("RATE_LIMIT_BACKEND", "firestore" if os.environ.get("GOOGLE_CLOUD_PROJECT") else "local")
+    if backend != "firestore":
+        return LocalBucketStore()
+    if db is None:
+        try:
+            from google.cloud import firestore
+            db = firestore.Client(project=os.environ.get("GOOGLE_CLOUD_PROJECT"))
+        except Exception as e:
+            logging.warning(f"Limitador sin Firestore, usando buckets locales: {e}")
+            return LocalBucketStore()
+    return FirestoreBucketStore(db)
+
+
+# Limitador del proceso: lo comparten tools.py, finance.py, analysis.py y replay.py
+LIMITER = RateLimiter()
+
+
+def use_firestore(db):
+    """Reutiliza el cliente de Firestore del runtime para los buckets compartidos."""
+    if db is not None and os.environ.get("RATE_LIMIT_BACKEND", "firestore") == "firestore":
+        LIMITER.store = FirestoreBucketStore(db)
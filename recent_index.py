@@ -0,0 +1,99 @@
+import heapq
+import itertools
+import threading
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import List, Dict, Any, Set
+
+from query_planner import normalize_text
+
+# Palabras vacías frecuentes en titulares: no aportan al ranking y engordan el índice
+STOPWORDS = {
+    "a", "al", "con", "de", "del", "el", "en", "es", "la", "las", "lo", "los", "para", "por",
+    "que", "se", "su", "sus", "un", "una", "y", "o", "the", "of", "and", "to", "in",
+}
+
+
+# Las menciones sin fecha se consideran las más antiguas
+_NO_DATE = datetime.min.replace(tzinfo=timezone.utc)
+
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in normalize_text(text).split() if t not in STOPWORDS and len(t) > 1]
+
+
+class RecentMentionIndex:
+    """Índice invertido acotado sobre las menciones recientes de una marca.
+
+    Indexa título, snippet, resumen, tag, severidad y sentimiento. Guarda como máximo `max_items`
+    menciones (se descartan las de `processed_at` más antiguo, sin importar el
+    orden en que se agregaron), de modo que las consultas del agente se
+    resuelven en memoria sin tocar Firestore.
+    """
+
+    def __init__(self, max_items: int = 2000):
+        self.max_items = max_items
+        self._docs: Dict[str, Dict[str, Any]] = {}
+        self._postings: Dict[str, Set[str]] = defaultdict(set)
+        # Montículo (processed_at, orden de llegada, id) para descartar siempre la mención más antigua
+        self._by_age: List[tuple] = []
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._docs)
+
+    def add(self, doc_id: str, record: Dict[str, Any]):
+        """Agrega una mención; `record` debe traer `processed_at` (datetime con zona horaria)."""
+        with self._lock:
+            if doc_id in self._docs:
+                return
+            tokens = set(tokenize(" ".join([
+                record.get("title") or "",
+                record.get("snippet") or "",
+                record.get("summary") or "",
+                record.get("tag") or "",
+                record.get("severity") or "",
+                record.get("sentiment") or "",
+            ])))
+            self._docs[doc_id] = {**record, "id": doc_id, "_tokens": tokens}
+            heapq.heappush(self._by_age, (record.get("processed_at") or _NO_DATE, next(self._seq), doc_id))
+            for token in tokens:
+                self._postings[token].add(doc_id)
+
+            while len(self._docs) > self.max_items:
+                self._evict_oldest()
+
+    def _evict_oldest(self):
+        _, _, doc_id = heapq.heappop(self._by_age)
+        record = self._docs.pop(doc_id)
+        for token in record["_tokens"]:
+            postings = self._postings.get(token)
+            if postings is not None:
+                postings.discard(doc_id)
+                if not postings:
+                    del self._postings[token]
+
+    def search(self, query: str = "", days: int = 7, limit: int = 10, now: datetime = None) -> List[Dict[str, Any]]:
+        """Menciones de los últimos `days` días, ordenadas por coincidencia con `query` y recencia."""
+        since = (now or datetime.now(timezone.utc)) - timedelta(days=days)
+        terms = tokenize(query)
+        with self._lock:
+            if terms:
+                scores: Dict[str, int] = defaultdict(int)
+                for term in terms:
+                    for doc_id in self._postings.get(term, ()):
+                        scores[doc_id] += 1
+                candidates = scores.keys()
+            else:
+                scores = {}
+                candidates = self._docs.keys()
+
+            hits = [
+                self._docs[doc_id] for doc_id in candidates
+                if self._docs[doc_id].get("processed_at") and self._docs[doc_id]["processed_at"] >= since
+            ]
+            hits.sort(key=lambda r: r["processed_at"], reverse=True)
+            if terms:
+                hits.sort(key=lambda r: scores[r["id"]], reverse=True)
+            return [{k: v for k, v in r.items() if k != "_tokens"} for r in hits[:limit]]
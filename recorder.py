@@ -0,0 +1,134 @@
+"""Grabación de ejecuciones: artefacto append-only (JSONL comprimido) por corrida.
+
+Cada corrida guarda los resultados crudos de búsqueda, las entradas del prompt
+y la salida del modelo, de modo que `replay.py` pueda reprocesar semanas o
+meses de historia con el pipeline actual sin volver a llamar a SerpApi.
+"""
+import os
+import gzip
+import json
+import uuid
+import logging
+import datetime
+import threading
+from typing import Dict, Any, Iterator, List, Optional
+
+RECORDINGS_DIR = os.environ.get("RECORDINGS_DIR", "recordings")
+RECORDINGS_BUCKET = os.environ.get("RECORDINGS_BUCKET")
+STAMP_FORMAT = "%Y%m%dT%H%M%S"
+
+
+class RunRecorder:
+    """Escribe los eventos de una corrida en `{dir}/{marca}/{timestamp}_{run_id}.jsonl.gz`.
+
+    Cada evento se agrega como un miembro gzip independiente: si el proceso se
+    interrumpe, lo ya escrito sigue siendo legible.
+    """
+
+    def __init__(self, brand_id: str, run_id: str = None, started_at: datetime.datetime = None,
+                 directory: str = RECORDINGS_DIR, bucket: Optional[str] = RECORDINGS_BUCKET):
+        self.brand_id = brand_id
+        self.run_id = run_id or uuid.uuid4().hex[:12]
+        self.started_at = started_at or datetime.datetime.now()
+        self.bucket = bucket
+        self.path = os.path.join(directory, brand_id, f"{self.started_at.strftime(STAMP_FORMAT)}_{self.run_id}.jsonl.gz")
+        self._lock = threading.Lock()
+        self._failed = False
+
+    def record(self, kind: str, **payload):
+        """Agrega un evento. Un fallo de disco no debe interrumpir la corrida."""
+        if self._failed:
+            return
+        event = {"kind": kind, "at": datetime.datetime.now().isoformat(), **payload}
+        line = json.dumps(event, ensure_ascii=False, default=str) + "\n"
+        try:
+            with self._lock:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                with gzip.open(self.path, "at", encoding="utf-8") as f:
+                    f.write(line)
+        except OSError as e:
+            logging.warning(f"No se pudo grabar la corrida ({self.path}): {e}")
+            self._failed = True
+
+    def close(self):
+        """Sube el artefacto a Cloud Storage si RECORDINGS_BUCKET está definido."""
+        if not self.bucket or self._failed or not os.path.exists(self.path):
+            return
+        try:
+            from google.cloud import storage
+            blob_name = os.path.relpath(self.path, os.path.dirname(os.path.dirname(self.path)))
+            storage.Client().bucket(self.bucket).blob(blob_name).upload_from_filename(self.path)
+            logging.info(f"📼 Grabación subida a gs://{self.bucket}/{blob_name}")
+        except Exception as e:
+            logging.warning(f"No se pudo subir la grabación a Cloud Storage: {e}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_recording(path: str) -> Iterator[Dict[str, Any]]:
+    """Itera los eventos de un artefacto. Una última línea truncada (corrida cortada) se ignora."""
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        try:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    logging.warning(f"Evento truncado ignorado en {path}")
+        except EOFError:
+            logging.warning(f"Grabación incompleta: {path}")
+
+
+def check_destination():
+    """En Cloud Run el disco es efímero: sin RECORDINGS_BUCKET las grabaciones se pierden al terminar la tarea.
+
+    La grabación es opcional, así que solo se avisa y la corrida sigue.
+    """
+    if (os.environ.get("CLOUD_RUN_JOB") or os.environ.get("K_SERVICE")) and not RECORDINGS_BUCKET:
+        logging.warning("⚠️ RECORDINGS_BUCKET no está definido: en Cloud Run las grabaciones para replay.py se pierden "
+                        "(ver deploy_multitenant.sh)")
+
+
+def recording_name(path: str) -> str:
+    """Nombre de la grabación sin extensión (`{timestamp}_{run_id}`)."""
+    return os.path.basename(path).split(".", 1)[0]
+
+
+def recording_time(path: str) -> datetime.datetime:
+    """Hora de inicio de la corrida, tomada del nombre del archivo."""
+    return datetime.datetime.strptime(os.path.basename(path).split("_", 1)[0], STAMP_FORMAT)
+
+
+def list_recordings(brand_id: str, since: datetime.datetime = None, until: datetime.datetime = None,
+                    directory: str = RECORDINGS_DIR) -> List[str]:
+    """Artefactos de una marca en orden cronológico, opcionalmente acotados por fecha."""
+    brand_dir = os.path.join(directory, brand_id)
+    if not os.path.isdir(brand_dir):
+        return []
+    paths = []
+    for name in sorted(os.listdir(brand_dir)):
+        if not name.endswith(".jsonl.gz"):
+            continue
+        path = os.path.join(brand_dir, name)
+        started = recording_time(path)
+        if (since and started < since) or (until and started >= until):
+            continue
+        paths.append(path)
+    return paths
+
+
+def download_recordings(bucket: str, brand_id: str, directory: str = RECORDINGS_DIR) -> int:
+    """Trae desde Cloud Storage los artefactos de una marca que no estén en disco."""
+    from google.cloud import storage
+    downloaded = 0
+    for blob in storage.Client().list_blobs(bucket, prefix=f"{brand_id}/"):
+        path = os.path.join(directory, blob.name)
+        if os.path.exists(path):
+            continue
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        blob.download_to_filename(path)
+        downloaded += 1
+    return downloaded
@@ -0,0 +1,151 @@
+"""Filtro de relevancia: descarta resultados fuera de tema antes de enviarlos a Gemini.
+
+Las consultas son amplias (listas OR de sitios, nombres propios como
+"Julio Medina Ortega"), así que llegan homónimos y temas ajenos. Cada marca
+tiene un perfil TF-IDF construido desde brands_config.yaml (nombre, términos,
+productos, ejecutivos, competidores, foco tecnológico) y desde las menciones
+que el análisis aceptó recientemente. Todos los candidatos se puntúan con
+similitud coseno contra ese perfil en una sola pasada de NumPy, sobre una
+representación dispersa (índices de token + pesos), de modo que el costo
+crece con el total de tokens y no con candidatos × vocabulario.
+"""
+import logging
+from collections import Counter
+from typing import Dict, Any, List, Iterable, Tuple
+
+import numpy as np
+
+from recent_index import tokenize
+
+DEFAULT_THRESHOLD = 0.05
+# Un candidato que solo coincide con el nombre de un ejecutivo (sin contexto de la marca) suele ser un homónimo
+NAME_ONLY_PENALTY = 0.3
+DEFAULT_MODE = "drop"  # "drop": descarta bajo el umbral; "rank": conserva todo, ordenado por relevancia
+
+# Peso de cada fuente en el perfil de la marca
+PROFILE_WEIGHTS = {
+    "name": 3.0, "search_terms": 2.0, "products": 2.0, "executives": 2.0,
+    "competitors": 0.5, "tech_focus": 0.5, "accepted": 1.0,
+}
+
+
+def features(text: str) -> List[str]:
+    """Unigramas y bigramas normalizados (los bigramas separan homónimos: 'medina ortega')."""
+    tokens = tokenize(text)
+    return tokens + [f"{a}_{b}" for a, b in zip(tokens, tokens[1:])]
+
+
+def profile_documents(brand: Dict[str, Any], accepted_texts: Iterable[str] = ()) -> List[Tuple[str, float]]:
+    """Documentos (texto, peso) que definen el perfil de la marca."""
+    docs = [(brand['name'], PROFILE_WEIGHTS["name"])]
+    for key in ("search_terms", "products", "executives", "competitors"):
+        docs += [(value, PROFILE_WEIGHTS[key]) for value in brand.get(key, [])]
+    if brand.get('tech_focus'):
+        docs.append((brand['tech_focus'], PROFILE_WEIGHTS["tech_focus"]))
+    accepted = [t for t in accepted_texts if t]
+    # Las menciones aceptadas pesan en conjunto lo mismo que un término de búsqueda, sin importar cuántas sean
+    docs += [(text, PROFILE_WEIGHTS["accepted"] * 2.0 / len(accepted)) for text in accepted]
+    return docs
+
+
+def executive_names(brand: Dict[str, Any]) -> List[str]:
+    """Nombres de los ejecutivos (entradas 'Nombre, cargo' en brands_config.yaml)."""
+    return [entry.split(",", 1)[0] for entry in brand.get('executives', [])]
+
+
+def _sparse_tfidf(token_lists: List[List[str]]):
+    """TF-IDF normalizado en formato COO: (fila, columna, peso) por cada token distinto de cada documento, y el vocabulario."""
+    vocab: Dict[str, int] = {}
+    rows, cols = [], []
+    for row, tokens in enumerate(token_lists):
+        for token, count in Counter(tokens).items():
+            rows.append((row, count))
+            cols.append(vocab.setdefault(token, len(vocab)))
+    n_docs = len(token_lists)
+    if not cols:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0), vocab
+
+    row_idx = np.fromiter((r for r, _ in rows), dtype=np.int64, count=len(rows))
+    counts = np.fromiter((c for _, c in rows), dtype=np.float64, count=len(rows))
+    col_idx = np.asarray(cols, dtype=np.int64)
+
+    df = np.bincount(col_idx, minlength=len(vocab))
+    idf = np.log((1 + n_docs) / (1 + df)) + 1.0
+    weights = (1.0 + np.log(counts)) * idf[col_idx]
+    norms = np.sqrt(np.bincount(row_idx, weights=weights ** 2, minlength=n_docs))
+    weights /= np.where(norms > 0, norms, 1.0)[row_idx]
+    return row_idx, col_idx, weights, vocab
+
+
+def score_texts(profile_docs: List[Tuple[str, float]], texts: List[str], names: Iterable[str] = ()) -> np.ndarray:
+    """Similitud coseno de cada texto contra el perfil (promedio ponderado de sus documentos).
+
+    Los textos cuya única coincidencia son los `names` (ejecutivos) se penalizan con NAME_ONLY_PENALTY.
+    """
+    if not texts:
+        return np.zeros(0)
+    n_profile = len(profile_docs)
+    name_features = {f for name in names for f in features(name)}
+    rows, cols, weights, vocab = _sparse_tfidf([features(t) for t, _ in profile_docs] + [features(t) for t in texts])
+    vocab_size = len(vocab)
+    if not vocab_size:
+        return np.zeros(len(texts))
+
+    in_profile = rows < n_profile
+    doc_weights = np.asarray([w for _, w in profile_docs], dtype=np.float64)
+    profile = np.bincount(cols[in_profile], weights=weights[in_profile] * doc_weights[rows[in_profile]], minlength=vocab_size)
+    norm = np.linalg.norm(profile)
+    if norm == 0:
+        return np.zeros(len(texts))
+    profile /= norm
+
+    candidates = ~in_profile
+    contributions = weights[candidates] * profile[cols[candidates]]
+    scores = np.bincount(rows[candidates] - n_profile, weights=contributions, minlength=len(texts))
+    if name_features:
+        is_name = np.fromiter((t in name_features for t in vocab), dtype=bool, count=vocab_size)
+        context = np.bincount(rows[candidates] - n_profile, weights=contributions * ~is_name[cols[candidates]],
+                              minlength=len(texts))
+        scores = np.where(context > 0, scores, scores * NAME_ONLY_PENALTY)
+    return scores
+
+
+def filter_relevant(batch, brand: Dict[str, Any], accepted_texts: Iterable[str] = ()):
+    """Puntúa el lote contra el perfil de la marca. Devuelve (conservadas, descartadas).
+
+    Umbral y modo por marca: `relevance_threshold` y `relevance_mode` en brands_config.yaml.
+    Cada mención queda con su puntaje en `relevance`.
+    """
+    threshold = brand.get('relevance_threshold', DEFAULT_THRESHOLD)
+    mode = brand.get('relevance_mode', DEFAULT_MODE)
+    texts = [f"{m.title} {m.snippet or ''}" for m in batch]
+    scores = score_texts(profile_documents(brand, accepted_texts), texts, executive_names(brand))
+    batch.assign("relevance", [round(float(s), 4) for s in scores])
+    if not len(batch):
+        return batch, batch.where([])
+
+    keep = scores >= threshold
+    if mode == "rank":
+        kept, dropped = batch.sort("relevance"), batch.where([False] * len(batch))
+    else:
+        kept, dropped = batch.where(keep), batch.where(~keep)
+    _log_drop_rates(batch, keep, scores, threshold, mode)
+    return kept, dropped
+
+
+def _log_drop_rates(batch, keep: np.ndarray, scores: np.ndarray, threshold: float, mode: str):
+    per_term: Dict[str, List[int]] = {}
+    for mention, kept in zip(batch, keep):
+        for term in mention.matched_terms or ["(sin término)"]:
+            stats = per_term.setdefault(term, [0, 0])
+            stats[0] += 1
+            stats[1] += int(not kept)
+    below = int((~keep).sum())
+    action = "descartadas" if mode == "drop" else "bajo el umbral (solo reordenadas)"
+    logging.info(f"🎯 Relevancia: {below}/{len(batch)} {action} ({below / len(batch):.0%}) con umbral {threshold}; "
+                 f"puntajes p10={np.percentile(scores, 10):.3f} p50={np.median(scores):.3f} max={scores.max():.3f}")
+    logging.info("🎯 Tasa de descarte por término: " + ", ".join(
+        f"{term} {dropped}/{total}" for term, (total, dropped) in sorted(per_term.items(), key=lambda kv: -kv[1][1])))
+    for mention, kept, score in zip(batch, keep, scores):
+        if not kept:
+            logging.info(f"   ✂️ {score:.3f} {mention.title} ({mention.link})")
@@ -0,0 +1,248 @@
+"""Replay: reprocesa corridas grabadas (ver recorder.py) con el pipeline actual.
+
+Uso:
+    python replay.py --brand banco_chile --since 2026-01-01 --until 2026-03-01 --workers 4
+
+Cada grabación se analiza en un proceso aparte con el prompt y el modelo
+vigentes, con el mismo filtro de relevancia que la corrida en vivo; el
+proceso principal escribe el historial (un punto por grabación: el de la
+corrida original si existe, idempotente), registra en la memoria de la marca
+las menciones que aún no tenía y guarda un checkpoint JSON que permite
+retomar un backfill interrumpido sin repetir trabajo. Con `--source-brand` se
+reutilizan las búsquedas grabadas de otra marca, re-atribuyendo cada
+resultado a los términos de la marca destino; una mención que ya apareció en
+una grabación anterior del rango no se vuelve a contar.
+"""
+import os
+import json
+import logging
+import argparse
+import datetime
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, Any, List, Tuple, Optional
+
+from mentions import make_batch
+from enrichment import canonical_url
+from deadline import TASK_TIMEOUT_SECONDS
+from query_planner import attribute_terms
+from recorder import RECORDINGS_DIR, RECORDINGS_BUCKET, read_recording, recording_time, recording_name, \
+    list_recordings, download_recordings
+
+DEFAULT_CHECKPOINT = "replay_checkpoint.json"
+
+_WORKER: Dict[str, Any] = {}
+
+
+def select_items(events: List[Dict[str, Any]], brand: Dict[str, Any]):
+    """Menciones de una grabación que corresponden a la marca destino.
+
+    Si la grabación es de la misma marca se reanalizan exactamente las menciones
+    que fueron nuevas en esa corrida, sin las que el filtro de relevancia
+    descartó; si es de otra marca, los resultados crudos se re-atribuyen a los
+    términos de la marca destino (el filtro se aplica después, ver
+    `relevance_recorded`).
+    """
+    run = next((e for e in events if e["kind"] == "run"), {})
+    search = next((e for e in events if e["kind"] == "search"), None)
+    dedup = next((e for e in events if e["kind"] == "dedup"), None)
+    enrichment = next((e for e in events if e["kind"] == "enrichment"), {})
+    if not search:
+        return make_batch([])
+
+    # Texto de artículo descargado en la corrida original (ver enrichment.py)
+    bodies = enrichment.get("bodies", {})
+    items = [{**i, "body": bodies.get(i.get("link"))} for i in search["items"]]
+    if run.get("brand_id") == brand['id']:
+        if dedup is not None:
+            new_links = set(dedup["new_links"])
+            items = [i for i in items if i.get("link") in new_links]
+        relevance = next((e for e in events if e["kind"] == "relevance"), {})
+        dropped = set(relevance.get("dropped", ()))
+        return make_batch([i for i in items if i.get("link") not in dropped])
+
+    attributed = []
+    for item in items:
+        matched = attribute_terms(item, brand['search_terms'])
+        if matched:
+            attributed.append({**item, "matched_terms": matched})
+    return make_batch(attributed)
+
+
+def relevance_recorded(events: List[Dict[str, Any]], brand: Dict[str, Any]) -> bool:
+    """Si la grabación trae la decisión del filtro de relevancia para la marca destino.
+
+    Las grabaciones de otra marca y las anteriores al registro de `dropped`
+    se filtran de nuevo con el perfil actual de la marca.
+    """
+    run = next((e for e in events if e["kind"] == "run"), {})
+    relevance = next((e for e in events if e["kind"] == "relevance"), {})
+    return run.get("brand_id") == brand['id'] and "dropped" in relevance
+
+
+def seen_before(paths: List[str], brand: Dict[str, Any]) -> Dict[str, set]:
+    """Por grabación (en orden cronológico), las URLs canónicas que ya aparecieron en una grabación anterior."""
+    seen, excluded = set(), {}
+    for path in paths:
+        links = {canonical_url(link) for link in select_items(list(read_recording(path)), brand).links()}
+        excluded[path] = links & seen
+        seen |= links
+    return excluded
+
+
+def _init_worker(brand_id: str):
+    # Cada proceso crea sus propios clientes (Vertex/Firestore no se comparten entre procesos)
+    from config import load_config
+    from runtime import Runtime
+    logging.basicConfig(level=logging.INFO)
+    _WORKER["brand"] = load_config(brand_id)
+    _WORKER["runtime"] = Runtime()
+    # Perfil de relevancia: una sola lectura de las menciones aceptadas por proceso
+    _WORKER["accepted_texts"] = _WORKER["runtime"].memory(_WORKER["brand"]).get_accepted_texts()
+
+
+def replay_recording(path: str, exclude: set = frozenset()) -> Dict[str, Any]:
+    """Analiza una grabación con el pipeline actual. Se ejecuta en un proceso del pool.
+
+    `exclude`: URLs canónicas ya contadas en una grabación anterior (ver `seen_before`).
+    """
+    from analysis import run_analysis, sentiment_counts
+    from prompt_compaction import TokenLedger
+    from relevance import filter_relevant
+    brand, runtime = _WORKER["brand"], _WORKER["runtime"]
+    started_at = recording_time(path)
+    events = list(read_recording(path))
+    batch = select_items(events, brand)
+    batch = batch.where([canonical_url(link) not in exclude for link in batch.links()])
+    if not relevance_recorded(events, brand):
+        batch, _ = filter_relevant(batch, brand, _WORKER.get("accepted_texts", []))
+    result = {"started_at": started_at.isoformat(), "mentions": len(batch)}
+    if not len(batch):
+        return {**result, "status": "empty"}
+
+    model, bundle = runtime.analysis_model(brand)
+    with TokenLedger(f"replay {os.path.basename(path)}") as ledger:
+        analysis = run_analysis(model, bundle, batch, started_at.strftime('%Y-%m-%d'))
+    # Las menciones analizadas vuelven al proceso principal para la memoria (sin el texto del artículo)
+    records = [{k: v for k, v in r.items() if k != "body"} for r in batch.to_records()]
+    return {**result, "status": "ok", "bundle": bundle.version, "score": analysis['score'],
+            "state": analysis['state'], "sentiment": sentiment_counts(analysis), "tokens": ledger.totals(),
+            "records": records}
+
+
+class Checkpoint:
+    """Estado del backfill en disco: grabaciones terminadas (con su resultado) y fallidas."""
+
+    def __init__(self, path: str, brand_id: str):
+        self.path = path
+        self.brand_id = brand_id
+        self.done: Dict[str, Dict[str, Any]] = {}
+        self.failed: Dict[str, str] = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("brand_id") != brand_id:
+                raise ValueError(f"El checkpoint {path} pertenece a la marca {data.get('brand_id')}")
+            self.done, self.failed = data.get("done", {}), data.get("failed", {})
+
+    def pending(self, paths: List[str]) -> List[str]:
+        return [p for p in paths if os.path.basename(p) not in self.done]
+
+    def mark(self, path: str, result: Dict[str, Any] = None, error: str = None):
+        name = os.path.basename(path)
+        if error is None:
+            self.done[name] = result
+            self.failed.pop(name, None)
+        else:
+            self.failed[name] = error
+        self.save()
+
+    def save(self):
+        # Escritura atómica: un corte a mitad de escritura no corrompe el checkpoint
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"brand_id": self.brand_id, "done": self.done, "failed": self.failed}, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, self.path)
+
+
+def replay(brand_id: str, source_brand: str = None, since: datetime.datetime = None, until: datetime.datetime = None,
+           workers: int = 4, checkpoint_path: str = DEFAULT_CHECKPOINT, directory: str = RECORDINGS_DIR,
+           dry_run: bool = False) -> Checkpoint:
+    paths = list_recordings(source_brand or brand_id, since, until, directory)
+    checkpoint = Checkpoint(checkpoint_path, brand_id)
+    pending = checkpoint.pending(paths)
+    logging.info(f"📼 {len(paths)} grabaciones en rango, {len(pending)} pendientes ({len(paths) - len(pending)} ya en checkpoint).")
+    if not pending:
+        return checkpoint
+
+    from config import load_config
+    brand = load_config(brand_id)
+    excluded = seen_before(paths, brand)
+    memory = None
+    if not dry_run:
+        from memory import BrandMemory
+        memory = BrandMemory(brand=brand)
+
+    # spawn: los clientes gRPC de Google no sobreviven a un fork
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=_init_worker, initargs=(brand_id,)) as pool:
+        futures = {pool.submit(replay_recording, path, excluded.get(path, set())): path for path in pending}
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                logging.error(f"❌ Replay falló para {path}: {e}")
+                checkpoint.mark(path, error=str(e))
+                continue
+            records = result.pop("records", [])
+            if memory and result["status"] == "ok":
+                _save(memory, path, result, records, same_brand=source_brand in (None, brand_id))
+            checkpoint.mark(path, result)
+            logging.info(f"✅ {os.path.basename(path)}: {result['status']} ({result['mentions']} menciones)")
+
+    logging.info(f"🏁 Replay terminado: {len(checkpoint.done)} procesadas, {len(checkpoint.failed)} fallidas.")
+    return checkpoint
+
+
+def _save(memory, path: str, result: Dict[str, Any], records: List[Dict[str, Any]], same_brand: bool):
+    """Escribe el punto de historial de la grabación y registra las menciones que la marca aún no tenía."""
+    when = datetime.datetime.fromisoformat(result["started_at"])
+    doc_id = recording_name(path)
+    if same_brand:
+        # La corrida original ya guardó su punto: se sobrescribe ese mismo documento en lugar de duplicarlo
+        doc_id = memory.find_summary(when, when + datetime.timedelta(seconds=TASK_TIMEOUT_SECONDS)) or doc_id
+    memory.save_daily_summary(result["score"], state=result["state"], sentiment=result["sentiment"],
+                              tokens=result.get("tokens"), when=when, doc_id=doc_id)
+    batch = make_batch(records)
+    memory.remember_batch(batch.exclude_links(memory.filter_processed(batch.links())), when=when)
+
+
+def _parse_date(value: Optional[str]) -> Optional[datetime.datetime]:
+    return datetime.datetime.strptime(value, "%Y-%m-%d") if value else None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Reprocesa corridas grabadas con el pipeline actual.")
+    parser.add_argument("--brand", required=True, help="Marca destino (id en brands_config.yaml)")
+    parser.add_argument("--source-brand", help="Reutiliza las grabaciones de otra marca")
+    parser.add_argument("--since", help="Fecha inicial inclusive (YYYY-MM-DD)")
+    parser.add_argument("--until", help="Fecha final exclusiva (YYYY-MM-DD)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4)
+    parser.add_argument("--checkpoint", default=DEFAULT_CHECKPOINT)
+    parser.add_argument("--recordings-dir", default=RECORDINGS_DIR)
+    parser.add_argument("--bucket", default=RECORDINGS_BUCKET, help="Descarga antes las grabaciones desde Cloud Storage")
+    parser.add_argument("--dry-run", action="store_true", help="No escribe historial en Firestore")
+    args = parser.parse_args(argv)
+
+    if args.bucket:
+        count = download_recordings(args.bucket, args.source_brand or args.brand, args.recordings_dir)
+        logging.info(f"⬇️ {count} grabaciones descargadas desde gs://{args.bucket}")
+
+    replay(args.brand, args.source_brand, _parse_date(args.since), _parse_date(args.until),
+           args.workers, args.checkpoint, args.recordings_dir, args.dry_run)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
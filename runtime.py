@@ -0,0 +1,70 @@
+import os
+import logging
+import hashlib
+import threading
+from typing import Dict, Any, Tuple
+
+import vertexai
+from vertexai.generative_models import GenerativeModel
+from google.cloud import firestore
+
+from memory import BrandMemory
+from prompt_bundle import PromptCompiler, PromptBundle, cache_backend_from_env
+from enrichment import Enricher
+from mention_store import MentionStore
+import ratelimit
+import deadline
+
+
+class Runtime:
+    """Clientes y handles reutilizables entre ejecuciones.
+
+    En modo Job se crea uno por ejecución; en modo servicio (worker.py) se crea
+    una sola vez y todas las marcas comparten el cliente de Firestore, los
+    handles de modelo de Vertex y las cachés.
+    """
+
+    def __init__(self, project_id: str = None, location: str = "us-central1", model_name: str = "gemini-2.5-pro"):
+        self.project_id = project_id or os.environ.get("GOOGLE_CLOUD_PROJECT")
+        self.location = location
+        self.model_name = model_name
+        self.db = None
+        self._models: Dict[str, GenerativeModel] = {}
+        self._memories: Dict[str, BrandMemory] = {}
+        self._lock = threading.Lock()
+        self.prompts = PromptCompiler(model_name, cache_backend_from_env())
+        # Almacén de menciones compartido por todas las marcas: contenido, texto y verificaciones (ver mention_store.py)
+        self.mention_store = MentionStore()
+        self.enricher = Enricher(self.mention_store)
+
+        if not self.project_id:
+            logging.error("GOOGLE_CLOUD_PROJECT environment variable not set.")
+            return
+
+        vertexai.init(project=self.project_id, location=self.location)
+        try:
+            self.db = firestore.Client(project=self.project_id)
+            ratelimit.use_firestore(self.db)
+            deadline.use_firestore(self.db)
+        except Exception as e:
+            logging.error(f"Error connecting to Firestore: {e}")
+        self.mention_store.db = self.db
+
+    def model(self, system_instruction: str, tools=None) -> GenerativeModel:
+        """Devuelve un handle de modelo reutilizable para la instrucción de sistema dada."""
+        key = hashlib.sha256(f"{self.model_name}\n{system_instruction}\n{bool(tools)}".encode("utf-8")).hexdigest()
+        with self._lock:
+            if key not in self._models:
+                self._models[key] = GenerativeModel(self.model_name, tools=tools, system_instruction=system_instruction)
+            return self._models[key]
+
+    def analysis_model(self, brand: Dict[str, Any], tools=None) -> Tuple[GenerativeModel, PromptBundle]:
+        """Modelo de análisis con la instrucción estática precompilada (y en context cache si es posible)."""
+        return self.prompts.model_for(brand, tools, fallback=lambda system_instruction: self.model(system_instruction, tools))
+
+    def memory(self, brand: Dict[str, Any]) -> BrandMemory:
+        """Memoria de la marca, compartiendo el cliente de Firestore del runtime."""
+        with self._lock:
+            if brand['id'] not in self._memories:
+                self._memories[brand['id']] = BrandMemory(self.project_id, brand=brand, db=self.db, store=self.mention_store)
+            return self._memories[brand['id']]
@@ -0,0 +1,125 @@
+import logging
+import math
+from dataclasses import dataclass
+from typing import List, Dict, Any, Iterable, Tuple
+
+from query_planner import plan_queries, QueryPlan
+from sentiment import analyze_sentiment
+
+# Presupuesto por defecto de llamadas SerpApi por ejecución (sobrescribible con `call_budget`)
+DEFAULT_CALL_BUDGET = 6
+
+EWMA_ALPHA = 0.3          # Peso de la última ejecución en el rendimiento histórico
+URGENCY_WEIGHT = 2.0      # Cuánto pesa la proporción de menciones urgentes frente al volumen
+COLD_START_PRIORITY = 10.0  # Términos sin historial se sondean siempre hasta tener datos
+MAX_INTERVAL = 4          # Un término de bajo rendimiento se consulta al menos cada 4 ejecuciones
+MIN_DEPTH, DEFAULT_DEPTH, MAX_DEPTH = 3, 5, 20
+
+
+@dataclass
+class TermSchedule:
+    term: str
+    priority: float
+    interval: int      # Cada cuántas ejecuciones se consulta el término
+    depth: int         # Resultados pedidos para el término
+    critical: bool
+    due: bool
+    polled: bool = False
+
+
+def term_priority(stats: Dict[str, Any]) -> float:
+    """Rendimiento esperado del término: menciones nuevas por consulta + urgencia."""
+    if not stats or stats.get("yield_ewma") is None:
+        return COLD_START_PRIORITY
+    return stats["yield_ewma"] + URGENCY_WEIGHT * stats.get("urgent_ewma", 0.0)
+
+
+def polling_interval(priority: float) -> int:
+    if priority >= 1.0:
+        return 1
+    if priority >= 0.3:
+        return 2
+    if priority >= 0.1:
+        return 3
+    return MAX_INTERVAL
+
+
+def result_depth(stats: Dict[str, Any]) -> int:
+    """Más resultados para términos que suelen traer muchas menciones nuevas."""
+    if not stats or stats.get("yield_ewma") is None:
+        return DEFAULT_DEPTH
+    return max(MIN_DEPTH, min(MAX_DEPTH, math.ceil(stats["yield_ewma"] * 2)))
+
+
+def schedule_terms(terms: List[str], term_stats: Dict[str, Dict[str, Any]], critical_terms: List[str] = None,
+                   call_budget: int = DEFAULT_CALL_BUDGET) -> Tuple[QueryPlan, List[TermSchedule]]:
+    """Decide qué términos se consultan en esta ejecución y con qué profundidad.
+
+    Los términos críticos se consultan en cada ejecución; el resto según su
+    intervalo. Si el plan resultante excede `call_budget`, se descartan los
+    términos no críticos de menor prioridad hasta que quepa.
+    """
+    critical_terms = set(critical_terms or [])
+    schedules = []
+    for term in terms:
+        stats = term_stats.get(term, {})
+        priority = term_priority(stats)
+        interval = polling_interval(priority)
+        critical = term in critical_terms
+        schedules.append(TermSchedule(
+            term=term,
+            priority=priority,
+            interval=1 if critical else interval,
+            depth=result_depth(stats),
+            critical=critical,
+            due=critical or stats.get("runs_since_poll", 0) + 1 >= interval,
+        ))
+
+    due = sorted((s for s in schedules if s.due), key=lambda s: (not s.critical, -s.priority))
+    plan = plan_queries([s.term for s in due], limits={s.term: s.depth for s in due})
+    while plan.call_count > call_budget and any(not s.critical for s in due):
+        dropped = next(s for s in reversed(due) if not s.critical)
+        due.remove(dropped)
+        logging.info(f"⏭️ Presupuesto agotado, se posterga: '{dropped.term}'")
+        plan = plan_queries([s.term for s in due], limits={s.term: s.depth for s in due})
+
+    for s in due:
+        s.polled = True
+    for s in schedules:
+        logging.info(f"   🗓️ {s.term}: prioridad={s.priority:.2f} cada {s.interval} ejec. "
+                     f"profundidad={s.depth}{' [crítico]' if s.critical else ''}{' ✔' if s.polled else ''}")
+    return plan, schedules
+
+
+def update_term_stats(term_stats: Dict[str, Dict[str, Any]], schedules: List[TermSchedule],
+                      new_items: List[Dict[str, Any]], executed_terms: Iterable[str] = None) -> Dict[str, Dict[str, Any]]:
+    """Actualiza el rendimiento histórico con las menciones nuevas (no duplicadas) de esta ejecución.
+
+    `executed_terms` son los términos cuya consulta realmente corrió (ver
+    `QueryPlan.executed_terms`); un término programado cuya consulta se omitió
+    por falta de tiempo cuenta como no consultado, no como rendimiento cero.
+    """
+    executed = None if executed_terms is None else set(executed_terms)
+    updated = {}
+    for s in schedules:
+        stats = dict(term_stats.get(s.term, {}))
+        if not s.polled or (executed is not None and s.term not in executed):
+            stats["runs_since_poll"] = stats.get("runs_since_poll", 0) + 1
+            updated[s.term] = stats
+            continue
+
+        items = [i for i in new_items if s.term in i.get("matched_terms", [])]
+        urgent = sum(
+            1 for i in items
+            if analyze_sentiment(f"{i.get('title') or ''} {i.get('snippet') or ''}")["urgency"] != "Verde"
+        )
+        urgent_share = urgent / len(items) if items else 0.0
+
+        previous = stats.get("yield_ewma")
+        stats["yield_ewma"] = len(items) if previous is None else EWMA_ALPHA * len(items) + (1 - EWMA_ALPHA) * previous
+        stats["urgent_ewma"] = EWMA_ALPHA * urgent_share + (1 - EWMA_ALPHA) * stats.get("urgent_ewma", 0.0)
+        stats["polls"] = stats.get("polls", 0) + 1
+        stats["last_new"] = len(items)
+        stats["runs_since_poll"] = 0
+        updated[s.term] = stats
+    return updated
@@ -0,0 +1,73 @@
+import json
+import pytest
+from analysis import parse_analysis, apply_analysis, render_report_html, sentiment_counts, build_prompt, verify_unenriched
+from mentions import make_batch
+
+ITEMS = [
+    {"title": "Caída de la App BancoEstado", "link": "https://df.cl/caida?utm=1&x=2"},
+    {"title": "BancoEstado lanza tarjeta", "link": "https://elmercurio.com/tarjeta"},
+]
+
+RESPONSE = {
+    "state": "Alerta", "score": 62, "analysis": "Caída <puntual> de la app.", "recommendation": "Comunicar.",
+    "tech_insight": "GKE Autopilot.",
+    "mentions": [
+        {"ref": 1, "tag": "tecnología", "severity": "Crítica", "sentiment": "Negativo", "summary": "App caída."},
+        {"ref": 7, "tag": "X", "severity": "Baja", "sentiment": "Neutro", "summary": "Fuera de rango"},
+    ],
+}
+
+def test_parse_validates_and_drops_bad_mentions():
+    analysis = parse_analysis("```json\n" + json.dumps(RESPONSE) + "\n```", mention_count=2)
+    assert analysis["score"] == 62
+    assert [m["ref"] for m in analysis["mentions"]] == [1]
+
+    # Sin tag o con resumen vacío la mención no llega al render (antes: KeyError y sin correo)
+    incomplete = {**RESPONSE, "mentions": RESPONSE["mentions"][:1] + [
+        {"ref": 2, "severity": "Baja", "sentiment": "Neutro", "summary": "Sin tag"},
+        {"ref": 2, "tag": "PRODUCTO", "severity": "Baja", "sentiment": "Positivo", "summary": " "}]}
+    analysis = parse_analysis(json.dumps(incomplete), mention_count=2)
+    assert [m["ref"] for m in analysis["mentions"]] == [1]
+    assert "App caída" in render_report_html(analysis, make_batch(ITEMS))
+
+def test_invalid_score_is_an_error_not_zero():
+    with pytest.raises(ValueError):
+        parse_analysis(json.dumps({**RESPONSE, "score": 140}), mention_count=2)
+    with pytest.raises(ValueError):
+        parse_analysis("<p>Brand Health Index: 70/100</p>", mention_count=2)
+
+def test_render_and_apply_use_local_links():
+    batch = make_batch(ITEMS)
+    analysis = parse_analysis(json.dumps(RESPONSE), mention_count=2)
+    apply_analysis(batch, analysis)
+    html = render_report_html(analysis, batch)
+
+    assert "Brand Health Index:</strong> 62/100" in html
+    assert '<a href="https://df.cl/caida?utm=1&amp;x=2" target="_blank">leer más</a>' in html
+    assert "[TECNOLOGÍA]" in html and "&lt;puntual&gt;" in html
+    assert [m.sentiment for m in batch] == ["Negativo", None]
+    assert sentiment_counts(analysis) == {"Positivo": 0, "Neutro": 0, "Negativo": 1}
+
+def test_prompt_uses_local_context_and_grounding_only_verifies():
+    batch = make_batch([{**ITEMS[0], "snippet": "La app\nno responde", "body": "Texto completo."}, ITEMS[1]])
+    prompt = build_prompt(batch, "2026-10-19")
+    assert "Extracto: La app no responde" in prompt and "Texto: Texto completo." in prompt
+
+    analysis = parse_analysis(json.dumps({**RESPONSE, "mentions": [
+        {"ref": 1, "tag": "TECNOLOGÍA", "severity": "Crítica", "sentiment": "Negativo", "summary": "App caída."},
+        {"ref": 2, "tag": "PRODUCTO", "severity": "Media", "sentiment": "Positivo", "summary": "Nueva tarjeta."},
+    ]}), mention_count=2)
+    queries = []
+    search = lambda q: queries.append(q) or "NO VERIFICADA\nNo hay registros."
+    assert verify_unenriched(batch, analysis, search=search) == 1
+    # Solo la mención sin texto local se verifica con grounding
+    assert len(queries) == 1 and "BancoEstado lanza tarjeta" in queries[0]
+    assert analysis["mentions"][1]["verified"] is False and "verified" not in analysis["mentions"][0]
+    assert "(no verificada)" in render_report_html(analysis, batch)
+
+if __name__ == "__main__":
+    test_parse_validates_and_drops_bad_mentions()
+    test_invalid_score_is_an_error_not_zero()
+    test_render_and_apply_use_local_links()
+    test_prompt_uses_local_context_and_grounding_only_verifies()
+    print("✅ Analysis tests passed!")
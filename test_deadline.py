@@ -0,0 +1,91 @@
+import time
+import threading
+import pytest
+import deadline
+import tools
+from deadline import Deadline, DeadlineExceeded, hedged, run_with_timeout, request_timeout
+from query_planner import plan_queries, execute_plan
+
+def test_stages_respect_final_reserve():
+    deadline = Deadline(100, reserve=15)
+    assert deadline.stage("search", 0.35).total == 35
+    # Una etapa sin fracción puede usar lo que queda, pero no la reserva final
+    assert deadline.stage("analysis").total == pytest.approx(85, abs=0.1)
+    assert deadline.stage("memory", reserved=True).total == pytest.approx(100, abs=0.1)
+
+    with Deadline(5).stage("search", 0.5):
+        assert request_timeout(cap=20) <= 2.5
+    assert request_timeout(cap=20) == 20
+
+def test_hedged_request_races_a_slow_first_attempt():
+    calls = []
+    release = threading.Event()
+
+    def search():
+        calls.append(1)
+        if len(calls) == 1:
+            release.wait(2)  # Primera solicitud en la cola larga de latencia
+            return "lenta"
+        return "rápida"
+
+    started = time.monotonic()
+    assert hedged("test", search, timeout=5, delay=0.05) == "rápida"
+    assert time.monotonic() - started < 1
+    release.set()
+
+def test_paid_search_is_not_hedged(monkeypatch):
+    calls = []
+    response = type("Response", (), {"raise_for_status": lambda self: None, "json": lambda self: {"organic_results": []}})()
+    monkeypatch.setenv("SERPAPI_KEY", "x")
+    monkeypatch.setattr(deadline, "HEDGE_DEFAULT_DELAY", 0.01)
+    monkeypatch.setattr(tools.SESSION, "get", lambda *a, **k: calls.append(1) or time.sleep(0.1) or response)
+    assert tools.serpapi_search("BancoEstado") == []
+    time.sleep(0.1)
+    assert len(calls) == 1
+
+def test_latency_samples_persist_across_processes(monkeypatch):
+    docs = {}
+
+    class Doc:
+        def __init__(self, name):
+            self.name = name
+            self.exists = name in docs
+        def to_dict(self):
+            return docs.get(self.name)
+        def get(self, timeout=None):
+            return Doc(self.name)
+        def set(self, data, timeout=None):
+            docs[self.name] = data
+
+    db = type("DB", (), {"collection": lambda self, c: type("C", (), {"document": lambda self, n: Doc(n)})()})()
+    monkeypatch.setattr(deadline, "_LATENCY_DB", db)
+    monkeypatch.setattr(deadline, "_LATENCIES", {})
+    for _ in range(deadline.HEDGE_MIN_SAMPLES):
+        hedged("indicadores", lambda: "ok", delay=1)
+    deadline._POOL.submit(lambda: None).result()
+    time.sleep(0.05)
+
+    # Otro proceso (una nueva ejecución del Job) parte con las latencias guardadas
+    monkeypatch.setattr(deadline, "_LATENCIES", {})
+    tracker = deadline.latency("indicadores")
+    assert len(tracker.samples) == deadline.HEDGE_MIN_SAMPLES
+    assert tracker.hedge_delay() == deadline.HEDGE_MIN_DELAY
+
+def test_timeouts_raise_deadline_exceeded():
+    with pytest.raises(DeadlineExceeded):
+        run_with_timeout(lambda: time.sleep(1), timeout=0.05)
+    with pytest.raises(DeadlineExceeded):
+        Deadline(0).timeout()
+
+def test_expired_search_stage_skips_pending_queries():
+    plan = plan_queries(["BancoEstado", "CuentaRUT"], sources=("financial", "social"))
+    executed = []
+    results = execute_plan(plan, search=lambda q, n: executed.append(q) or [], deadline=Deadline(0))
+    assert results == [] and executed == [] and plan.call_count == 0
+
+if __name__ == "__main__":
+    test_stages_respect_final_reserve()
+    test_hedged_request_races_a_slow_first_attempt()
+    test_timeouts_raise_deadline_exceeded()
+    test_expired_search_stage_skips_pending_queries()
+    print("✅ Deadline tests passed!")
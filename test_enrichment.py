@@ -0,0 +1,103 @@
+import time
+import threading
+import enrichment
+from enrichment import canonical_url, extract_text, fetch_html, Enricher
+from mention_store import MentionStore
+from mentions import make_batch
+from deadline import Deadline
+
+PAGE = """<html><head><meta property="og:description" content="Resumen corto"><script>var x = 1;</script></head>
+<body><nav><p>Inicio | Economía | Mercados | Opinión | Contacto | Suscríbete</p></nav>
+<article><h1>BancoEstado sufre caída masiva en su app</h1>
+<p>La aplicación de BancoEstado presentó intermitencias durante la mañana del lunes, afectando pagos.</p>
+<p>Publicidad</p>
+<p>El banco informó que el servicio fue restablecido cerca del mediodía tras una falla en un proveedor.</p></article>
+<footer><p>Todos los derechos reservados a El Diario Financiero y sus filiales.</p></footer></body></html>"""
+
+def test_canonical_url_strips_tracking():
+    assert canonical_url("https://www.DF.cl/noticia/?utm_source=x&id=2&fbclid=abc#comentarios") == "https://df.cl/noticia?id=2"
+    assert canonical_url("https://df.cl/noticia/") == canonical_url("https://df.cl/noticia?utm_medium=email")
+
+def test_extract_text_prefers_article_paragraphs():
+    text = extract_text(PAGE)
+    assert "La aplicación de BancoEstado" in text and "restablecido" in text and "Publicidad" not in text
+    assert "Suscríbete" not in text and "derechos reservados" not in text and "var x" not in text
+    assert len(extract_text(PAGE, max_chars=60)) <= 61
+    assert extract_text("<html><head><meta name='description' content='Solo meta'></head></html>") == "Solo meta"
+
+def test_fetch_html_decodes_utf8_served_without_charset(monkeypatch):
+    class Response:
+        def __init__(self, body, content_type):
+            self.body = body
+            self.headers = {"Content-Type": content_type}
+            self.encoding = "ISO-8859-1"  # Lo que asume requests para text/html sin charset
+        def __enter__(self):
+            return self
+        def __exit__(self, *exc):
+            return False
+        def raise_for_status(self):
+            pass
+        def iter_content(self, size):
+            yield self.body
+
+    pages = {
+        "https://df.cl/utf8": Response(PAGE.encode("utf-8"), "text/html"),
+        "https://df.cl/meta": Response(PAGE.replace("<head>", '<head><meta charset="iso-8859-1">').encode("latin-1"), "text/html"),
+        "https://df.cl/header": Response(PAGE.encode("cp1252"), "text/html; charset=windows-1252"),
+    }
+    monkeypatch.setattr(enrichment.SESSION, "get", lambda url, **kwargs: pages[url])
+    for url in pages:
+        text = extract_text(fetch_html(url))
+        assert "La aplicación de BancoEstado" in text and "caída" in fetch_html(url)
+
+def test_enricher_caches_and_limits_per_domain():
+    active, peak, fetched = {}, {}, []
+    lock = threading.Lock()
+
+    def fetch(url):
+        domain = url.split("/")[2]
+        with lock:
+            fetched.append(url)
+            active[domain] = active.get(domain, 0) + 1
+            peak[domain] = max(peak.get(domain, 0), active[domain])
+        time.sleep(0.05)
+        with lock:
+            active[domain] -= 1
+        return PAGE
+
+    items = [{"title": f"Nota {i}", "link": f"https://df.cl/nota-{i}?utm_source=x"} for i in range(6)]
+    items.append({"title": "Hilo", "link": "https://twitter.com/bancoestado/status/1"})
+    enricher = Enricher(MentionStore(), workers=8, per_domain=2, fetch=fetch)
+
+    batch = make_batch(items)
+    bodies = enricher.enrich(batch)
+    assert len(bodies) == 6 and peak["df.cl"] == 2
+    assert [m.body is not None for m in batch] == [True] * 6 + [False]
+
+    # Segunda corrida: todo desde caché (la URL canónica ignora los parámetros de seguimiento)
+    again = make_batch([{**i, "link": i["link"].replace("utm_source=x", "utm_source=y")} for i in items])
+    enricher.enrich(again)
+    assert len(fetched) == 6
+
+def test_enricher_without_time_left_keeps_mentions_without_body():
+    fetched = []
+    store = MentionStore()
+    store.put_many({canonical_url("https://df.cl/en-cache"): "Texto guardado"})
+    enricher = Enricher(store, fetch=lambda url: fetched.append(url) or PAGE)
+    clock = iter([0.0, 5.0] + [10.0] * 20).__next__
+    run = Deadline(5.0, clock=clock)
+
+    batch = make_batch([{"title": "En caché", "link": "https://df.cl/en-cache"},
+                        {"title": "Nueva", "link": "https://df.cl/nueva"}])
+    with run.stage("enrich") as stage:
+        assert stage.expired
+        bodies = enricher.enrich(batch)
+    assert bodies == {"https://df.cl/en-cache": "Texto guardado"} and fetched == []
+    assert [m.body for m in batch] == ["Texto guardado", None]
+
+if __name__ == "__main__":
+    test_canonical_url_strips_tracking()
+    test_extract_text_prefers_article_paragraphs()
+    test_enricher_caches_and_limits_per_domain()
+    test_enricher_without_time_left_keeps_mentions_without_body()
+    print("✅ Enrichment tests passed!")
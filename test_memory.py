@@ -0,0 +1,106 @@
+import datetime
+import itertools
+from google.cloud import firestore
+from memory import BrandMemory
+from mentions import make_batch
+from mention_store import mention_id
+
+BRAND = {"id": "banco_estado", "name": "BancoEstado"}
+
+class FakeDoc:
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self.exists = data is not None
+        self._data = data
+    def to_dict(self):
+        return dict(self._data) if self._data is not None else None
+    def get(self, field):
+        return self._data.get(field)
+
+class FakeRef:
+    def __init__(self, db, collection, doc_id):
+        self.db, self.collection, self.id = db, collection, doc_id
+    def set(self, data, merge=False, timeout=None):
+        docs = self.db.data.setdefault(self.collection, {})
+        now = datetime.datetime.now(datetime.timezone.utc)
+        data = {k: now if v is firestore.SERVER_TIMESTAMP else v for k, v in data.items()}
+        docs[self.id] = {**docs.get(self.id, {}), **data} if merge else data
+
+class FakeQuery:
+    def __init__(self, db, collection, filters=()):
+        self.db, self.collection, self.filters = db, collection, filters
+    def where(self, field, op, value):
+        return FakeQuery(self.db, self.collection, self.filters + ((field, op, value),))
+    def select(self, fields):
+        return self
+    def order_by(self, field, direction=None):
+        return self
+    def limit(self, n):
+        return self
+    def stream(self, timeout=None):
+        ops = {"==": lambda a, b: a == b, "in": lambda a, b: a in b, ">": lambda a, b: a > b,
+               ">=": lambda a, b: a >= b, "<": lambda a, b: a < b}
+        for doc_id, data in self.db.data.get(self.collection, {}).items():
+            if all(field in data and ops[op](data[field], value) for field, op, value in self.filters):
+                yield FakeDoc(doc_id, data)
+
+class FakeCollection(FakeQuery):
+    def document(self, doc_id=None):
+        return FakeRef(self.db, self.collection, doc_id or f"auto{next(self.db.ids)}")
+
+class FakeBatch:
+    def __init__(self):
+        self.writes = []
+    def set(self, ref, data, merge=False):
+        self.writes.append((ref, data, merge))
+    def commit(self, timeout=None):
+        for ref, data, merge in self.writes:
+            ref.set(data, merge=merge)
+
+class FakeFirestore:
+    def __init__(self):
+        self.data = {}
+        self.ids = itertools.count()
+    def collection(self, name):
+        return FakeCollection(self, name)
+    def batch(self):
+        return FakeBatch()
+    def get_all(self, refs, timeout=None):
+        return [FakeDoc(r.id, self.data.get(r.collection, {}).get(r.id)) for r in refs]
+
+def test_tracking_variants_of_a_processed_mention_are_not_new():
+    db = FakeFirestore()
+    memory = BrandMemory(brand=BRAND, db=db)
+    memory.remember_batch(make_batch([{"title": "Caída de la app", "link": "https://www.df.cl/caida?utm_source=x",
+                                       "snippet": "La app no responde"}]))
+    # Registro anterior a mention_id: solo se reconoce por URL exacta
+    db.data["banco_estado_processed_news"]["antiguo"] = {"url": "https://df.cl/antigua"}
+
+    urls = ["https://df.cl/caida?fbclid=abc", "https://df.cl/caida/", "https://df.cl/antigua", "https://df.cl/nueva"]
+    assert memory.filter_processed(urls) == set(urls[:3])
+    record = next(r for r in db.data["banco_estado_processed_news"].values() if r.get("mention_id"))
+    assert record["mention_id"] == mention_id("https://df.cl/caida") and record["snippet"] == "La app no responde"
+
+def test_relevance_drops_are_not_context_and_expire():
+    db = FakeFirestore()
+    memory = BrandMemory(brand=BRAND, db=db)
+    memory.remember_batch(make_batch([{"title": "Caída de la App BancoEstado", "link": "https://df.cl/caida",
+                                       "tag": "SERVICIO", "summary": "App caída"}]))
+    memory.remember_dropped(make_batch([{"title": "Receta de empanadas", "link": "https://df.cl/receta", "relevance": 0.01}]))
+    assert memory.filter_processed(["https://df.cl/receta", "https://df.cl/caida"]) == {"https://df.cl/receta", "https://df.cl/caida"}
+
+    # Una memoria nueva (otra ejecución) carga el contexto desde Firestore
+    fresh = BrandMemory(brand=BRAND, db=db)
+    assert [r["url"] for r in fresh.get_recent_context()] == ["https://df.cl/caida"]
+    assert fresh.get_accepted_texts() == ["Caída de la App BancoEstado App caída"]
+
+    # Vencido el plazo, la descartada vuelve a evaluarse
+    for record in db.data["banco_estado_processed_news"].values():
+        if record.get("relevance_dropped"):
+            record["expires_at"] = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=1)
+    assert memory.filter_processed(["https://df.cl/receta", "https://df.cl/caida"]) == {"https://df.cl/caida"}
+
+if __name__ == "__main__":
+    test_tracking_variants_of_a_processed_mention_are_not_new()
+    test_relevance_drops_are_not_context_and_expire()
+    print("✅ Memory tests passed!")
@@ -0,0 +1,62 @@
+import json
+from enrichment import Enricher
+from mention_store import MentionStore, mention_id, VERIFICATION_TTL_SECONDS
+from analysis import parse_analysis, verify_unenriched
+from mentions import make_batch
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+    def __call__(self):
+        return self.now
+
+def test_mention_id_uses_canonical_url():
+    assert mention_id("https://www.df.cl/nota/?utm_source=bch") == mention_id("https://df.cl/nota")
+    assert mention_id("https://df.cl/nota") != mention_id("https://df.cl/otra")
+
+def test_article_is_fetched_once_for_all_brands():
+    fetched = []
+    store = MentionStore(clock=FakeClock())
+    # Cada marca tiene su propio lote, pero comparten el almacén del runtime
+    enricher = Enricher(store, fetch=lambda url: fetched.append(url) or "<p>" + "Banco de Chile y BancoEstado " * 3 + "</p>")
+    chile = make_batch([{"title": "Bancos suben tasas", "link": "https://df.cl/tasas?utm_source=chile"}])
+    estado = make_batch([{"title": "Bancos suben tasas", "link": "https://www.df.cl/tasas"}])
+    enricher.enrich(chile)
+    enricher.enrich(estado)
+    assert len(fetched) == 1 and next(iter(estado)).body == next(iter(chile)).body
+
+def test_cached_bodies_expire_after_ttl():
+    clock = FakeClock()
+    store = MentionStore(body_ttl_seconds=60, clock=clock)
+    store.put_many({"https://df.cl/vacia": "", "https://df.cl/nota": "Texto"})
+    urls = ["https://df.cl/vacia", "https://df.cl/nota"]
+    assert store.get_many(urls) == {"https://df.cl/vacia": "", "https://df.cl/nota": "Texto"}
+    clock.now += 61
+    # Tanto la extracción fallida como el texto ya extraído se vuelven a descargar
+    assert store.get_many(urls) == {}
+
+def test_grounding_verification_is_shared_between_brands():
+    clock = FakeClock()
+    store = MentionStore(clock=clock)
+    items = [{"title": "BancoEstado cierra sucursales", "link": "https://x.com/post/1"}]
+    response = json.dumps({"state": "Alerta", "score": 50, "analysis": "a", "recommendation": "r", "tech_insight": "t",
+                           "mentions": [{"ref": 1, "tag": "t", "severity": "Crítica", "sentiment": "Negativo", "summary": "s"}]})
+    queries = []
+    search = lambda q: queries.append(q) or "VERIFICADA\nConfirmado por medios."
+
+    first = parse_analysis(response, mention_count=1)
+    assert verify_unenriched(make_batch(items), first, search=search, store=store) == 1
+    second = parse_analysis(response, mention_count=1)
+    assert verify_unenriched(make_batch(items), second, search=search, store=store) == 1
+    assert len(queries) == 1 and second["mentions"][0]["verified"] is True
+
+    clock.now += VERIFICATION_TTL_SECONDS + 1
+    verify_unenriched(make_batch(items), parse_analysis(response, mention_count=1), search=search, store=store)
+    assert len(queries) == 2
+
+if __name__ == "__main__":
+    test_mention_id_uses_canonical_url()
+    test_article_is_fetched_once_for_all_brands()
+    test_cached_bodies_expire_after_ttl()
+    test_grounding_verification_is_shared_between_brands()
+    print("✅ Mention store tests passed!")
@@ -0,0 +1,32 @@
+from mentions import make_batch, MentionBatch, ColumnarMentionBatch
+
+ITEMS = [
+    {"title": "Caída de CuentaRUT", "link": "https://df.cl/1", "source": "financial", "matched_terms": ["CuentaRUT"]},
+    {"title": "BancoEstado en X", "link": "https://x.com/2", "snippet": "hilo", "source": "social"},
+    {"title": "Repetida", "link": "https://df.cl/1", "source": "financial"},
+    {"error": "SerpApi key not found."},
+]
+
+def _check(batch):
+    assert len(batch) == 3  # Los errores de SerpApi no entran al lote
+    unique = batch.dedup()
+    assert unique.links() == ["https://df.cl/1", "https://x.com/2"]
+    new = unique.exclude_links({"https://df.cl/1"})
+    assert [m.title for m in new] == ["BancoEstado en X"]
+    assert new.to_records()[0]["snippet"] == "hilo"
+    first = next(iter(unique))
+    assert first.get("matched_terms") == ["CuentaRUT"] and first.get("snippet") is None
+    assert [len(c) for c in batch.iter_chunks(2)] == [2, 1]
+    assert len(batch.where([True, False, True])) == 2
+
+def test_record_and_columnar_batches_behave_alike():
+    small = make_batch(ITEMS)
+    large = make_batch(ITEMS, columnar=True)
+    assert isinstance(small, MentionBatch) and isinstance(large, ColumnarMentionBatch)
+    _check(small)
+    _check(large)
+    assert small.to_records() == large.to_records()
+
+if __name__ == "__main__":
+    test_record_and_columnar_batches_behave_alike()
+    print("✅ Mention batch tests passed!")
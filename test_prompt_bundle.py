@@ -0,0 +1,90 @@
+import tempfile
+from prompt_bundle import PromptCompiler, LocalContextCache, compile_bundle, report_usage, agent_instructions
+
+BRAND = {"id": "banco_estado", "name": "BancoEstado", "competitors": ["Santander", "Mercado Pago"],
+         "tech_focus": "GKE Autopilot"}
+
+def test_bundle_is_versioned_and_brand_specific():
+    bundle = compile_bundle(BRAND, "gemini-2.5-pro")
+    assert "Financial Market Expert for BancoEstado" in bundle.system_instruction
+    assert "Santander, Mercado Pago" in bundle.system_instruction
+    assert "{brand_name}" not in bundle.system_instruction
+    # El pipeline pide JSON; el formato HTML solo va en las instrucciones del agente
+    assert "Detalle de Menciones" not in bundle.system_instruction
+    assert agent_instructions(BRAND).count("Detalle de Menciones") == 1
+    assert compile_bundle(BRAND, "gemini-2.5-pro").version == bundle.version
+    assert compile_bundle({**BRAND, "name": "Otro"}, "gemini-2.5-pro").version != bundle.version
+
+def test_local_cache_serves_static_tokens():
+    cache = LocalContextCache()
+    with tempfile.TemporaryDirectory() as bundle_dir:
+        compiler = PromptCompiler("gemini-2.5-pro", cache=cache, bundle_dir=bundle_dir, min_cache_tokens=0)
+        model, bundle = compiler.model_for(BRAND, fallback=lambda s: None)
+        assert bundle.cache_valid and bundle.cache_name in cache.entries
+
+        # Una segunda compilación (p.ej. otro proceso) reutiliza el artefacto y el caché vigente
+        other = PromptCompiler("gemini-2.5-pro", cache=cache, bundle_dir=bundle_dir, min_cache_tokens=0)
+        _, reloaded = other.model_for(BRAND, fallback=lambda s: None)
+        assert reloaded.cache_name == bundle.cache_name
+
+        response = model.generate_content("1. [hoy] Caída de la app")
+        usage = report_usage(response, bundle, elapsed=0.1)
+        assert usage["cached_tokens"] == bundle.static_tokens
+        assert usage["saved_ratio"] > 0.9
+
+def test_short_instruction_is_not_cached_and_decision_persists():
+    with tempfile.TemporaryDirectory() as bundle_dir:
+        # Bajo el mínimo configurado: ni se intenta registrar
+        cache = LocalContextCache()
+        compiler = PromptCompiler("gemini-2.5-pro", cache=cache, bundle_dir=bundle_dir)
+        model, bundle = compiler.model_for(BRAND, fallback=lambda s: "plain")
+        assert model == "plain" and bundle.cacheable is False and cache.created == 0
+
+    with tempfile.TemporaryDirectory() as bundle_dir:
+        # El caché lo rechaza (mínimo del modelo mayor al configurado): se recuerda en el artefacto
+        cache = LocalContextCache(min_tokens=32768)
+        compiler = PromptCompiler("gemini-2.5-pro", cache=cache, bundle_dir=bundle_dir, min_cache_tokens=0)
+        model, bundle = compiler.model_for(BRAND, fallback=lambda s: "plain")
+        assert model == "plain" and bundle.cacheable is False and cache.created == 1
+        compiler.model_for(BRAND, fallback=lambda s: "plain")
+        other = PromptCompiler("gemini-2.5-pro", cache=cache, bundle_dir=bundle_dir, min_cache_tokens=0)
+        _, reloaded = other.model_for(BRAND, fallback=lambda s: "plain")
+        assert reloaded.cacheable is False and cache.created == 1
+
+        # Sin caché, el reporte no atribuye ahorro: todos los tokens viajan en la llamada
+        response = type("Response", (), {"usage_metadata": type("Usage", (), {
+            "prompt_token_count": bundle.static_tokens + 200, "cached_content_token_count": 0,
+            "candidates_token_count": 50})()})()
+        usage = report_usage(response, bundle, elapsed=0.1)
+        assert usage["cached_tokens"] == 0 and usage["saved_ratio"] == 0.0
+
+def test_transient_cache_errors_are_retried():
+    class FlakyCache(LocalContextCache):
+        def create(self, *args):
+            if not self.created:
+                self.created += 1
+                raise RuntimeError("429 Resource exhausted")
+            return super().create(*args)
+
+    with tempfile.TemporaryDirectory() as bundle_dir:
+        cache = FlakyCache()
+        compiler = PromptCompiler("gemini-2.5-pro", cache=cache, bundle_dir=bundle_dir, min_cache_tokens=0)
+        model, bundle = compiler.model_for(BRAND, fallback=lambda s: "plain")
+        assert model == "plain" and bundle.cacheable is None
+        # Otro proceso no hereda el error: el artefacto sigue sin decisión
+        other = PromptCompiler("gemini-2.5-pro", cache=cache, bundle_dir=bundle_dir, min_cache_tokens=0)
+        model, reloaded = other.model_for(BRAND, fallback=lambda s: "plain")
+        assert model != "plain" and reloaded.cacheable is True and cache.created == 2
+
+def test_fallback_without_cache():
+    compiler = PromptCompiler("gemini-2.5-pro", cache=None, bundle_dir=tempfile.mkdtemp())
+    model, bundle = compiler.model_for(BRAND, fallback=lambda system_instruction: ("plain", system_instruction))
+    assert model == ("plain", bundle.system_instruction)
+
+if __name__ == "__main__":
+    test_bundle_is_versioned_and_brand_specific()
+    test_local_cache_serves_static_tokens()
+    test_short_instruction_is_not_cached_and_decision_persists()
+    test_transient_cache_errors_are_retried()
+    test_fallback_without_cache()
+    print("✅ Prompt bundle tests passed!")
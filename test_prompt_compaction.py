@@ -0,0 +1,74 @@
+import json
+from types import SimpleNamespace
+from analysis import build_prompt, parse_analysis, apply_analysis, render_report_html
+from deadline import submit
+from mentions import make_batch
+from prompt_bundle import estimate_tokens
+from prompt_compaction import compact_mention, fit_prompt, restore_links, TokenLedger, record_usage, count_tokens
+
+LONG_URL = "https://www.df.cl/mercados/banca/bancoestado-cae?utm_source=newsletter&utm_medium=email&utm_campaign=x&fbclid=abc"
+
+def test_prompt_uses_aliases_instead_of_urls():
+    batch = make_batch([
+        {"title": "Caída de  la app&nbsp;BancoEstado​", "link": LONG_URL, "snippet": "La app no responde desde",
+         "body": "La app no responde desde la mañana. " * 200},
+        {"title": "BancoEstado lanza tarjeta", "link": "https://elmercurio.com/tarjeta", "date": "2026-10-18"},
+    ])
+    prompt = build_prompt(batch, "2026-10-19", item_tokens=200)
+    assert "[R1] (Fecha desc.) Caída de la app BancoEstado · df.cl" in prompt
+    assert "[R2] (2026-10-18) BancoEstado lanza tarjeta · elmercurio.com" in prompt
+    assert "utm_source" not in prompt and "https://" not in prompt
+    # El extracto repetido al inicio del texto se omite, y el texto se recorta al presupuesto de la mención
+    assert "Extracto:" not in prompt
+    assert estimate_tokens(compact_mention(1, next(iter(batch)), 200)) <= 200
+
+def test_fit_prompt_shrinks_item_budget_until_it_fits():
+    mention = SimpleNamespace(title="BancoEstado", link="https://df.cl/1", snippet=None, body="palabra " * 2000,
+                              get=lambda key, default=None: default)
+    build = lambda budget: "".join(compact_mention(i, mention, budget) for i in range(1, 21))
+    prompt, tokens, budget = fit_prompt(build, estimate_tokens, max_tokens=3000, budget=400)
+    assert tokens <= 3000 and budget < 400 and tokens == estimate_tokens(prompt)
+
+def test_count_tokens_calls_the_model_only_near_the_limit():
+    calls = []
+    model = SimpleNamespace(count_tokens=lambda prompt: calls.append(prompt) or SimpleNamespace(total_tokens=2900))
+    assert count_tokens(model, "palabra " * 200, max_tokens=3000) == estimate_tokens("palabra " * 200)
+    assert calls == []
+    # Cerca del máximo la estimación no alcanza: se mide con el modelo
+    assert count_tokens(model, "palabra " * 1000, max_tokens=3000) == 2900 and len(calls) == 1
+    failing = SimpleNamespace(count_tokens=lambda prompt: 1 / 0)
+    assert count_tokens(failing, "palabra " * 1000, max_tokens=3000) == estimate_tokens("palabra " * 1000)
+
+def test_aliases_become_links_in_report_and_are_stripped_from_memory():
+    batch = make_batch([{"title": "Caída", "link": LONG_URL}])
+    analysis = parse_analysis(json.dumps({
+        "state": "Alerta", "score": 60, "analysis": "Caída masiva [R1]; ver también [R7].", "recommendation": "Comunicar.",
+        "tech_insight": "GKE.", "mentions": [{"ref": 1, "tag": "SERVICIO", "severity": "Media", "sentiment": "Negativo",
+                                               "summary": "App caída [R1]."}]}), mention_count=1)
+    apply_analysis(batch, analysis)
+    html = render_report_html(analysis, batch)
+    assert 'Caída masiva <a href="https://www.df.cl/mercados/banca/bancoestado-cae?utm_source=newsletter&amp;' in html
+    assert "[R7]" in html  # Un alias inexistente no se convierte en enlace
+    assert next(iter(batch)).summary == "App caída."
+    assert restore_links("sin alias", {1: LONG_URL}) == "sin alias"
+
+def test_ledger_totals_calls_across_threads():
+    usage = lambda i, o, c=0: SimpleNamespace(usage_metadata=SimpleNamespace(
+        prompt_token_count=i, candidates_token_count=o, cached_content_token_count=c))
+    with TokenLedger("banco_estado") as ledger:
+        record_usage("analysis", usage(1000, 300, 800))
+        # Las verificaciones corren en hilos de deadline.submit, que copian el contexto
+        for future in [submit(lambda: record_usage("grounding", usage(50, 20))) for _ in range(3)]:
+            future.result()
+    record_usage("analysis", usage(999, 999))  # Fuera de la corrida no se cuenta
+    totals = ledger.totals()
+    assert (totals["calls"], totals["input"], totals["cached"], totals["output"]) == (4, 1150, 800, 360)
+    assert totals["by_call"]["grounding"]["calls"] == 3
+
+if __name__ == "__main__":
+    test_prompt_uses_aliases_instead_of_urls()
+    test_fit_prompt_shrinks_item_budget_until_it_fits()
+    test_count_tokens_calls_the_model_only_near_the_limit()
+    test_aliases_become_links_in_report_and_are_stripped_from_memory()
+    test_ledger_totals_calls_across_threads()
+    print("✅ Prompt compaction tests passed!")
@@ -0,0 +1,78 @@
+from query_planner import plan_queries, execute_plan, attribute_terms, MAX_QUERY_WORDS
+
+TERMS = [
+    "Banco de Chile", "Banco Edwards", "Cuenta FAN", "Banchile Inversiones", "Banchile Pagos",
+    "Eduardo Ebensperger", "Esteban Kemp", "Julio Medina Ortega", "App de Banco de Chile",
+    "directorio Banco de Chile",
+]
+
+def test_plan_packs_terms_within_limits():
+    plan = plan_queries(TERMS, per_term_limit=5)
+    assert plan.call_count < plan.naive_call_count / 3
+    for group in plan.groups:
+        assert len(group.query.split()) <= MAX_QUERY_WORDS
+    for source in ("financial", "social"):
+        packed = [t for g in plan.groups if g.source == source for t in g.terms]
+        assert packed == TERMS
+
+def test_single_terms_stay_unquoted_and_groups_use_exact_phrases():
+    plan = plan_queries(["Banco de Chile"], sources=("financial",))
+    assert plan.groups[0].query.endswith(" Banco de Chile") and '"' not in plan.groups[0].query
+    grouped = plan_queries(["Banco de Chile", "Cuenta FAN"], sources=("financial",)).groups[0].query
+    assert grouped.endswith('("Banco de Chile" OR "Cuenta FAN")')
+
+    calls = []
+    search = lambda query, num: calls.append(query) or [{"title": "Sin coincidencia", "link": "https://df.cl/z"},
+                                                        {"title": "Sin coincidencia", "link": "https://www.df.cl/z?utm_source=x"}]
+    results = execute_plan(plan, search=search)
+    # Una consulta de un solo término acredita sus resultados aunque el texto no lo repita
+    assert results[0]["matched_terms"] == ["Banco de Chile"]
+    # Las variantes con parámetros de seguimiento son un solo resultado
+    assert len(results) == 1
+
+def test_attribution_ignores_accents_and_uses_url_slug():
+    item = {"title": "Cae la app", "snippet": "", "link": "https://www.df.cl/mercados/banco-edwards-y-cuenta-fan"}
+    assert attribute_terms(item, TERMS) == ["Banco Edwards", "Cuenta FAN"]
+    assert attribute_terms({"title": "CAÍDA BANCOESTADO"}, ["Caída BancoEstado"]) == ["Caída BancoEstado"]
+
+def test_saturated_group_is_split():
+    calls = []
+
+    def fake_search(query, num):
+        calls.append((query, num))
+        # La primera consulta combinada se satura; las subdivisiones no
+        count = num if len(calls) == 1 else 1
+        return [{"title": f"Banco Edwards {len(calls)}-{i}", "link": f"https://df.cl/{len(calls)}/{i}"} for i in range(count)]
+
+    plan = plan_queries(TERMS[:4], per_term_limit=5, sources=("financial",))
+    results = execute_plan(plan, search=fake_search)
+
+    assert len(calls) == 3
+    assert plan.groups[0].saturated and plan.groups[1].depth == 1
+    assert len(results) == 22
+    assert all(r["matched_terms"] == ["Banco Edwards"] for r in results[:21])
+    # Sin coincidencia textual en un grupo OR, el resultado no se acredita a ningún término
+    assert results[21]["matched_terms"] == []
+    assert plan.to_dict()["call_count"] == 3
+
+def test_full_page_saturates_even_below_num():
+    calls = []
+
+    def fake_search(query, num):
+        calls.append(num)
+        # Google entrega a lo más 10 por página aunque el grupo pida 20
+        count = 10 if len(calls) == 1 else 3
+        return [{"title": f"Banco Edwards {len(calls)}-{i}", "link": f"https://df.cl/{len(calls)}/{i}"} for i in range(count)]
+
+    plan = plan_queries(TERMS[:4], per_term_limit=5, sources=("financial",))
+    execute_plan(plan, search=fake_search, page_size=10)
+    assert calls == [20, 10, 10]
+    assert plan.groups[0].saturated and not plan.groups[1].saturated
+
+if __name__ == "__main__":
+    test_plan_packs_terms_within_limits()
+    test_single_terms_stay_unquoted_and_groups_use_exact_phrases()
+    test_attribution_ignores_accents_and_uses_url_slug()
+    test_saturated_group_is_split()
+    test_full_page_saturates_even_below_num()
+    print("✅ Query planner tests passed!")
@@ -0,0 +1,97 @@
+import pytest
+import requests
+import ratelimit
+from ratelimit import RateLimiter, LocalBucketStore, Limit, Priority, RateLimitTimeout, tenant_context, escalate
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+    def __call__(self):
+        return self.now
+    def sleep(self, seconds):
+        self.now += seconds
+
+def _limiter(per_minute=60, burst=4, share=0.5):
+    clock = FakeClock()
+    limiter = RateLimiter(LocalBucketStore(), {"serpapi": Limit(per_minute, burst)}, tenant_share=share,
+                          clock=clock, sleep=clock.sleep)
+    return limiter, clock
+
+def test_tenant_share_and_priority_reserve():
+    limiter, clock = _limiter()
+    with tenant_context("banco_chile", Priority.NORMAL):
+        limiter.acquire("serpapi")
+        limiter.acquire("serpapi")
+        # La marca agotó su mitad de la ráfaga: debe esperar aunque el upstream tenga cuota
+        with pytest.raises(RateLimitTimeout):
+            limiter.acquire("serpapi", timeout=0.5)
+
+    with tenant_context("banco_estado", Priority.LOW):
+        # Quedan 2 tokens, pero la clase baja debe dejar la mitad de la ráfaga en reserva
+        with pytest.raises(RateLimitTimeout):
+            limiter.acquire("serpapi", timeout=0.5)
+        with escalate(Priority.CRITICAL):
+            limiter.acquire("serpapi", timeout=0)
+    assert clock.now == 0.0
+
+def test_throttled_call_honors_retry_after():
+    limiter, clock = _limiter()
+    calls = []
+
+    def flaky():
+        calls.append(clock.now)
+        if len(calls) == 1:
+            response = requests.Response()
+            response.status_code = 429
+            response.headers["Retry-After"] = "30"
+            raise requests.HTTPError(response=response)
+        return "ok"
+
+    assert limiter.call("serpapi", flaky) == "ok"
+    assert calls[1] >= 30  # El bucket compartido quedó vacío durante el Retry-After
+
+def test_client_errors_are_not_retried():
+    limiter, _ = _limiter()
+    calls = []
+
+    def bad_request():
+        calls.append(1)
+        response = requests.Response()
+        response.status_code = 401
+        raise requests.HTTPError(response=response)
+
+    with pytest.raises(requests.HTTPError):
+        limiter.call("serpapi", bad_request)
+    assert len(calls) == 1
+
+def test_shared_store_errors_fall_back_locally_and_retry():
+    class FlakyStore(LocalBucketStore):
+        def __init__(self):
+            super().__init__()
+            self.calls, self.failing = 0, True
+        def take(self, *args):
+            self.calls += 1
+            if self.failing:
+                raise RuntimeError("UNAVAILABLE")
+            return super().take(*args)
+
+    clock = FakeClock()
+    store = FlakyStore()
+    limiter = RateLimiter(store, {"serpapi": Limit(600, 100)}, clock=clock, sleep=clock.sleep)
+    limiter.acquire("serpapi")
+    limiter.acquire("serpapi")
+    # Durante el backoff no se insiste con el almacén compartido
+    assert store.calls == 1 and limiter.store is store
+
+    store.failing = False
+    clock.now += ratelimit.STORE_RETRY_SECONDS
+    limiter.acquire("serpapi")
+    limiter.acquire("serpapi")
+    assert store.calls == 3
+
+if __name__ == "__main__":
+    test_tenant_share_and_priority_reserve()
+    test_throttled_call_honors_retry_after()
+    test_client_errors_are_not_retried()
+    test_shared_store_errors_fall_back_locally_and_retry()
+    print("✅ Rate limiter tests passed!")
@@ -0,0 +1,48 @@
+from datetime import datetime, timedelta, timezone
+from recent_index import RecentMentionIndex
+
+NOW = datetime(2026, 3, 2, 12, 0, tzinfo=timezone.utc)
+
+def _index():
+    index = RecentMentionIndex(max_items=3)
+    # Se cargan en orden cronológico, como en la sincronización con Firestore
+    index.add("c", {"title": "Directorio de BancoEstado", "processed_at": NOW - timedelta(days=20)})
+    index.add("b", {"title": "BancoEstado lanza beneficio CuentaRUT", "snippet": "Nueva app", "processed_at": NOW - timedelta(days=2)})
+    index.add("a", {"title": "Caída de la App de BancoEstado", "sentiment": "negativo", "processed_at": NOW - timedelta(days=1)})
+    return index
+
+def test_keyword_search_ranks_by_matches_then_recency():
+    results = _index().search("caida app", days=7, now=NOW)
+    assert [r["id"] for r in results] == ["a", "b"]
+    assert "_tokens" not in results[0]
+
+def test_time_window_and_sentiment_token():
+    index = _index()
+    assert [r["id"] for r in index.search("", days=7, now=NOW)] == ["a", "b"]
+    assert [r["id"] for r in index.search("directorio", days=30, now=NOW)] == ["c"]
+    assert [r["id"] for r in index.search("negativo", days=7, now=NOW)] == ["a"]
+
+def test_index_is_bounded():
+    index = _index()
+    index.add("d", {"title": "Fraude en CajaVecina", "processed_at": NOW})
+    assert len(index) == 3
+    assert index.search("directorio", days=30, now=NOW) == []
+    assert "directorio" not in index._postings
+
+def test_eviction_follows_processed_at_not_insertion_order():
+    index = RecentMentionIndex(max_items=2)
+    # Primera carga desde Firestore: de la más reciente a la más antigua
+    index.add("nueva", {"title": "Caída de la App", "processed_at": NOW})
+    index.add("media", {"title": "Fraude en CajaVecina", "processed_at": NOW - timedelta(days=3)})
+    index.add("vieja", {"title": "Directorio de BancoEstado", "processed_at": NOW - timedelta(days=20)})
+    assert [r["id"] for r in index.search("", days=30, now=NOW)] == ["nueva", "media"]
+    index.add("hoy", {"title": "BancoEstado lanza beneficio", "processed_at": NOW + timedelta(hours=1)})
+    assert [r["id"] for r in index.search("", days=30, now=NOW + timedelta(hours=1))] == ["hoy", "nueva"]
+    assert "directorio" not in index._postings and "fraude" not in index._postings
+
+if __name__ == "__main__":
+    test_keyword_search_ranks_by_matches_then_recency()
+    test_time_window_and_sentiment_token()
+    test_index_is_bounded()
+    test_eviction_follows_processed_at_not_insertion_order()
+    print("✅ Recent index tests passed!")
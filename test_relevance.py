@@ -0,0 +1,51 @@
+import logging
+import pytest
+from mentions import make_batch
+from relevance import filter_relevant, score_texts, profile_documents, executive_names
+
+BRAND = {
+    "id": "banco_chile", "name": "Banco de Chile",
+    "search_terms": ["Banco de Chile", "App de Banco de Chile"],
+    "products": ["Cuenta FAN", "Banchile Inversiones"],
+    "executives": ["Eduardo Ebensperger, Gerente General", "Julio Medina Ortega, Gerente de Tecnología"],
+    "competitors": ["Santander", "BCI"],
+    "tech_focus": "Banca digital, ciberseguridad",
+}
+
+ITEMS = [
+    {"title": "Banco de Chile lanza nueva versión de su app", "link": "https://df.cl/1",
+     "snippet": "La Cuenta FAN suma funciones de banca digital", "matched_terms": ["Banco de Chile"]},
+    {"title": "Julio Medina anota doblete en la victoria de Cobreloa", "link": "https://latercera.com/2",
+     "snippet": "El delantero fue la figura del partido del domingo", "matched_terms": ["Julio Medina Ortega"]},
+    {"title": "Receta de empanadas para fiestas patrias", "link": "https://biobiochile.cl/3",
+     "snippet": "Consejos para el horno", "matched_terms": ["Banco de Chile"]},
+    {"title": "Julio Medina Ortega, gerente de tecnología del Banco de Chile, habla de ciberseguridad",
+     "link": "https://emol.com/4", "snippet": "", "matched_terms": ["Julio Medina Ortega"]},
+]
+
+@pytest.mark.parametrize("columnar", [False, True])
+def test_drops_homonyms_and_off_topic(columnar, caplog):
+    batch = make_batch(ITEMS, columnar=columnar)
+    with caplog.at_level(logging.INFO):
+        kept, dropped = filter_relevant(batch, BRAND)
+    assert kept.links() == ["https://df.cl/1", "https://emol.com/4"]
+    assert sorted(dropped.links()) == ["https://biobiochile.cl/3", "https://latercera.com/2"]
+    assert all(m.relevance is not None for m in dropped)
+    # Tasas de descarte global y por término en los logs, para calibrar el umbral
+    assert "2/4 descartadas" in caplog.text
+    assert "Julio Medina Ortega 1/2" in caplog.text
+
+def test_rank_mode_keeps_everything_sorted():
+    kept, dropped = filter_relevant(make_batch(ITEMS), {**BRAND, "relevance_mode": "rank"})
+    assert len(kept) == 4 and not len(dropped)
+    scores = kept.column("relevance")
+    assert scores == sorted(scores, reverse=True)
+
+def test_accepted_mentions_extend_the_profile():
+    text = ["Nuevo beneficio para clientes de la tarjeta Travel Plus"]
+    docs = profile_documents(BRAND)
+    before = score_texts(docs, text, executive_names(BRAND))[0]
+    after = score_texts(profile_documents(BRAND, ["Banco de Chile amplía beneficios de la tarjeta Travel Plus"]),
+                        text, executive_names(BRAND))[0]
+    assert before == 0 and after > 0.05
+    assert len(score_texts(docs, [])) == 0
@@ -0,0 +1,110 @@
+import os
+import gzip
+import datetime
+import tempfile
+import replay
+from mentions import make_batch
+from recorder import RunRecorder, read_recording, list_recordings
+from replay import select_items, relevance_recorded, replay_recording, seen_before, Checkpoint, _save
+from prompt_bundle import PromptCompiler, LocalContextCache
+from memory import BrandMemory
+from test_memory import FakeFirestore
+
+BRAND = {"id": "banco_estado", "name": "BancoEstado", "search_terms": ["BancoEstado", "CuentaRUT"],
+         "competitors": [], "tech_focus": "GKE"}
+ITEMS = [
+    {"title": "Caída de CuentaRUT", "link": "https://df.cl/1", "source": "financial"},
+    {"title": "Santander sube tasas", "link": "https://df.cl/2", "source": "financial"},
+]
+
+def _record(directory, brand_id, started_at, relevance=True):
+    with RunRecorder(brand_id, started_at=started_at, directory=directory, bucket=None) as recorder:
+        recorder.record("run", brand_id=brand_id)
+        recorder.record("search", items=ITEMS)
+        recorder.record("dedup", new_links=["https://df.cl/2"])
+        if relevance:
+            recorder.record("relevance", scores={"https://df.cl/2": 0.1}, dropped=[])
+    return recorder.path
+
+def test_recording_is_appendable_and_listed_by_date():
+    with tempfile.TemporaryDirectory() as d:
+        path = _record(d, "banco_estado", datetime.datetime(2026, 1, 5, 8))
+        _record(d, "banco_estado", datetime.datetime(2026, 2, 5, 8))
+        # Una línea truncada al final (corrida interrumpida) no impide leer lo anterior
+        with gzip.open(path, "at", encoding="utf-8") as f:
+            f.write('{"kind": "resp')
+        assert [e["kind"] for e in read_recording(path)] == ["run", "search", "dedup", "relevance"]
+        assert list_recordings("banco_estado", until=datetime.datetime(2026, 2, 1), directory=d) == [path]
+
+def test_select_items_same_brand_and_reattributed():
+    events = [{"kind": "run", "brand_id": "banco_estado"}, {"kind": "search", "items": ITEMS},
+              {"kind": "dedup", "new_links": ["https://df.cl/2"]}]
+    assert select_items(events, BRAND).links() == ["https://df.cl/2"]
+    assert not relevance_recorded(events, BRAND)
+    # La decisión del filtro de relevancia de la corrida original se respeta
+    events.append({"kind": "relevance", "scores": {"https://df.cl/2": 0.01}, "dropped": ["https://df.cl/2"]})
+    assert select_items(events, BRAND).links() == [] and relevance_recorded(events, BRAND)
+
+    events[0]["brand_id"] = "banco_chile"
+    other = select_items(events, BRAND)
+    assert other.links() == ["https://df.cl/1"]
+    assert next(iter(other)).matched_terms == ["CuentaRUT"]
+    assert not relevance_recorded(events, BRAND)
+
+def test_replay_recording_and_checkpoint():
+    class FakeRuntime:
+        prompts = PromptCompiler("gemini-2.5-pro", cache=LocalContextCache(), bundle_dir=tempfile.mkdtemp(), min_cache_tokens=0)
+        def analysis_model(self, brand):
+            return self.prompts.model_for(brand, fallback=lambda s: None)
+
+    with tempfile.TemporaryDirectory() as d:
+        path = _record(d, "banco_estado", datetime.datetime(2026, 1, 5, 8))
+        replay._WORKER.update(brand=BRAND, runtime=FakeRuntime())
+        result = replay_recording(path)
+        assert result["status"] == "ok" and result["score"] == 100 and result["mentions"] == 1
+        # Sin decisión grabada se vuelve a filtrar: "Santander sube tasas" no es de BancoEstado
+        old = _record(d, "banco_estado", datetime.datetime(2025, 12, 5, 8), relevance=False)
+        assert replay_recording(old)["status"] == "empty"
+
+        assert result["records"][0]["link"] == "https://df.cl/2" and "body" not in result["records"][0]
+        # Ya contada en una grabación anterior del rango: no se vuelve a analizar
+        assert replay_recording(path, exclude={"https://df.cl/2"})["status"] == "empty"
+
+        checkpoint = Checkpoint(os.path.join(d, "ckpt.json"), "banco_estado")
+        checkpoint.mark(path, result)
+        assert Checkpoint(checkpoint.path, "banco_estado").pending([path]) == []
+
+def test_source_brand_mentions_count_once_across_recordings():
+    with tempfile.TemporaryDirectory() as d:
+        first = _record(d, "banco_chile", datetime.datetime(2026, 1, 5, 8))
+        second = _record(d, "banco_chile", datetime.datetime(2026, 1, 6, 8))
+        # La misma nota re-atribuida (CuentaRUT) aparece en ambas búsquedas grabadas
+        assert seen_before([first, second], BRAND) == {first: set(), second: {"https://df.cl/1"}}
+
+def test_replay_overwrites_the_live_history_point_and_remembers_new_mentions():
+    db = FakeFirestore()
+    memory = BrandMemory(brand=BRAND, db=db)
+    memory.save_daily_summary(40, state="Alerta")  # Punto de la corrida en vivo (id automático)
+    memory.remember_batch(make_batch([{"title": "Santander sube tasas", "link": "https://df.cl/2"}]))
+    started_at = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(minutes=2)
+    result = {"started_at": started_at.isoformat(), "score": 90, "state": "Estable", "sentiment": {}, "tokens": {}}
+    records = [{"title": "Santander sube tasas", "link": "https://df.cl/2?utm_source=x", "tag": "MERCADO"},
+               {"title": "Caída de CuentaRUT", "link": "https://df.cl/1", "tag": "SERVICIO"}]
+
+    _save(memory, "recordings/banco_estado/20260105T080000_abc.jsonl.gz", result, records, same_brand=True)
+    history = db.data["banco_estado_brand_history"]
+    assert len(history) == 1 and next(iter(history.values()))["brand_index"] == 90
+    processed = [r["url"] for r in db.data["banco_estado_processed_news"].values()]
+    assert sorted(processed) == ["https://df.cl/1", "https://df.cl/2"]
+
+    # Desde otra marca no hay punto en vivo que reemplazar: el documento lleva el nombre de la grabación
+    _save(memory, "recordings/banco_chile/20260105T080000_abc.jsonl.gz", result, [], same_brand=False)
+    assert "20260105T080000_abc" in history and len(history) == 2
+
+if __name__ == "__main__":
+    test_recording_is_appendable_and_listed_by_date()
+    test_select_items_same_brand_and_reattributed()
+    test_replay_recording_and_checkpoint()
+    test_source_brand_mentions_count_once_across_recordings()
+    test_replay_overwrites_the_live_history_point_and_remembers_new_mentions()
+    print("✅ Replay tests passed!")
@@ -0,0 +1,78 @@
+from scheduler import schedule_terms, update_term_stats, MAX_INTERVAL
+from query_planner import execute_plan
+
+TERMS = ["BancoEstado", "CuentaRUT", "Caída BancoEstado", "directorio banco estado"]
+
+def test_cold_start_polls_every_term():
+    plan, schedules = schedule_terms(TERMS, {}, critical_terms=["Caída BancoEstado"], call_budget=10)
+    assert all(s.polled for s in schedules)
+    assert plan.terms[0] == "Caída BancoEstado"  # Críticos primero
+
+def test_low_yield_terms_are_polled_less_often():
+    stats = {
+        "BancoEstado": {"yield_ewma": 4.0, "urgent_ewma": 0.2, "runs_since_poll": 0},
+        "CuentaRUT": {"yield_ewma": 1.5, "urgent_ewma": 0.0, "runs_since_poll": 0},
+        "Caída BancoEstado": {"yield_ewma": 0.0, "urgent_ewma": 0.0, "runs_since_poll": 0},
+        "directorio banco estado": {"yield_ewma": 0.0, "urgent_ewma": 0.0, "runs_since_poll": 0},
+    }
+    plan, schedules = schedule_terms(TERMS, stats, critical_terms=["Caída BancoEstado"], call_budget=10)
+    by_term = {s.term: s for s in schedules}
+    assert by_term["Caída BancoEstado"].polled           # Crítico aunque no rinda
+    assert not by_term["directorio banco estado"].polled  # Bajo rendimiento: espera su turno
+    assert by_term["directorio banco estado"].interval == MAX_INTERVAL
+    assert by_term["BancoEstado"].depth > by_term["CuentaRUT"].depth
+
+    stats["directorio banco estado"]["runs_since_poll"] = MAX_INTERVAL - 1
+    _, schedules = schedule_terms(TERMS, stats, critical_terms=["Caída BancoEstado"], call_budget=10)
+    assert {s.term: s for s in schedules}["directorio banco estado"].polled
+
+def test_budget_drops_lowest_priority_first():
+    stats = {t: {"yield_ewma": float(i), "runs_since_poll": 0} for i, t in enumerate(reversed(TERMS), 1)}
+    plan, schedules = schedule_terms(TERMS, stats, critical_terms=["Caída BancoEstado"], call_budget=1)
+    # Los críticos nunca se descartan, aunque por sí solos excedan el presupuesto
+    assert plan.terms == ["Caída BancoEstado"]
+    assert [s.term for s in schedules if s.polled] == ["Caída BancoEstado"]
+
+def test_update_stats_counts_new_and_urgent_mentions():
+    _, schedules = schedule_terms(TERMS, {}, call_budget=10)
+    new_items = [
+        {"title": "Caída BancoEstado: problema con la app, no funciona", "matched_terms": ["Caída BancoEstado", "BancoEstado"]},
+        {"title": "BancoEstado lanza nueva tarjeta", "matched_terms": ["BancoEstado"]},
+    ]
+    stats = update_term_stats({}, schedules, new_items)
+    assert stats["BancoEstado"]["yield_ewma"] == 2
+    assert stats["Caída BancoEstado"]["urgent_ewma"] > 0
+    assert stats["CuentaRUT"]["yield_ewma"] == 0 and stats["CuentaRUT"]["polls"] == 1
+
+def test_skipped_queries_do_not_count_as_zero_yield():
+    stats = {t: {"yield_ewma": 3.0, "runs_since_poll": 0, "polls": 5} for t in TERMS}
+    plan, schedules = schedule_terms(TERMS, stats, call_budget=10)
+    # El deadline de la búsqueda se agota tras la primera consulta
+    deadline = type("Deadline", (), {"calls": 0, "expired": property(lambda self: self.calls > 0)})()
+    def search(query, num):
+        deadline.calls += 1
+        return []
+    execute_plan(plan, search=search, deadline=deadline)
+    assert plan.executed_terms == []  # Ningún término alcanzó a consultarse en ambas fuentes
+
+    updated = update_term_stats(stats, schedules, [], plan.executed_terms)
+    assert all(updated[t]["yield_ewma"] == 3.0 and updated[t]["polls"] == 5 for t in TERMS)
+    assert all(updated[t]["runs_since_poll"] == 1 for t in TERMS)
+
+def test_failed_queries_do_not_count_as_zero_yield():
+    stats = {t: {"yield_ewma": 3.0, "runs_since_poll": 0, "polls": 5} for t in TERMS}
+    plan, schedules = schedule_terms(TERMS, stats, call_budget=10)
+    execute_plan(plan, search=lambda query, num: [{"error": "503 Server Error: Service Unavailable"}])
+    assert plan.call_count > 0 and plan.executed_terms == []
+
+    updated = update_term_stats(stats, schedules, [], plan.executed_terms)
+    assert all(updated[t]["yield_ewma"] == 3.0 and updated[t]["runs_since_poll"] == 1 for t in TERMS)
+
+if __name__ == "__main__":
+    test_cold_start_polls_every_term()
+    test_low_yield_terms_are_polled_less_often()
+    test_budget_drops_lowest_priority_first()
+    test_update_stats_counts_new_and_urgent_mentions()
+    test_skipped_queries_do_not_count_as_zero_yield()
+    test_failed_queries_do_not_count_as_zero_yield()
+    print("✅ Scheduler tests passed!")
@@ -0,0 +1,93 @@
+import json
+import time
+import urllib.request
+import urllib.error
+import threading
+import pytest
+import worker
+from http.server import ThreadingHTTPServer
+from worker import RunQueue
+
+BRANDS = {"banco_chile": {"id": "banco_chile", "search_terms": ["Banco de Chile"]},
+          "banco_estado": {"id": "banco_estado", "search_terms": ["BancoEstado", "Caída BancoEstado", "falla"]}}
+
+def _fake_run_brand(active, peak, lock, seconds=0.05):
+    def run_brand(brand, runtime, terms=None, notify_empty=True):
+        with lock:
+            active[brand["id"]] = active.get(brand["id"], 0) + 1
+            peak[brand["id"]] = max(peak.get(brand["id"], 0), active[brand["id"]])
+            peak["total"] = max(peak.get("total", 0), sum(v for k, v in active.items()))
+        time.sleep(seconds)
+        with lock:
+            active[brand["id"]] -= 1
+        if terms == ["falla"]:
+            raise RuntimeError("boom")
+    return run_brand
+
+def test_runs_are_serialized_per_brand_and_drained(monkeypatch):
+    active, peak, lock = {}, {}, threading.Lock()
+    monkeypatch.setattr(worker, "run_brand", _fake_run_brand(active, peak, lock))
+    run_queue = RunQueue(runtime=None, brands=BRANDS, workers=4, per_brand=1)
+    run_ids = [run_queue.submit("banco_chile") for _ in range(3)] + [run_queue.submit("banco_estado") for _ in range(2)]
+    run_ids.append(run_queue.submit("banco_estado", terms=["falla"]))
+
+    assert run_queue.drain(timeout=10)
+    assert peak["banco_chile"] == 1 and peak["banco_estado"] == 1
+    assert peak["total"] == 2  # Marcas distintas sí corren en paralelo
+    assert [run_queue.runs[r]["status"] for r in run_ids] == ["done"] * 5 + ["failed"]
+    with pytest.raises(RuntimeError):
+        run_queue.submit("banco_chile")
+    with pytest.raises(ValueError):
+        RunQueue(runtime=None, brands=BRANDS, workers=0).submit("otra_marca")
+
+def test_drain_times_out_with_runs_in_flight(monkeypatch):
+    monkeypatch.setattr(worker, "run_brand", _fake_run_brand({}, {}, threading.Lock(), seconds=0.5))
+    run_queue = RunQueue(runtime=None, brands=BRANDS, workers=1)
+    run_queue.submit("banco_chile")
+    run_queue.submit("banco_chile")
+    assert run_queue.drain(timeout=0.1) is False
+
+def test_finished_runs_are_evicted(monkeypatch):
+    monkeypatch.setattr(worker, "run_brand", lambda *a, **k: None)
+    monkeypatch.setattr(worker, "MAX_FINISHED_RUNS", 2)
+    now = [1000.0]
+    run_queue = RunQueue(runtime=None, brands=BRANDS, workers=1, clock=lambda: now[0])
+    first = run_queue.submit("banco_chile")
+    for _ in range(3):
+        run_queue.submit("banco_estado")
+        time.sleep(0.05)
+    # Tope por cantidad: solo quedan las 2 terminadas más recientes (más la recién encolada)
+    assert first not in run_queue.runs and len(run_queue.runs) <= 3
+
+    now[0] += worker.FINISHED_RUN_TTL_SECONDS + 1
+    last = run_queue.submit("banco_chile")
+    assert list(run_queue.runs) == [last]
+    assert run_queue.drain(timeout=10)
+
+def test_run_endpoint_rejects_invalid_payloads(monkeypatch):
+    monkeypatch.setattr(worker, "run_brand", lambda *a, **k: None)
+    run_queue = RunQueue(runtime=None, brands=BRANDS, workers=1)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), worker.make_handler(run_queue))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    def post(payload):
+        url = f"http://127.0.0.1:{server.server_address[1]}/run"
+        request = urllib.request.Request(url, data=json.dumps(payload).encode("utf-8"), method="POST")
+        try:
+            with urllib.request.urlopen(request) as response:
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+    try:
+        assert post(["banco_estado"]) == 400
+        # Un string se iteraría letra por letra: una consulta pagada por carácter
+        assert post({"brand_id": "banco_estado", "terms": "Caída"}) == 400
+        assert post({"brand_id": "banco_estado", "terms": ["Caída", "BancoEstado"]}) == 400
+        assert post({"brand_id": "banco_estado", "terms": ["Caída BancoEstado"]}) == 202
+    finally:
+        server.shutdown()
+    assert run_queue.drain(timeout=10)
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-q"])
@@ -2,12 +2,31 @@ import os
 import logging
 from typing import List, Dict, Any
 import requests
+from requests.adapters import HTTPAdapter
 
-def search_social_media(query: str, limit: int = 10) -> List[Dict[str, Any]]:
-    """Monitors social media (X/Twitter) for mentions of the brand.
+from ratelimit import LIMITER
+from deadline import request_timeout
+from prompt_compaction import record_usage
+
+SERPAPI_TIMEOUT_SECONDS = 20
+# Resultados orgánicos que Google devuelve por página: ignora `num` y entrega a lo más 10
+SERPAPI_PAGE_SIZE = int(os.environ.get("SERPAPI_PAGE_SIZE", 10))
+
+# Sesión HTTP compartida: reutiliza conexiones TLS entre llamadas (y entre ejecuciones en modo servicio)
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(pool_connections=8, pool_maxsize=16))
+
+# Cláusulas de sitios por fuente (compartidas por las búsquedas y el planificador de consultas)
+SOURCE_CLAUSES = {
+    "financial": "(site:df.cl OR site:elmercurio.com)",
+    "social": "(site:twitter.com OR site:linkedin.com OR site:facebook.com OR site:instagram.com OR site:reddit.com)",
+}
+
+def serpapi_search(query: str, limit: int = 10) -> List[Dict[str, Any]]:
+    """Runs a raw Google query through SerpApi and normalizes the organic results.
     Args:
-        query: Search query (e.g., 'Banco de Chile').
-        limit: Number of results to return.
+        query: Full Google query, including any site: clause.
+        limit: Value for SerpApi's `num` parameter.
     """
     api_key = os.environ.get("SERPAPI_KEY")
     if not api_key:
@@ -16,15 +35,19 @@ def search_social_media(query: str, limit: int = 10) -> List[Dict[str, Any]]:
     url = "https://serpapi.com/search"
     params = {
         "engine": "google",
-        "q": f"(site:twitter.com OR site:linkedin.com OR site:facebook.com OR site:instagram.com OR site:reddit.com) {query}",
+        "q": query,
         "api_key": api_key,
         "num": limit
     }
     
-    try:
-        response = requests.get(url, params=params)
+    def _get():
+        response = SESSION.get(url, params=params, timeout=request_timeout(SERPAPI_TIMEOUT_SECONDS))
         response.raise_for_status()
-        data = response.json()
+        return response
+
+    try:
+        # Cuota compartida entre marcas y procesos (ver ratelimit.py). Sin hedging: cada solicitud es una búsqueda pagada
+        data = LIMITER.call("serpapi", _get, timeout=request_timeout()).json()
         results = []
         for result in data.get("organic_results", []):
             results.append({
@@ -33,46 +56,30 @@ def search_social_media(query: str, limit: int = 10) -> List[Dict[str, Any]]:
                 "snippet": result.get("snippet"),
                 "date": result.get("date") or result.get("time_ago")
             })
-        logging.info(f"📱 SerpApi Social Search for '{query}' found {len(results)} results.")
-        for res in results[:3]: # Log first 3 for verification
-            logging.info(f"   - [Social] {res.get('title')} ({res.get('link')})")
         return results
     except Exception as e:
         logging.error(f"SerpApi failed: {str(e)}")
         return [{"error": str(e)}]
 
+def search_social_media(query: str, limit: int = 10) -> List[Dict[str, Any]]:
+    """Monitors social media (X/Twitter) for mentions of the brand.
+    Args:
+        query: Search query (e.g., 'Banco de Chile').
+        limit: Number of results to return.
+    """
+    results = serpapi_search(f"{SOURCE_CLAUSES['social']} {query}", limit)
+    if results and "error" in results[0]:
+        return results
+    logging.info(f"📱 SerpApi Social Search for '{query}' found {len(results)} results.")
+    for res in results[:3]: # Log first 3 for verification
+        logging.info(f"   - [Social] {res.get('title')} ({res.get('link')})")
+    return results
+
 def search_financial_news(query: str, limit: int = 5) -> List[Dict[str, Any]]:
     """Monitors financial news for mentions of the brand."""
     # Placeholder for actual financial news API (e.g., Bloomberg, NewsAPI)
     # For now, uses Google Search limited to financial sites
-    api_key = os.environ.get("SERPAPI_KEY")
-    if not api_key:
-        return [{"error": "SerpApi key not found."}]
-    
-    url = "https://serpapi.com/search"
-    params = {
-        "engine": "google",
-        "q": f"site:df.cl OR site:elmercurio.com {query}",
-        "api_key": api_key,
-        "num": limit
-    }
-    
-    try:
-        response = requests.get(url, params=params)
-        response.raise_for_status()
-        data = response.json()
-        results = []
-        for result in data.get("organic_results", []):
-            results.append({
-                "title": result.get("title"),
-                "link": result.get("link"),
-                "snippet": result.get("snippet"),
-                "date": result.get("date") or result.get("time_ago")
-            })
-        return results
-    except Exception as e:
-        logging.error(f"SerpApi failed: {str(e)}")
-        return [{"error": str(e)}]
+    return serpapi_search(f"{SOURCE_CLAUSES['financial']} {query}", limit)
 
 def vertex_ai_search(query: str) -> str:
     """Uses Vertex AI Grounding with Google Search for fresh, reliable info.
@@ -87,7 +94,8 @@ def vertex_ai_search(query: str) -> str:
         # Workaround for SDK compatibility with google_search
         tools = [Tool.from_dict({'google_search': {}})]
         
-        response = model.generate_content(query, tools=tools)
+        response = LIMITER.call("vertex", lambda: model.generate_content(query, tools=tools))
+        record_usage("grounding", response)
         return response.text
     except ImportError:
         return "Vertex AI SDK not installed. Fallback to SerpApi."
@@ -97,6 +105,10 @@ def vertex_ai_search(query: str) -> str:
 
 def store_in_bigquery(data: List[Dict[str, Any]]):
     """Stores structured data in BigQuery for Looker Studio dashboards."""
+    # Mention batches (see mentions.py) are exported in chunks to keep memory flat
+    if hasattr(data, "iter_chunks"):
+        results = [store_in_bigquery(chunk.to_records()) for chunk in data.iter_chunks(5000)]
+        return next((r for r in results if r != "Data inserted successfully."), "Data inserted successfully.")
     try:
         from google.cloud import bigquery
         client = bigquery.Client()
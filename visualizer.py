@@ -1,7 +1,13 @@
+import matplotlib
+matplotlib.use("Agg")
 import matplotlib.pyplot as plt
 import io
+import threading
 import matplotlib.dates as mdates
 
+# pyplot mantiene estado global: en modo servicio varias marcas pueden graficar a la vez
+_PLOT_LOCK = threading.Lock()
+
 def generate_trend_chart(history_data: list) -> io.BytesIO:
     """Genera un gráfico PNG de la tendencia del Brand Index."""
     if not history_data:
@@ -10,6 +16,10 @@ def generate_trend_chart(history_data: list) -> io.BytesIO:
     dates = [h['date'] for h in history_data]
     scores = [h['score'] for h in history_data]
 
+    with _PLOT_LOCK:
+        return _render_chart(dates, scores)
+
+def _render_chart(dates, scores) -> io.BytesIO:
     # Configuración de estilo "Corporativo"
     plt.figure(figsize=(8, 3)) # Ancho, Alto
     plt.style.use('bmh') # Estilo limpio
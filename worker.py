@@ -0,0 +1,215 @@
+"""Modo servicio residente (Cloud Run Service).
+
+Mantiene calientes los clientes de Vertex AI, Firestore y HTTP, la
+configuración y los prompts, y ejecuta ciclos de vigilancia por marca bajo
+demanda:
+
+    POST /run            {"brand_id": "banco_estado", "terms": ["Caída BancoEstado"], "notify_empty": false}
+    GET  /runs/<run_id>  Estado de una ejecución
+    GET  /healthz
+
+Uso local (cola en memoria, sin HTTP):
+
+    python worker.py banco_chile banco_estado
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import signal
+import logging
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from config import load_all_brands
+from runtime import Runtime
+from main import run_brand
+from recorder import check_destination
+
+WORKER_THREADS = int(os.environ.get("WORKER_THREADS", 4))
+PER_BRAND_CONCURRENCY = int(os.environ.get("PER_BRAND_CONCURRENCY", 1))
+DRAIN_TIMEOUT_SECONDS = int(os.environ.get("DRAIN_TIMEOUT_SECONDS", 300))
+# Estado de ejecuciones terminadas consultable en GET /runs/<id>: se descarta por antigüedad o por cantidad
+FINISHED_RUN_TTL_SECONDS = int(os.environ.get("FINISHED_RUN_TTL_SECONDS", 24 * 3600))
+MAX_FINISHED_RUNS = 1000
+
+
+class RunQueue:
+    """Cola local de ejecuciones con límite de concurrencia por marca y drenado ordenado.
+
+    Los hilos toman la ejecución pendiente más antigua cuya marca tenga un cupo
+    libre; si ninguna lo tiene, esperan en la condición hasta que termine una
+    ejecución o llegue trabajo nuevo.
+    """
+
+    def __init__(self, runtime: Runtime, brands: dict, workers: int = WORKER_THREADS,
+                 per_brand: int = PER_BRAND_CONCURRENCY, clock=time.time):
+        self.runtime = runtime
+        self.brands = brands
+        self.per_brand = per_brand
+        self.clock = clock
+        self.accepting = True
+        self.runs = {}
+        self._pending = []
+        self._active = {brand_id: 0 for brand_id in brands}
+        self._unfinished = 0
+        self._stopping = False
+        self._cond = threading.Condition()
+        self._threads = [threading.Thread(target=self._work, daemon=True) for _ in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, brand_id: str, terms=None, notify_empty: bool = True) -> str:
+        if not self.accepting:
+            raise RuntimeError("El worker se está drenando, no acepta nuevas ejecuciones.")
+        if brand_id not in self.brands:
+            raise ValueError(f"BRAND_ID '{brand_id}' no encontrado en brands_config.yaml")
+        if terms is not None:
+            # Cada término es una consulta pagada: solo se aceptan los configurados para la marca
+            if not isinstance(terms, list) or not all(isinstance(t, str) for t in terms):
+                raise ValueError("'terms' debe ser una lista de términos")
+            unknown = [t for t in terms if t not in self.brands[brand_id].get('search_terms', [])]
+            if unknown:
+                raise ValueError(f"Términos fuera de search_terms de '{brand_id}': {unknown}")
+
+        run_id = uuid.uuid4().hex[:12]
+        with self._cond:
+            self._evict_finished()
+            self.runs[run_id] = {"brand_id": brand_id, "status": "queued", "terms": terms, "queued_at": self.clock()}
+            self._pending.append((run_id, brand_id, terms, notify_empty))
+            self._unfinished += 1
+            self._cond.notify_all()
+        logging.info(f"📥 Ejecución {run_id} encolada para {brand_id}")
+        return run_id
+
+    def _evict_finished(self):
+        # El servicio vive indefinidamente: solo se conserva el estado de las ejecuciones recientes
+        finished = sorted(((run["finished_at"], run_id) for run_id, run in self.runs.items() if "finished_at" in run),
+                          key=lambda item: item[0])
+        expired = [run_id for finished_at, run_id in finished if self.clock() - finished_at > FINISHED_RUN_TTL_SECONDS]
+        overflow = [run_id for _, run_id in finished[:max(0, len(finished) - MAX_FINISHED_RUNS)]]
+        for run_id in set(expired + overflow):
+            del self.runs[run_id]
+
+    def _next_job(self):
+        with self._cond:
+            while True:
+                if self._stopping:
+                    return None
+                for i, job in enumerate(self._pending):
+                    if self._active[job[1]] < self.per_brand:
+                        del self._pending[i]
+                        self._active[job[1]] += 1
+                        return job
+                self._cond.wait()
+
+    def _work(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+            run_id, brand_id, terms, notify_empty = job
+            run = self.runs[run_id]
+            run.update(status="running", started_at=self.clock())
+            try:
+                run_brand(self.brands[brand_id], self.runtime, terms=terms, notify_empty=notify_empty)
+                run["status"] = "done"
+            except Exception as e:
+                logging.error(f"❌ Ejecución {run_id} ({brand_id}) falló: {e}")
+                run.update(status="failed", error=str(e))
+            finally:
+                with self._cond:
+                    run["finished_at"] = self.clock()
+                    self._active[brand_id] -= 1
+                    self._unfinished -= 1
+                    self._cond.notify_all()
+
+    def drain(self, timeout: float = DRAIN_TIMEOUT_SECONDS) -> bool:
+        """Deja de aceptar trabajo y espera a que terminen las ejecuciones encoladas y en curso."""
+        self.accepting = False
+        logging.info("🧹 Drenando cola de ejecuciones...")
+        with self._cond:
+            drained = self._cond.wait_for(lambda: self._unfinished == 0,
+                                          timeout=None if timeout == float("inf") else timeout)
+            if not drained:
+                logging.warning(f"⚠️ {self._unfinished} ejecuciones sin terminar al cumplirse el drenado")
+            self._stopping = True
+            self._cond.notify_all()
+        return drained
+
+
+def make_handler(run_queue: RunQueue):
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, status: int, payload: dict):
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == "/healthz":
+                return self._reply(200 if run_queue.accepting else 503, {"accepting": run_queue.accepting})
+            if self.path.startswith("/runs/"):
+                run = run_queue.runs.get(self.path[len("/runs/"):])
+                return self._reply(200, run) if run else self._reply(404, {"error": "run not found"})
+            self._reply(404, {"error": "not found"})
+
+        def do_POST(self):
+            if self.path != "/run":
+                return self._reply(404, {"error": "not found"})
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                payload = json.loads(self.rfile.read(length) or b"{}")
+                if not isinstance(payload, dict):
+                    raise ValueError("El cuerpo debe ser un objeto JSON")
+                run_id = run_queue.submit(
+                    payload.get("brand_id", ""),
+                    terms=payload.get("terms"),
+                    notify_empty=payload.get("notify_empty", True),
+                )
+                self._reply(202, {"run_id": run_id})
+            except ValueError as e:
+                self._reply(400, {"error": str(e)})
+            except RuntimeError as e:
+                self._reply(503, {"error": str(e)})
+
+        def log_message(self, format, *args):
+            logging.info(f"🌐 {self.address_string()} {format % args}")
+
+    return Handler
+
+
+def serve(port: int):
+    check_destination()
+    run_queue = RunQueue(Runtime(), load_all_brands())
+    server = ThreadingHTTPServer(("0.0.0.0", port), make_handler(run_queue))
+
+    def shutdown(signum, frame):
+        # Cloud Run envía SIGTERM antes de detener la instancia
+        def _stop():
+            run_queue.drain()
+            server.shutdown()
+        threading.Thread(target=_stop, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+    print(f"🔥 Worker residente escuchando en :{port} ({len(run_queue.brands)} marcas)")
+    server.serve_forever()
+
+
+def run_local(brand_ids):
+    run_queue = RunQueue(Runtime(), load_all_brands())
+    for brand_id in brand_ids:
+        run_queue.submit(brand_id)
+    run_queue.drain(timeout=float("inf"))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) > 1:
+        run_local(sys.argv[1:])
+    else:
+        serve(int(os.environ.get("PORT", 8080)))